@@ -1,12 +1,22 @@
-import uuid
 import os
-from typing import List, Dict, Any, Optional
+import asyncio
+import hashlib
+import itertools
+import math
+import time
+import threading
+from typing import List, Dict, Any, Optional, Sequence
 from datetime import datetime
 from chromadb import HttpClient
 from chromadb.api.models.Collection import Collection
 from dotenv import load_dotenv, find_dotenv
 from app.logger import get_logger
-from app.utils.openai import get_embeddings
+from app.utils.openai import get_embeddings_batch
+from app.utils.chunker import Chunk, iter_chunks
+from app.utils.lexical_index import LexicalIndex, lexical_indexes, reciprocal_rank_fusion
+from app.utils.request_context import RequestContext, embed_query
+from app.utils.singleflight import SingleFlight
+from app.utils.metrics import external_call
 
 logger = get_logger(__name__)
 
@@ -20,91 +30,275 @@ else:
 client = HttpClient(host="localhost", port=8100)
 
 SIMILARITY_THRESHOLD = float(os.getenv("SIMILARITY_THRESHOLD", "0.85"))
+# チャンクの最大サイズと、長い段落を分割する際の重複（いずれもトークン数）
 DEFAULT_CHUNK_SIZE = int(os.getenv("CHUNK_SIZE", "300"))
 DEFAULT_CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", "50"))
+# 1ページあたりに保存するチャンク数の上限（0の場合は制限なし）
+MAX_CHUNKS_PER_PAGE = int(os.getenv("MAX_CHUNKS_PER_PAGE", "0"))
+# 質問と回答に使ったページの対応を保存するコレクション
+QUERY_MAPPING_COLLECTION = os.getenv("QUERY_MAPPING_COLLECTION", "notion_queries")
+# 事前に取り込んだNotionページのベクトルインデックス用コレクション
+PAGE_INDEX_COLLECTION = os.getenv("PAGE_INDEX_COLLECTION", "notion_pages")
+# 他プロセス（取り込みジョブなど）による書き込みを反映するため件数を数え直す間隔（秒）
+COLLECTION_STATS_TTL_SECONDS = float(os.getenv("COLLECTION_STATS_TTL_SECONDS", "30"))
+# 転置インデックス（文字バイグラムのBM25）をベクトル検索と組み合わせるかどうか
+LEXICAL_SEARCH_ENABLED = os.getenv("LEXICAL_SEARCH_ENABLED", "true").lower() == "true"
+# Reciprocal Rank Fusionの定数
+RRF_K = int(os.getenv("RRF_K", "60"))
+# 過去のほぼ同じ質問で使われたページの順位への重み（ベクトル検索・転置インデックスの1位を1とする）
+RRF_QUERY_MAPPING_WEIGHT = float(os.getenv("RRF_QUERY_MAPPING_WEIGHT", "0.5"))
+# 転置インデックスに一致がある場合、クエリのエンベディングを待つ最大時間（秒）
+# 超えた場合やエラーの場合は転置インデックスの結果のみで検索する
+QUERY_EMBEDDING_TIMEOUT = float(os.getenv("QUERY_EMBEDDING_TIMEOUT", "3.0"))
+# 転置インデックスを構築する際にChromaから1回に読み込む件数
+LEXICAL_INDEX_LOAD_BATCH = 1000
+# 転置インデックスを作り直す間隔（秒、件数が変わらない他プロセスでの内容の変更もこの間隔で反映する）
+LEXICAL_INDEX_MAX_AGE_SECONDS = float(os.getenv("LEXICAL_INDEX_MAX_AGE_SECONDS", "600"))
+# 件数のずれや失敗による作り直しの最短間隔（秒）
+LEXICAL_INDEX_MIN_REBUILD_INTERVAL_SECONDS = float(os.getenv("LEXICAL_INDEX_MIN_REBUILD_INTERVAL_SECONDS", "30"))
+# ベクトル検索・転置インデックスの検索結果の最大件数
+SEARCH_N_RESULTS = 20
+
+class CollectionRegistry:
+    """
+    コレクションのハンドルと件数をキャッシュする
+    リクエストごとにコレクション全体を取得せず、件数はcount()で数えて書き込み時に更新する
+    """
+    def __init__(self, chroma_client, stats_ttl: float = COLLECTION_STATS_TTL_SECONDS):
+        self.client = chroma_client
+        self.stats_ttl = stats_ttl
+        self._collections: Dict[str, Collection] = {}
+        self._sizes: Dict[str, int] = {}
+        self._counted_at: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def get(self, name: str) -> Collection:
+        collection = self._collections.get(name)
+        if collection is None:
+            with self._lock:
+                collection = self._collections.get(name)
+                if collection is None:
+                    collection = self.client.get_or_create_collection(name)
+                    self._collections[name] = collection
+        return collection
+
+    def size(self, name: str) -> int:
+        counted_at = self._counted_at.get(name)
+        if counted_at is None or time.monotonic() - counted_at > self.stats_ttl:
+            self.refresh(name)
+        return self._sizes.get(name, 0)
+
+    def refresh(self, name: str) -> int:
+        size = self.get(name).count()
+        self._sizes[name] = size
+        self._counted_at[name] = time.monotonic()
+        return size
+
+    def record_added(self, name: str, count: int) -> None:
+        if name in self._sizes:
+            self._sizes[name] += count
+
+    def invalidate(self, name: str) -> None:
+        with self._lock:
+            self._collections.pop(name, None)
+            self._sizes.pop(name, None)
+            self._counted_at.pop(name, None)
+
+collection_registry = CollectionRegistry(client)
+# 同じページの同じ内容の保存が同時に要求された場合にエンベディングの計算と保存を1回にまとめる
+# 保存の途中で止めるとチャンクが欠けるため、呼び出し元がキャンセルされても最後まで実行する
+chunk_stores = SingleFlight(cancel_when_abandoned=False)
+
+"""
+コレクションから類似したチャンクを検索
+request_contextがあればリクエストごとに1回だけ検索し、prefetch_similar_chunksでまとめて検索済みの結果も使う
+"""
+async def query_similar_chunks(
+    collection: Collection,
+    query_embedding: List[float],
+    n_results: int = SEARCH_N_RESULTS,
+    request_context: Optional[RequestContext] = None
+) -> Dict[str, Any]:
+    def query() -> Dict[str, Any]:
+        with external_call("chroma", "query"):
+            return collection.query(query_embeddings=[query_embedding], n_results=n_results)
+
+    async def run_query() -> Dict[str, Any]:
+        return query()
+
+    if request_context is None:
+        return query()
+    return await request_context.memoize(f"similar_chunks:{collection.name}", run_query)
+
+"""
+複数の質問のベクトル検索と過去の質問との対応の検索を、コレクションごとに1回の問い合わせでまとめて実行する
+結果は各リクエストのコンテキストに保存し、以降のfind_similar_notion_infoはChromaに問い合わせずにそれを使う
+"""
+async def prefetch_similar_chunks(
+    request_contexts: List[RequestContext],
+    collection_names: Sequence[str] = ("notion_info", PAGE_INDEX_COLLECTION),
+    n_results: int = SEARCH_N_RESULTS
+) -> None:
+    if not request_contexts:
+        return
+
+    query_embeddings = await asyncio.gather(*[request_context.query_embedding() for request_context in request_contexts])
+    for collection_name in collection_names:
+        collections = await get_collection_info(collection_name)
+        if not collections["has_data"]:
+            continue
+
+        with external_call("chroma", "query"):
+            results = collections["collection"].query(query_embeddings=list(query_embeddings), n_results=n_results)
+
+        # 質問ごとの結果を、1件の問い合わせの結果と同じ形に分ける
+        for i, request_context in enumerate(request_contexts):
+            request_context.seed(
+                f"similar_chunks:{collection_name}",
+                {key: [results[key][i]] for key in ("ids", "distances", "metadatas", "documents") if results.get(key) is not None}
+            )
+
+    # 過去の質問との対応（失敗した場合は質問ごとの検索にまかせる）
+    try:
+        query_collection = collection_registry.get(QUERY_MAPPING_COLLECTION)
+        with external_call("chroma", "query"):
+            results = query_collection.query(query_embeddings=list(query_embeddings), n_results=1, include=["metadatas", "distances"])
+        for i, request_context in enumerate(request_contexts):
+            request_context.seed("query_mapping", parse_query_mapping(results["metadatas"][i], results["distances"][i]))
+    except Exception as e:
+        logger.warning(f"質問とページの対応の一括検索中にエラー: {str(e)}")
 
 """
 ユーザーの質問とそれに対応するNotion情報のみを保存
+ページのチャンクと、質問からページへの対応は別々に保存する
 """
-async def store_notion_info(user_query: str, notion_info: Dict) -> str:
-    chunk_ids = await store_notion_chunks(user_query, notion_info)
-    return chunk_ids[0] if chunk_ids else str(uuid.uuid4())
+async def store_notion_info(user_query: str, notion_info: Dict, request_context: Optional[RequestContext] = None) -> List[str]:
+    chunk_ids = await store_notion_chunks(notion_info)
+    if chunk_ids:
+        await store_query_mapping(user_query, notion_info.get("page_id") or chunk_ids[0].split(":")[0], request_context)
+    return chunk_ids
 
 """
 chromaから類似情報を検索
-Top-nの中から最もスコアが高いものを採用
+ベクトル検索と転置インデックスの検索結果をReciprocal Rank Fusionで統合し、最も順位の高いページを採用
+エンベディングが取得できない場合は転置インデックスの結果のみを使う
 """
-async def find_similar_notion_info(user_query: str, collections: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+async def find_similar_notion_info(
+    user_query: str,
+    collections: Optional[Dict[str, Any]],
+    request_context: Optional[RequestContext] = None
+) -> Optional[Dict[str, Any]]:
     try:
         notion_collection = collections.get("collection")
 
         # 検索結果の最大件数
-        n_results = 20
-
-        # ユーザークエリから直接クエリを実行
-        query_embedding = await get_embeddings(user_query)
-
-        # 類似したチャンクを検索
-        results = notion_collection.query(
-            query_embeddings=[query_embedding],
-            n_results=n_results
-        )
-
-        if not results or not results.get("ids") or len(results["ids"][0]) == 0:
-            return None
+        n_results = SEARCH_N_RESULTS
+
+        # 転置インデックスから検索（ネットワークを使わない）
+        lexical_hits = []
+        lexical_index = load_lexical_index(notion_collection.name)
+        if lexical_index is not None:
+            lexical_hits = lexical_index.search(user_query, n_results)
+
+        # ユーザークエリのエンベディングを取得
+        # 転置インデックスに一致があれば、時間がかかりすぎる場合は待たずにそちらの結果のみを使う
+        query_embedding = None
+        try:
+            query_embedding = await asyncio.wait_for(
+                embed_query(user_query, request_context),
+                QUERY_EMBEDDING_TIMEOUT if lexical_hits else None
+            )
+        except Exception as e:
+            if not lexical_hits:
+                raise
+            logger.warning(f"エンベディングを取得できないため転置インデックスの結果のみで検索します: {type(e).__name__} {str(e)}")
+
+        distances = []
+        metadatas = []
+        if query_embedding is not None:
+            # 類似したチャンクを検索（まとめて検索済みであればその結果を使う）
+            results = await query_similar_chunks(notion_collection, query_embedding, n_results, request_context)
 
-        # 検索結果の距離（類似度）から類似度を計算
-        distances = results.get("distances", [[]])[0]
-        metadatas = results.get("metadatas", [[]])[0]
+            # 検索結果の距離（類似度）から類似度を計算
+            if results and results.get("ids") and len(results["ids"][0]) > 0:
+                distances = results.get("distances", [[]])[0] or []
+                metadatas = results.get("metadatas", [[]])[0] or []
 
-        if not distances or not metadatas:
+        if not (distances and metadatas) and not lexical_hits:
             logger.info("検索結果が空です")
             return None
 
         # ページIDごとにチャンクをグループ化
         page_chunks = {}
         page_best_similarity = {}
+        vector_ranking = []
+        lexical_ranking = []
 
-        for i, (distance, metadata) in enumerate(zip(distances, metadatas)):
-            # 類似度を計算（距離を類似度に変換）
-            similarity = 1.0 - distance
+        # ページの類似度はベクトル検索のみから求め、転置インデックスの一致率（クエリのトークンの一致率）は別に記録する
+        # チャンクの関連度（参考情報の並び順に使う）には、転置インデックスのみで一致したチャンクは一致率を使う
+        page_lexical_score = {}
+        hits = [(1.0 - distance, metadata, vector_ranking) for distance, metadata in zip(distances, metadatas)]
+        hits += [(coverage, metadata, lexical_ranking) for _, _, coverage, metadata in lexical_hits]
+
+        for similarity, metadata, ranking in hits:
             page_id = metadata.get("notion_page_id", "")
 
             if not page_id:
                 continue
 
-            # ページごとに最高の類似度を記録
-            if page_id not in page_best_similarity or similarity > page_best_similarity[page_id]:
-                page_best_similarity[page_id] = similarity
+            if page_id not in ranking:
+                ranking.append(page_id)
 
-            # ページIDでチャンクをグループ化
-            if page_id not in page_chunks:
-                page_chunks[page_id] = []
+            # ページごとに最高の類似度・一致率を記録
+            scores = page_best_similarity if ranking is vector_ranking else page_lexical_score
+            if page_id not in scores or similarity > scores[page_id]:
+                scores[page_id] = similarity
 
-            # チャンク情報を保存
+            # チャンク情報を保存（同じチャンクは1つにまとめる）
             chunk_info = {
                 "chunk_index": metadata.get("chunk_index", 0),
                 "content": metadata.get("notion_content_chunk", ""),
                 "title": metadata.get("notion_title", ""),
                 "url": metadata.get("notion_url", ""),
                 "similarity": similarity,
-                "query": metadata.get("query", "")
+                "last_edited_time": metadata.get("notion_last_edited_time", "")
             }
-            page_chunks[page_id].append(chunk_info)
+            page_chunks.setdefault(page_id, {}).setdefault(chunk_info["chunk_index"], chunk_info)
 
         # ページがない場合
         if not page_chunks:
             logger.info("有効なページが見つかりませんでした")
             return None
 
-        # 最も類似度の高いページを特定
-        best_page_id = max(page_best_similarity, key=page_best_similarity.get)
-        best_similarity = page_best_similarity[best_page_id]
-
-        logger.info(f"最適なページ {best_page_id} を選択 (類似度: {best_similarity:.2f}, チャンク数: {len(page_chunks[best_page_id])})")
+        # 過去のほぼ同じ質問（類似度がSIMILARITY_THRESHOLD以上）で使われたページが検索結果に含まれていれば、順位を上げる
+        # 質問同士の類似度はページの内容との類似度ではないため、ページの類似度には使わない
+        query_match = await find_query_mapping(query_embedding, request_context) if query_embedding is not None else None
+        if query_match and (query_match["similarity"] < SIMILARITY_THRESHOLD or query_match["page_id"] not in page_chunks):
+            query_match = None
+        mapping_ranking = [query_match["page_id"]] if query_match else []
+
+        # 各ランキングを統合
+        # 過去の質問との対応は1件だけの補助的なランキングのため、重みを下げて実際の検索結果の1位を上回らないようにする
+        fused_scores = reciprocal_rank_fusion(
+            [vector_ranking, lexical_ranking, mapping_ranking], RRF_K, (1.0, 1.0, RRF_QUERY_MAPPING_WEIGHT)
+        )
 
-        # 最適なページのチャンクを順序付けて結合
-        chunks = sorted(page_chunks[best_page_id], key=lambda x: x["chunk_index"])
+        # 統合スコアの高いページから順に、全チャンクを順序通りに取得（上位n件に含まれなかったチャンクも含める）
+        # このコレクションにチャンクがないページは飛ばす
+        chunks = []
+        ranked_pages = sorted(fused_scores, key=fused_scores.get, reverse=True)
+        for best_page_id in ranked_pages:
+            chunks = await get_page_chunks(notion_collection, best_page_id)
+            if not chunks:
+                chunks = sorted(page_chunks.get(best_page_id, {}).values(), key=lambda x: x["chunk_index"])
+            if chunks:
+                break
+        best_similarity = page_best_similarity.get(best_page_id, 0.0)
+
+        logger.debug(
+            "最適なページ %s を選択 (類似度: %.2f, 統合スコア: %.4f, ベクトル: %dページ, 転置インデックス: %dページ, チャンク数: %d)",
+            best_page_id, best_similarity, fused_scores[best_page_id], len(vector_ranking), len(lexical_ranking), len(chunks)
+        )
 
         # ページ情報を構築
         if chunks:
@@ -112,22 +306,29 @@ async def find_similar_notion_info(user_query: str, collections: Optional[Dict[s
             first_chunk = chunks[0]
 
             # すべてのチャンクコンテンツを結合
-            combined_content = "\n".join([chunk["content"] for chunk in chunks])
+            combined_content = merge_chunks([chunk["content"] for chunk in chunks])
 
             notion_info = {
                 "title": first_chunk["title"],
                 "page_id": best_page_id,
                 "url": first_chunk["url"],
-                "content": combined_content
+                "content": combined_content,
+                "last_edited_time": first_chunk["last_edited_time"],
+                # 回答生成の参考情報の候補（最適なページの全チャンクと、他のページで一致したチャンク）
+                "context_chunks": build_context_chunks(best_page_id, chunks, page_chunks, ranked_pages, page_best_similarity)
             }
 
             result = {
                 "notion_info": notion_info,
+                # ベクトル検索による類似度（転置インデックスのみで一致したページは0）
                 "similarity": best_similarity,
-                "original_query": first_chunk["query"]
+                "lexical_score": page_lexical_score.get(best_page_id, 0.0),
+                # エンベディングを取得できず転置インデックスのみで検索した場合はFalse
+                "vector_search": query_embedding is not None,
+                "original_query": query_match["query"] if query_match and query_match["page_id"] == best_page_id else ""
             }
 
-            logger.info(f"チャンクを結合して完全なコンテンツを作成しました (合計 {len(combined_content)} 文字)")
+            logger.debug("チャンクを結合して完全なコンテンツを作成しました (合計 %d 文字)", len(combined_content))
             return result
 
         return None
@@ -136,9 +337,171 @@ async def find_similar_notion_info(user_query: str, collections: Optional[Dict[s
         logger.error(f"Notion情報検索中にエラー: {str(e)}", exc_info=True)
         return None
 
+"""
+回答生成の参考情報の候補となるチャンクを関連度の高いページ順に並べる
+最適なページの一致しなかったチャンクには、そのページで一致したチャンクの最低の類似度を使う
+page_similarity（参照元として返す値）はベクトル検索による類似度のみとする
+"""
+def build_context_chunks(
+    best_page_id: str,
+    best_page_chunks: List[Dict[str, Any]],
+    page_chunks: Dict[str, Dict[int, Dict[str, Any]]],
+    ranked_pages: List[str],
+    page_best_similarity: Dict[str, float]
+) -> List[Dict[str, Any]]:
+    hits = page_chunks.get(best_page_id, {})
+    base_similarity = min((hit["similarity"] for hit in hits.values()), default=page_best_similarity.get(best_page_id, 0.0))
+
+    context_chunks = [
+        {
+            "page_id": best_page_id,
+            "title": chunk["title"],
+            "url": chunk["url"],
+            "last_edited_time": chunk["last_edited_time"],
+            "chunk_index": chunk["chunk_index"],
+            "content": chunk["content"],
+            "similarity": hits[chunk["chunk_index"]]["similarity"] if chunk["chunk_index"] in hits else base_similarity,
+            "page_similarity": page_best_similarity.get(best_page_id, 0.0)
+        }
+        for chunk in best_page_chunks
+    ]
+    for page_id in ranked_pages:
+        if page_id == best_page_id:
+            continue
+        for chunk in sorted(page_chunks.get(page_id, {}).values(), key=lambda x: x["chunk_index"]):
+            context_chunks.append({"page_id": page_id, "page_similarity": page_best_similarity.get(page_id, 0.0), **chunk})
+    return context_chunks
+
+"""
+ページの全チャンクをメタデータのフィルタで取得し、チャンク番号順に並べて返す
+"""
+async def get_page_chunks(collection: Collection, page_id: str) -> List[Dict[str, Any]]:
+    try:
+        results = collection.get(where={"notion_page_id": page_id}, include=["metadatas"])
+    except Exception as e:
+        logger.error(f"ページ '{page_id}' のチャンク取得中にエラー: {str(e)}", exc_info=True)
+        return []
+
+    chunks = [
+        {
+            "chunk_index": metadata.get("chunk_index", 0),
+            "content": metadata.get("notion_content_chunk", ""),
+            "title": metadata.get("notion_title", ""),
+            "url": metadata.get("notion_url", ""),
+            "last_edited_time": metadata.get("notion_last_edited_time", "")
+        }
+        for metadata in results.get("metadatas") or []
+    ]
+    return sorted(chunks, key=lambda x: x["chunk_index"])
+
+# 実行中の転置インデックスの構築（コレクション名ごと）
+lexical_index_builds: Dict[str, asyncio.Task] = {}
+_lexical_index_scheduled_at: Dict[str, float] = {}
+
+"""
+コレクションの構築済みの転置インデックスを取得（リクエストの処理中には構築しない）
+未構築の場合や、他のプロセス（取り込みジョブなど）の書き込みで件数がずれた場合、一定時間が経った場合は
+バックグラウンドで構築し直し、それまでは古いインデックス（未構築ならNone、ベクトル検索のみ）を使う
+"""
+def load_lexical_index(collection_name: str) -> Optional[LexicalIndex]:
+    if not LEXICAL_SEARCH_ENABLED:
+        return None
+
+    index = lexical_indexes.peek(collection_name)
+    try:
+        if (
+            index is None
+            or len(index) != collection_registry.size(collection_name)
+            or time.monotonic() - index.built_at > LEXICAL_INDEX_MAX_AGE_SECONDS
+        ):
+            schedule_lexical_index_build(collection_name)
+    except Exception as e:
+        logger.warning(f"転置インデックスの状態確認中にエラー: {str(e)}")
+    return index
+
+"""
+転置インデックスの構築をバックグラウンドで開始（構築中や、直前に開始した場合は何もしない）
+"""
+def schedule_lexical_index_build(collection_name: str) -> None:
+    if not LEXICAL_SEARCH_ENABLED:
+        return
+
+    running = lexical_index_builds.get(collection_name)
+    if running is not None and not running.done():
+        return
+    now = time.monotonic()
+    if now - _lexical_index_scheduled_at.get(collection_name, -math.inf) < LEXICAL_INDEX_MIN_REBUILD_INTERVAL_SECONDS:
+        return
+    _lexical_index_scheduled_at[collection_name] = now
+
+    task = asyncio.ensure_future(rebuild_lexical_index(collection_name))
+    lexical_index_builds[collection_name] = task
+    task.add_done_callback(
+        lambda done: lexical_index_builds.pop(collection_name, None) if lexical_index_builds.get(collection_name) is done else None
+    )
+
+"""
+Chromaの文書から転置インデックスを別スレッドで構築し、完成してから差し替える
+"""
+async def rebuild_lexical_index(collection_name: str) -> Optional[LexicalIndex]:
+    try:
+        index = await asyncio.to_thread(build_lexical_index, collection_name)
+        lexical_indexes.replace(collection_name, index)
+        logger.info("コレクション '%s' の転置インデックスを構築しました (%d件)", collection_name, len(index))
+        return index
+    except Exception as e:
+        logger.error(f"転置インデックスの構築中にエラー: {str(e)}", exc_info=True)
+        return None
+
+def build_lexical_index(collection_name: str) -> LexicalIndex:
+    index = LexicalIndex()
+    collection = collection_registry.get(collection_name)
+    offset = 0
+    while True:
+        batch = collection.get(include=["documents", "metadatas"], limit=LEXICAL_INDEX_LOAD_BATCH, offset=offset)
+        ids = batch.get("ids") or []
+        if not ids:
+            break
+        index.add(ids, batch.get("documents") or [], batch.get("metadatas") or [])
+        offset += len(ids)
+    index.built_at = time.monotonic()
+    return index
+
+"""
+連続するチャンクを結合
+前のチャンクの末尾と次のチャンクの先頭が重複している場合は重複部分を取り除く
+（重複部分は短い方のチャンクの半分までを探す）
+"""
+def merge_chunks(chunks: List[str], min_overlap: int = 10) -> str:
+    merged = ""
+    for chunk in chunks:
+        if not merged:
+            merged = chunk
+            continue
+
+        overlap = 0
+        for size in range(min(len(merged), len(chunk)) // 2, min_overlap - 1, -1):
+            if merged.endswith(chunk[:size]):
+                overlap = size
+                break
+
+        merged += chunk[overlap:] if overlap else "\n\n" + chunk
+    return merged
+
+"""
+事前に取り込んだページインデックスから類似情報を検索
+クエリのエンベディング1回とベクトル検索1回のみで完結する
+"""
+async def find_indexed_notion_info(user_query: str, request_context: Optional[RequestContext] = None) -> Optional[Dict[str, Any]]:
+    collections = await get_collection_info(PAGE_INDEX_COLLECTION)
+    if not collections["has_data"]:
+        return None
+    return await find_similar_notion_info(user_query, collections, request_context)
+
 async def get_collection_info(collection_name: str = "notion_info") -> Dict[str, Any]:
     """
     指定されたコレクションの情報を取得します。
+    件数はキャッシュされ、書き込み時と一定間隔ごとにのみ数え直します。
 
     Args:
         collection_name: コレクション名
@@ -147,11 +510,8 @@ async def get_collection_info(collection_name: str = "notion_info") -> Dict[str,
         コレクション情報を含む辞書: {"exists": bool, "size": int, "collection": Collection}
     """
     try:
-        collection = client.get_or_create_collection(collection_name)
-        collection_data = collection.get()
-
-        ids = collection_data.get("ids", [])
-        size = len(ids)
+        collection = collection_registry.get(collection_name)
+        size = collection_registry.size(collection_name)
 
         return {
             "exists": True,
@@ -162,6 +522,9 @@ async def get_collection_info(collection_name: str = "notion_info") -> Dict[str,
 
     except Exception as e:
         logger.error(f"コレクション情報取得中にエラー: {str(e)}", exc_info=True)
+        # コレクションが削除・再作成された場合に備えてハンドルを破棄
+        # （転置インデックスは構築し直すまで古いものを使う）
+        collection_registry.invalidate(collection_name)
         return {
             "exists": False,
             "size": 0,
@@ -169,15 +532,60 @@ async def get_collection_info(collection_name: str = "notion_info") -> Dict[str,
             "collection": None
         }
 
+"""
+指定ページのチャンクをコレクションから削除
+"""
+async def delete_page_chunks(page_id: str, collection_name: str = "notion_info") -> None:
+    try:
+        collection = collection_registry.get(collection_name)
+        collection.delete(where={"notion_page_id": page_id})
+        collection_registry.refresh(collection_name)
+        # 構築済みの転置インデックスからもそのページの文書のみ削除
+        lexical_index = lexical_indexes.peek(collection_name)
+        if lexical_index is not None:
+            lexical_index.remove_where("notion_page_id", page_id)
+    except Exception as e:
+        logger.error(f"ページ '{page_id}' のチャンク削除中にエラー: {str(e)}", exc_info=True)
+
+"""
+指定ページがインデックス済みであれば、その最終編集日時を取得
+"""
+async def get_indexed_last_edited_time(page_id: str, collection_name: str = PAGE_INDEX_COLLECTION) -> Optional[str]:
+    try:
+        collection = collection_registry.get(collection_name)
+        existing = collection.get(where={"notion_page_id": page_id}, limit=1, include=["metadatas"])
+        metadatas = existing.get("metadatas") or []
+        if not metadatas:
+            return None
+        return metadatas[0].get("notion_last_edited_time") or None
+    except Exception as e:
+        logger.error(f"ページ '{page_id}' のインデックス状態取得中にエラー: {str(e)}", exc_info=True)
+        return None
+
+"""
+チャンクIDを生成
+ページID・チャンク番号・内容のハッシュから決まるため、同じ内容を保存し直しても同じIDになる
+"""
+def make_chunk_id(page_id: str, chunk_index: int, chunk: str) -> str:
+    content_hash = hashlib.sha256(chunk.encode("utf-8")).hexdigest()[:16]
+    return f"{page_id}:{chunk_index}:{content_hash}"
+
 """
 Notion情報をチャンクに分割して保存
+既に同じ内容で保存済みのチャンクはエンベディングを再計算せず、
+内容が変わって不要になったチャンクは削除する
 Args:
-    user_query: ユーザーからの質問
     notion_info: Notionから取得した情報
+    collection_name: 保存先のコレクション名
 Returns:
-    生成されたチャンクIDのリスト
+    ページを構成するチャンクIDのリスト
 """
-async def store_notion_chunks(user_query: str, notion_info: Dict) -> List[str]:
+async def store_notion_chunks(notion_info: Dict, collection_name: str = "notion_info") -> List[str]:
+    content_hash = hashlib.sha256(notion_info.get("content", "").encode("utf-8")).hexdigest()
+    key = (collection_name, notion_info.get("page_id") or notion_info.get("url", ""), notion_info.get("title", ""), content_hash)
+    return list(await chunk_stores.do(key, lambda: _store_notion_chunks(notion_info, collection_name)))
+
+async def _store_notion_chunks(notion_info: Dict, collection_name: str) -> List[str]:
     try:
         # デフォルト値の使用
         chunk_size = DEFAULT_CHUNK_SIZE
@@ -192,35 +600,38 @@ async def store_notion_chunks(user_query: str, notion_info: Dict) -> List[str]:
                 first_line = content.split("\n")[0][:50]  # 最初の行を最大50文字まで
                 notion_title = first_line
 
-        # コンテンツをチャンクに分割
+        # ページIDがない場合はURLとタイトルから識別子を作る
+        page_id = notion_info.get("page_id") or hashlib.sha256(
+            f"{notion_info.get('url', '')}\n{notion_title}".encode("utf-8")
+        ).hexdigest()[:32]
+
+        # コンテンツをブロック構造に沿ってチャンクに分割
         content = notion_info.get("content", "")
-        chunks = await chunk_text(content, chunk_size, overlap)
+        chunk_iter = iter_chunks(content, chunk_size, overlap)
 
-        # 最大チャンク数を制限
-        max_chunks = 20
-        if len(chunks) > max_chunks:
-            chunks = chunks[:max_chunks]
+        # 最大チャンク数を制限（0の場合は制限なし）
+        if MAX_CHUNKS_PER_PAGE > 0:
+            chunk_iter = itertools.islice(chunk_iter, MAX_CHUNKS_PER_PAGE)
+        chunks = list(chunk_iter)
 
         # チャンクがない場合は空で作成
         if not chunks:
-            chunks = [""]
+            chunks = [Chunk("", "")]
 
         chunk_ids = []
-        embeddings = []
         documents = []
         metadatas = []
 
-        for i, chunk in enumerate(chunks):
+        for i, (chunk, heading) in enumerate(chunks):
             # チャンクIDの生成
-            chunk_id = str(uuid.uuid4())
-            chunk_ids.append(chunk_id)
+            chunk_ids.append(make_chunk_id(page_id, i, chunk))
 
             # メタデータの準備
             metadata = {
-                "query": user_query,
                 "notion_title": notion_title,
-                "notion_page_id": notion_info.get("page_id", ""),
+                "notion_page_id": page_id,
                 "notion_url": notion_info.get("url", ""),
+                "notion_last_edited_time": notion_info.get("last_edited_time", ""),
                 "timestamp": datetime.now().isoformat(),
                 "chunk_index": i,
                 "total_chunks": len(chunks)
@@ -229,27 +640,57 @@ async def store_notion_chunks(user_query: str, notion_info: Dict) -> List[str]:
             # チャンクの内容をメタデータに追加
             metadata["notion_content_chunk"] = chunk
 
-            # 検索用テキスト（ユーザークエリとNotionタイトルを結合）
-            combined_text = f"{user_query}\n{notion_title}\n{chunk}"
-
-            # テキストのエンベディングを取得
-            embedding = await get_embeddings(combined_text)
+            # 検索用テキスト（Notionタイトル・見出しの階層・チャンクを結合）
+            combined_text = "\n".join(part for part in (notion_title, heading, chunk) if part)
 
-            embeddings.append(embedding)
             documents.append(combined_text)
             metadatas.append(metadata)
 
         # Notionコレクションを取得または作成
-        notion_collection = client.get_or_create_collection("notion_info")
-
-        # ChromaDBに保存
-        notion_collection.add(
-            ids=chunk_ids,
-            embeddings=embeddings,
-            documents=documents,
-            metadatas=metadatas
+        notion_collection = collection_registry.get(collection_name)
+
+        # 保存済みのチャンクを確認
+        stored_ids = set(notion_collection.get(where={"notion_page_id": page_id}, include=[]).get("ids", []))
+
+        # 内容が変わって不要になったチャンクを削除
+        current_ids = set(chunk_ids)
+        stale_ids = [chunk_id for chunk_id in stored_ids if chunk_id not in current_ids]
+        if stale_ids:
+            notion_collection.delete(ids=stale_ids)
+
+        # 保存済みのチャンクはメタデータのみ更新
+        existing = [i for i, chunk_id in enumerate(chunk_ids) if chunk_id in stored_ids]
+        if existing:
+            notion_collection.update(
+                ids=[chunk_ids[i] for i in existing],
+                metadatas=[metadatas[i] for i in existing]
+            )
+
+        # 新しいチャンクのみエンベディングを取得してまとめて保存
+        new = [i for i, chunk_id in enumerate(chunk_ids) if chunk_id not in stored_ids]
+        if new:
+            embeddings = await get_embeddings_batch([documents[i] for i in new])
+            notion_collection.upsert(
+                ids=[chunk_ids[i] for i in new],
+                embeddings=embeddings,
+                documents=[documents[i] for i in new],
+                metadatas=[metadatas[i] for i in new]
+            )
+
+        if stale_ids or new:
+            collection_registry.record_added(collection_name, len(new) - len(stale_ids))
+
+        # 構築済みの転置インデックスにも反映
+        lexical_index = lexical_indexes.peek(collection_name)
+        if lexical_index is not None:
+            lexical_index.remove(stale_ids)
+            lexical_index.update_metadatas([chunk_ids[i] for i in existing], [metadatas[i] for i in existing])
+            lexical_index.add([chunk_ids[i] for i in new], [documents[i] for i in new], [metadatas[i] for i in new])
+
+        logger.info(
+            "ページ '%s' のチャンクを保存しました (新規: %d, 既存: %d, 削除: %d)",
+            notion_title, len(new), len(existing), len(stale_ids)
         )
-
         return chunk_ids
 
     except Exception as e:
@@ -257,40 +698,64 @@ async def store_notion_chunks(user_query: str, notion_info: Dict) -> List[str]:
         return []
 
 """
-テキストを指定されたサイズのチャンクに分割
+ユーザーの質問と回答に使ったページの対応を保存
+チャンクとは別のコレクションに保存し、ページの内容を質問ごとに重複して保存しない
 """
-async def chunk_text(text: str, chunk_size: Optional[int] = None, overlap: Optional[int] = None) -> List[str]:
-
-    # デフォルト値の使用
-    chunk_size = chunk_size or DEFAULT_CHUNK_SIZE
-    overlap = overlap or DEFAULT_CHUNK_OVERLAP
-
-    if not text:
-        return [""]
-
-    chunks = []
-    text_length = len(text)
-
-    # テキストが短い場合は分割せずに返す
-    if text_length <= chunk_size:
-        return [text]
-
-    # 重複を考慮してチャンクに分割
-    start = 0
-    while start < text_length:
-        end = start + chunk_size
-
-        # テキストの終わりを超えないように調整
-        if end > text_length:
-            end = text_length
+async def store_query_mapping(user_query: str, page_id: str, request_context: Optional[RequestContext] = None) -> None:
+    try:
+        query_embedding = await embed_query(user_query, request_context)
+        query_collection = collection_registry.get(QUERY_MAPPING_COLLECTION)
+        query_collection.upsert(
+            ids=[hashlib.sha256(normalize_query(user_query).encode("utf-8")).hexdigest()],
+            embeddings=[query_embedding],
+            documents=[user_query],
+            metadatas=[{
+                "query": user_query,
+                "notion_page_id": page_id,
+                "timestamp": datetime.now().isoformat()
+            }]
+        )
+    except Exception as e:
+        logger.error(f"質問とページの対応の保存中にエラー: {str(e)}", exc_info=True)
 
-        chunks.append(text[start:end])
+"""
+過去の質問のうち最も似ているものと、その回答に使ったページを検索
+request_contextを渡すと結果を保存し、同じリクエスト内の2回目以降（ページインデックスの検索など）は問い合わせない
+Returns:
+    {"page_id": str, "similarity": float, "query": str}（見つからない場合はNone）
+"""
+async def find_query_mapping(
+    query_embedding: List[float],
+    request_context: Optional[RequestContext] = None
+) -> Optional[Dict[str, Any]]:
+    async def lookup() -> Optional[Dict[str, Any]]:
+        try:
+            query_collection = collection_registry.get(QUERY_MAPPING_COLLECTION)
+            with external_call("chroma", "query"):
+                results = query_collection.query(query_embeddings=[query_embedding], n_results=1, include=["metadatas", "distances"])
+            return parse_query_mapping(results.get("metadatas", [[]])[0], results.get("distances", [[]])[0])
+        except Exception as e:
+            logger.error(f"質問とページの対応の検索中にエラー: {str(e)}", exc_info=True)
+            return None
 
-        # 次のチャンクの開始位置を計算（重複を考慮）
-        start = end - overlap
+    if request_context is None:
+        return await lookup()
+    return await request_context.memoize("query_mapping", lookup)
 
-        # 終了条件: スタート位置が終了位置を超えるか、テキストの終わりに達した場合
-        if start >= end or end >= text_length:
-            break
+"""
+質問とページの対応の検索結果（1件の質問分）を変換
+"""
+def parse_query_mapping(metadatas: List[Dict[str, Any]], distances: List[float]) -> Optional[Dict[str, Any]]:
+    if not metadatas or not distances:
+        return None
+    return {
+        "page_id": metadatas[0].get("notion_page_id", ""),
+        "similarity": 1.0 - distances[0],
+        "query": metadatas[0].get("query", "")
+    }
 
-    return chunks
+"""
+質問を正規化（前後の空白の除去・連続する空白の圧縮・小文字化）
+"""
+def normalize_query(user_query: str) -> str:
+    return " ".join(user_query.split()).lower()
@@ -1,29 +1,156 @@
+import atexit
+import json
 import logging
+import logging.handlers
 import os
+import queue
+import random
+from contextvars import ContextVar
+from datetime import datetime, timezone
 from typing import Optional
 
+# ログの出力形式（"text" または "json"）
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text").lower()
+# ログの書き出しをバックグラウンドのスレッドで行うかどうか
+LOG_QUEUE_ENABLED = os.getenv("LOG_QUEUE_ENABLED", "true").lower() == "true"
+# 書き出し待ちのログの上限（超えた分は破棄する）
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+# DEBUGログを出力する割合（0〜1、リクエストごとの詳細なログを間引く）
+LOG_DEBUG_SAMPLE_RATE = float(os.getenv("LOG_DEBUG_SAMPLE_RATE", "1.0"))
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - [%(request_id)s] %(message)s'
+# LogRecordが標準で持つ属性（これ以外はextraで渡された項目として出力する）
+RESERVED_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "request_id"}
+
+# 処理中のリクエストのID（リクエストごとに設定し、ログに付与する）
+request_id_var: ContextVar[str] = ContextVar("request_id", default="-")
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+def extra_fields(record: logging.LogRecord) -> dict:
+    return {key: value for key, value in vars(record).items() if key not in RESERVED_ATTRIBUTES}
+
+class RequestIdFilter(logging.Filter):
+    """
+    処理中のリクエストのIDをログに付与し、DEBUGログを指定した割合に間引く
+    """
+    def __init__(self, debug_sample_rate: float = LOG_DEBUG_SAMPLE_RATE):
+        super().__init__()
+        self.debug_sample_rate = debug_sample_rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno <= logging.DEBUG and self.debug_sample_rate < 1.0 and random.random() >= self.debug_sample_rate:
+            return False
+        if not hasattr(record, "request_id"):
+            record.request_id = request_id_var.get()
+        return True
+
+class TextFormatter(logging.Formatter):
+    """
+    従来の形式のログの末尾に、extraで渡された項目を key=value で付け加える
+    """
+    def format(self, record: logging.LogRecord) -> str:
+        message = super().format(record)
+        fields = extra_fields(record)
+        if fields:
+            message += " " + " ".join(f"{key}={json.dumps(value, ensure_ascii=False, default=str)}" for key, value in fields.items())
+        return message
+
+class JsonFormatter(logging.Formatter):
+    """
+    ログを1行のJSONとして出力する（extraで渡された項目もそのまま含める）
+    """
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "timestamp": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "request_id": getattr(record, "request_id", "-")
+        }
+        entry.update(extra_fields(record))
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """
+    ログを整形せずにキューへ入れる（メッセージの組み立てと書き出しはQueueListenerのスレッドで行う）
+    キューが一杯の場合は待たずに破棄する
+    """
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # 例外のトレースバックはフレームが変わる前に文字列にしておく
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
 """
 アプリケーション全体のロギング設定を初期化します
+LOG_QUEUE_ENABLEDが有効な場合はログの整形と書き出しをバックグラウンドのスレッドで行います
 """
 def setup_logger(level: Optional[int] = None):
+    global _listener
+
     # 環境変数からログレベルを取得（設定されていない場合はINFO）
     if level is None:
         log_level_str = os.getenv("LOG_LEVEL", "INFO")
         level = getattr(logging, log_level_str.upper(), logging.INFO)
-    
+
+    # 出力先のハンドラ
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(JsonFormatter() if LOG_FORMAT == "json" else TextFormatter(TEXT_FORMAT))
+
+    # 再設定の場合は前のスレッドを止めてから差し替える
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+    if LOG_QUEUE_ENABLED:
+        log_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+        handler = NonBlockingQueueHandler(log_queue)
+        _listener = logging.handlers.QueueListener(log_queue, stream_handler)
+        _listener.start()
+    else:
+        handler = stream_handler
+    handler.addFilter(RequestIdFilter())
+
     # 基本設定
     logging.basicConfig(
         level=level,
-        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        handlers=[handler],
         force=True  # 既存の設定を上書き
     )
-    
+
     # 各モジュールのログレベルを設定（必要に応じて）
     logging.getLogger("uvicorn").setLevel(logging.WARNING)
     logging.getLogger("fastapi").setLevel(logging.WARNING)
 
+"""
+バックグラウンドのスレッドに残っているログを書き出して止めます
+"""
+def shutdown_logger():
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+atexit.register(shutdown_logger)
+
 """
 指定された名前のロガーを取得します
 """
 def get_logger(name: str):
-    return logging.getLogger(name) 
\ No newline at end of file
+    return logging.getLogger(name)
@@ -1,9 +1,20 @@
 import os
-from fastapi import FastAPI
+import time
+import uuid
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
 from routers.router import router
 from dotenv import load_dotenv
-from app.logger import setup_logger, get_logger
+from app.logger import setup_logger, get_logger, request_id_var
+from app.utils.openai import close_openai_client
+from app.services.refresh import refresh
+from app.db import schedule_lexical_index_build, PAGE_INDEX_COLLECTION
+from app.utils.answer_cache import answer_cache
+from app.utils.embedding_cache import embedding_cache
+from app.utils.admission import admission_controller
+from app.utils.metrics import metrics, setup_tracing, HTTP_REQUEST_DURATION
 
 load_dotenv()
 setup_logger()
@@ -25,8 +36,21 @@ if not os.getenv("SIMILARITY_THRESHOLD"):
 else:
     logger.info(f"SIMILARITY_THRESHOLD環境変数: {os.getenv('SIMILARITY_THRESHOLD')}")
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 転置インデックスはリクエストを待たせないようにバックグラウンドで構築する
+    schedule_lexical_index_build("notion_info")
+    schedule_lexical_index_build(PAGE_INDEX_COLLECTION)
+    yield
+    # 保存済み情報の更新確認を止める
+    await refresh.stop()
+    # エンベディングキャッシュのディスクへの書き込みを終える
+    await embedding_cache.flush()
+    # 共有HTTP接続プールを閉じる
+    await close_openai_client()
+
 # FastAPI初期化
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 # CORS
 app.add_middleware(
@@ -39,3 +63,63 @@ app.add_middleware(
 
 # ルーター登録
 app.include_router(router, prefix="/api")
+
+# OTEL_EXPORTER_OTLP_ENDPOINTが設定されていればトレースを送信
+if setup_tracing(app):
+    logger.info("OpenTelemetryのトレースを有効にしました")
+
+# キャッシュの統計は集計済みの値を出力時に読み取る
+metrics.callback(
+    "devbot_answer_cache_requests_total", "回答キャッシュの検索結果",
+    lambda: {("hit",): answer_cache.hits, ("miss",): answer_cache.misses}, ("result",), "counter"
+)
+metrics.callback(
+    "devbot_embedding_cache_requests_total", "エンベディングキャッシュの検索結果",
+    lambda: {
+        ("memory_hit",): embedding_cache.hits_memory,
+        ("disk_hit",): embedding_cache.hits_disk,
+        ("miss",): embedding_cache.misses
+    },
+    ("result",), "counter"
+)
+metrics.callback("devbot_answer_cache_entries", "回答キャッシュの件数", lambda: {(): answer_cache.stats()["entries"]})
+metrics.callback(
+    "devbot_admission_in_flight", "実行枠ごとの処理中のリクエスト数",
+    lambda: {(budget,): stats["in_flight"] for budget, stats in admission_controller.stats().items()}, ("budget",)
+)
+metrics.callback(
+    "devbot_admission_queue_depth", "実行枠ごとの待機列のリクエスト数",
+    lambda: {(budget,): stats["queue_depth"] for budget, stats in admission_controller.stats().items()}, ("budget",)
+)
+
+"""
+リクエストにIDを割り当ててログに付与し、処理時間をルートごとに記録
+IDはX-Request-IDヘッダがあればそれを使い、レスポンスのヘッダにも返す
+"""
+@app.middleware("http")
+async def record_request_duration(request: Request, call_next):
+    started_at = time.perf_counter()
+    request_id = request.headers.get("x-request-id") or uuid.uuid4().hex[:16]
+    token = request_id_var.set(request_id)
+    status = "500"
+    try:
+        response = await call_next(request)
+        response.headers["X-Request-ID"] = request_id
+        status = str(response.status_code)
+        return response
+    finally:
+        request_id_var.reset(token)
+        route = request.scope.get("route")
+        HTTP_REQUEST_DURATION.observe(
+            time.perf_counter() - started_at,
+            request.method,
+            getattr(route, "path", "unmatched"),
+            status
+        )
+
+"""
+メトリクスをPrometheusのテキスト形式で返す
+"""
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
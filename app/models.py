@@ -1,14 +1,22 @@
 from pydantic import BaseModel
-from typing import Optional
+from typing import Optional, List
 
 class ChatRequest(BaseModel):
     message: str
     session_id: Optional[str] = None
 
+class SourceInfo(BaseModel):
+    title: str
+    url: str
+    page_id: str
+    similarity: float
+
 class NotionChatResponse(BaseModel):
     message: str
     source: Optional[str] = None
     url: Optional[str] = None  # Notionへのリンク
     success: bool = True
     error: Optional[str] = None
-    similarity: Optional[float] = None  # ヒット時の類似度
\ No newline at end of file
+    similarity: Optional[float] = None  # ヒット時の類似度
+    from_cache: bool = False  # 回答キャッシュから返したかどうか
+    sources: List[SourceInfo] = []  # 回答の参考情報に使ったページ
\ No newline at end of file
@@ -1,154 +1,628 @@
 import os
-from typing import Optional, Dict, Any
-from app.db import find_similar_notion_info, store_notion_info, get_collection_info
+import asyncio
+from typing import Optional, Dict, Any, List, Tuple, AsyncIterator
+from app.db import (
+    find_similar_notion_info, find_indexed_notion_info, store_notion_info, get_collection_info, merge_chunks,
+    normalize_query, prefetch_similar_chunks, DEFAULT_CHUNK_SIZE, DEFAULT_CHUNK_OVERLAP, PAGE_INDEX_COLLECTION
+)
 from app.services.notion import notion
+from app.services.refresh import refresh
 from app.logger import get_logger
-from app.utils.openai import generate_completion
+from app.utils.openai import generate_completion, generate_completion_stream, get_embeddings_batch
+from app.utils.answer_cache import answer_cache
+from app.utils.context_builder import PackedContext, build_context, page_candidates
+from app.utils.request_context import RequestContext, embed_query
+from app.utils.singleflight import SingleFlight
+from app.utils.vector import to_unit_vector
+from app.utils.admission import Admission, AdmissionRejected, admission_controller
 
 logger = get_logger(__name__)
 
+COMPLETION_MODEL = "gpt-3.5-turbo-16k"
+SYSTEM_MESSAGE = "あなたはNotionの情報を基にした質問回答システムです。与えられた情報のみに基づいて簡潔に回答してください。"
+# ベクトル検索と並行してNotionの検索を先行して開始するかどうか
+SPECULATIVE_RETRIEVAL = os.getenv("SPECULATIVE_RETRIEVAL", "false").lower() == "true"
+# 先行して実行するNotionの検索の同時実行数の上限（超えた場合は先行せず従来どおり順に検索する）
+SPECULATIVE_MAX_CONCURRENCY = int(os.getenv("SPECULATIVE_MAX_CONCURRENCY", "2"))
+# エンベディングを取得できず転置インデックスのみで検索した場合に、保存済みの情報を使うクエリのトークンの一致率の下限
+LEXICAL_MIN_SCORE = float(os.getenv("LEXICAL_MIN_SCORE", "0.3"))
+# 一括回答で1回に受け付ける質問数の上限
+BATCH_MAX_REQUESTS = int(os.getenv("BATCH_MAX_REQUESTS", "500"))
+# 一括回答で同時に実行する検索・回答生成の数
+BATCH_MAX_CONCURRENCY = int(os.getenv("BATCH_MAX_CONCURRENCY", "8"))
+
 class ChatService:
     def __init__(self):
         self.api_key = os.getenv("OPENAI_API_KEY")
+        # 同じ質問によるNotionの検索と保存が同時に要求された場合に1回にまとめる
+        self.notion_searches = SingleFlight()
+        self.speculative_searches = 0
 
     def check_initialized(self):
         if not self.api_key:
             raise ValueError("OpenAI APIキーが設定されていません")
 
     """
-    Notion情報に基づいて回答を生成
+    質問に関連するNotion情報を検索
     類似度が0.2以下の場合はnotionから新しい情報を取得
+    SPECULATIVE_RETRIEVALが有効な場合はNotionの検索をベクトル検索と並行して開始し、
+    ベクトル検索で見つかった時点で中止する
+    クエリのエンベディングはrequest_contextを通して各段階で使い回す
+    Returns:
+        (Notion情報, 類似度)
     """
-    async def generate_response_with_notion(self, user_query: str) -> Dict[str, Any]:
-        self.check_initialized()
-
+    async def retrieve_notion_info(
+        self,
+        user_query: str,
+        request_context: Optional[RequestContext] = None,
+        admission: Optional[Admission] = None
+    ) -> Tuple[Optional[Dict], float]:
+        request_context = request_context or RequestContext(user_query)
+
+        # 最低類似度閾値
+        min_similarity_threshold = float(os.getenv("MIN_SIMILARITY_THRESHOLD", "0.2"))
+
+        speculative_search = self.start_speculative_search(user_query, request_context)
         try:
-            # 最低類似度閾値
-            min_similarity_threshold = float(os.getenv("MIN_SIMILARITY_THRESHOLD", "0.2"))
+            notion_info, similarity = await self.retrieve_stored_notion_info(user_query, request_context, min_similarity_threshold)
 
-            notion_info = None
-            similarity = 0.0
+            # Notion情報が見つからなければ新たに検索（同じ質問の検索が実行中であればその結果を待つ）
+            # 受付制御を行っている場合は、重い処理用の実行枠を確保してから検索する
+            # （他のリクエストが同じ質問の検索を実行中であれば、その結果を待つだけなので確保しない
+            #   先行して開始した検索がその検索を始めた場合は、このリクエスト自身の検索なので確保する）
+            if not notion_info:
+                search_key = ("search", normalize_query(user_query))
+                search_shared = self.notion_searches.is_running(search_key) and not self.notion_searches.is_leader(
+                    search_key, speculative_search
+                )
+                if admission is not None and not search_shared:
+                    await admission.escalate()
+                notion_info = await self.search_and_store_notion_info(user_query, request_context, speculative_search)
+            elif speculative_search is not None:
+                logger.info("保存済みの情報が見つかったため、先行して開始したNotionの検索を中止します")
+        finally:
+            if speculative_search is not None and not speculative_search.done():
+                speculative_search.cancel()
+
+        return notion_info, similarity
 
-            try:
-                # chromaから取得
+    """
+    保存済みの情報（チャンクのコレクション、事前取り込み済みのページインデックス）から検索
+    見つかった情報はそのまま返し、Notion側で更新されていないかはバックグラウンドで確認する
+    Returns:
+        (Notion情報, 類似度) 最低類似度閾値を超えるものがなければNotion情報はNone
+    """
+    async def retrieve_stored_notion_info(
+        self,
+        user_query: str,
+        request_context: RequestContext,
+        min_similarity_threshold: float
+    ) -> Tuple[Optional[Dict], float]:
+        notion_info = None
+        similarity = 0.0
+
+        try:
+            # chromaから取得
+            with request_context.stage("collection_info"):
                 collections = await get_collection_info("notion_info")
 
-                if collections["has_data"]:
-                    result = await find_similar_notion_info(user_query, collections)
+            if collections["has_data"]:
+                with request_context.stage("vector_search"):
+                    result = await find_similar_notion_info(user_query, collections, request_context)
+                request_context.candidates["notion_info"] = result
 
-                    if result:
-                        similarity = result.get("similarity", 0)
+                if result:
+                    similarity = result.get("similarity", 0)
 
-                        # 類似度が最低閾値を下回る場合はNotionから新しい情報を取得
-                        if similarity <= min_similarity_threshold:
-                            notion_info = None
-                        else:
-                            notion_info = result.get("notion_info")
+                    # 類似度が最低閾値を下回る場合は使わず、Notionから新しい情報を取得
+                    if self.is_relevant(result, min_similarity_threshold):
+                        notion_info = result.get("notion_info")
+                        refresh.schedule(notion_info, "notion_info")
+        except Exception as e:
+            logger.warning(f"Notion情報の検索中にエラー: {str(e)}")
+
+        # 事前取り込み済みのページインデックスを検索
+        if not notion_info:
+            try:
+                with request_context.stage("page_index_search"):
+                    indexed = await find_indexed_notion_info(user_query, request_context)
+                request_context.candidates["page_index"] = indexed
+                if indexed and self.is_relevant(indexed, min_similarity_threshold):
+                    similarity = indexed.get("similarity", 0)
+                    notion_info = indexed.get("notion_info")
+                    refresh.schedule(notion_info, PAGE_INDEX_COLLECTION)
             except Exception as e:
-                logger.warning(f"Notion情報の検索中にエラー: {str(e)}")
+                logger.warning(f"ページインデックスの検索中にエラー: {str(e)}")
 
-            # Notion情報が見つからなければ新たに検索
-            if not notion_info:
-                notion_info = await notion.find_best_matching_content(user_query)
+        return notion_info, similarity
 
-                # 情報をチャンク分割して保存
-                if notion_info:
-                    chunk_ids = await store_notion_info(user_query, notion_info)
-                    logger.info(f"Notion情報を{len(chunk_ids)}チャンクに分割して保存しました")
-                else:
-                    logger.warning("Notionから関連情報が見つかりませんでした")
+    """
+    検索結果を回答に使うかどうか
+    類似度の閾値はベクトル検索の類似度にのみ適用し、転置インデックスの一致率は
+    エンベディングを取得できなかった場合にのみLEXICAL_MIN_SCOREと比べて使う
+    """
+    def is_relevant(self, result: Dict[str, Any], min_similarity_threshold: float) -> bool:
+        if result.get("similarity", 0) > min_similarity_threshold:
+            return True
+        return not result.get("vector_search", True) and result.get("lexical_score", 0) >= LEXICAL_MIN_SCORE
+
+    """
+    Notionの検索を先行して開始する
+    無効な場合や同時実行数の上限に達している場合はNoneを返す
+    """
+    def start_speculative_search(self, user_query: str, request_context: RequestContext) -> Optional[asyncio.Task]:
+        if not SPECULATIVE_RETRIEVAL or self.speculative_searches >= SPECULATIVE_MAX_CONCURRENCY:
+            return None
+
+        self.speculative_searches += 1
+        task = asyncio.ensure_future(self.search_notion(user_query, request_context))
+
+        def release(_):
+            self.speculative_searches -= 1
+
+        task.add_done_callback(release)
+        return task
+
+    """
+    Notionから関連情報を検索（同じ質問の検索が実行中であればその結果を待つ）
+    """
+    async def search_notion(self, user_query: str, request_context: RequestContext) -> Optional[Dict]:
+        return await self.notion_searches.do(
+            ("search", normalize_query(user_query)),
+            lambda: notion.find_best_matching_content(user_query, request_context)
+        )
 
-            # 回答を生成
-            response_text = await self.generate_response(user_query, notion_info)
+    """
+    Notionから関連情報を検索し、見つかった情報をチャンク分割して保存
+    先行して開始した検索があればその結果を使う
+    """
+    async def search_and_store_notion_info(
+        self,
+        user_query: str,
+        request_context: RequestContext,
+        search_task: Optional[asyncio.Task] = None
+    ) -> Optional[Dict]:
+        with request_context.stage("notion_search"):
+            notion_info = await (search_task or self.search_notion(user_query, request_context))
+
+        # 情報をチャンク分割して保存（同じ質問の保存が実行中であればその完了を待つ）
+        if notion_info:
+            with request_context.stage("store"):
+                chunk_ids = await self.notion_searches.do(
+                    ("store", normalize_query(user_query)),
+                    lambda: store_notion_info(user_query, notion_info, request_context)
+                )
+            logger.debug("Notion情報を%dチャンクに分割して保存しました", len(chunk_ids))
+        else:
+            logger.warning("Notionから関連情報が見つかりませんでした")
+
+        return notion_info
 
-            # レスポンスを構築
-            source = notion_info.get("title", "") if notion_info else "情報なし"
-            url = notion_info.get("url", "") if notion_info else ""
+    """
+    Notion情報に基づいて回答を生成
+    混雑している場合は処理を始めずにAdmissionRejectedを送出する
+    """
+    async def generate_response_with_notion(self, user_query: str) -> Dict[str, Any]:
+        self.check_initialized()
 
-            result = {
-                "message": response_text,
-                "source": source,
-                "url": url,
-                "similarity": similarity
-            }
+        request_context = RequestContext(user_query)
+        admission = await admission_controller.admit()
 
-            return result
+        try:
+            notion_info, similarity = await self.retrieve_notion_info(user_query, request_context, admission)
+            return await self.answer_with_notion_info(user_query, notion_info, similarity, request_context)
 
+        except AdmissionRejected:
+            raise
         except Exception as e:
             logger.error(f"レスポンス生成中にエラー: {str(e)}", exc_info=True)
-            return {
-                "message": "エラーが発生しました。",
-                "success": False,
-                "error": str(e),
-                "from_cache": False
-            }
+            return self.build_error_result(e)
+        finally:
+            admission.release()
 
     """
-    Notion情報に基づいてレスポンスを生成
-    チャンク分割された長い情報も適切に処理
+    検索済みのNotion情報から参考情報を組み立てて回答を生成
     """
-    async def generate_response(self, user_query: str, notion_info: Optional[Dict]) -> str:
+    async def answer_with_notion_info(
+        self,
+        user_query: str,
+        notion_info: Optional[Dict],
+        similarity: float,
+        request_context: RequestContext
+    ) -> Dict[str, Any]:
+        context = self.pack_context(notion_info)
+
+        # 回答を生成（似た質問への回答がキャッシュにあれば再利用）
+        with request_context.stage("generate"):
+            response_text, from_cache = await self.generate_response_with_cache(
+                user_query, notion_info, context, request_context
+            )
+        logger.info("回答を生成しました", extra={"timings_ms": request_context.timings_ms(), "from_cache": from_cache})
+
+        return {
+            "message": response_text,
+            **self.build_source_info(notion_info, similarity, context),
+            "from_cache": from_cache
+        }
+
+    def build_error_result(self, error: Exception) -> Dict[str, Any]:
+        return {
+            "message": "エラーが発生しました。",
+            "success": False,
+            "error": str(error),
+            "from_cache": False
+        }
+
+    def build_rejected_result(self, error: AdmissionRejected) -> Dict[str, Any]:
+        return {
+            "message": "混雑しています。しばらく経ってからもう一度お試しください。",
+            "success": False,
+            "error": str(error),
+            "from_cache": False
+        }
+
+    """
+    複数の質問にまとめて回答（結果は入力と同じ順序）
+    エンベディングは1回のAPI呼び出し、ベクトル検索はコレクションごとに1回の問い合わせでまとめて行い、
+    同じ質問は1回だけ処理する
+    同じページを参照する質問は順に回答を生成し、似た質問には回答キャッシュを使えるようにする
+    検索と回答生成はBATCH_MAX_CONCURRENCY件ずつ並行して行い、単独の質問と同じく質問ごとに実行枠を確保する
+    （保存済みの情報で回答できない質問はNotionの検索の前に重い処理用の実行枠に移る）
+    受け付けられなかった質問は混雑を示す結果とし、すべての質問が受け付けられない場合はAdmissionRejectedを送出する
+    """
+    async def generate_batch_responses(self, user_queries: List[str]) -> List[Dict[str, Any]]:
         self.check_initialized()
 
-        if not notion_info:
-            return "関連する情報が見つかりませんでした。もう少し具体的な質問をいただけますか？"
+        # 正規化して同じになる質問は1回だけ処理する
+        request_contexts: Dict[str, RequestContext] = {}
+        for user_query in user_queries:
+            request_contexts.setdefault(normalize_query(user_query), RequestContext(user_query))
+        contexts = list(request_contexts.values())
+        answers: Dict[str, Dict[str, Any]] = {}
 
         try:
-            # コンテンツの長さを確認
-            content = notion_info.get('content', '')
-            if not content:
-                logger.warning("Notion情報のコンテンツが空です")
-                return "取得した情報に本文が含まれていないため、回答を生成できません。検索条件を変更してお試しください。"
+            embeddings = await get_embeddings_batch([request_context.user_query for request_context in contexts])
+            for request_context, embedding in zip(contexts, embeddings):
+                request_context.seed("query_embedding", embedding)
+            await prefetch_similar_chunks(contexts)
+        except Exception as e:
+            # まとめて検索できない場合は質問ごとの検索にまかせる
+            logger.warning(f"一括回答の事前検索中にエラー: {str(e)}")
+
+        semaphore = asyncio.Semaphore(BATCH_MAX_CONCURRENCY)
+        rejections: List[AdmissionRejected] = []
+
+        async def retrieve(key: str, request_context: RequestContext) -> Tuple[str, Optional[Dict], float]:
+            async with semaphore:
+                admission = None
+                try:
+                    admission = await admission_controller.admit()
+                    notion_info, similarity = await self.retrieve_notion_info(request_context.user_query, request_context, admission)
+                    return key, notion_info, similarity
+                except AdmissionRejected as e:
+                    rejections.append(e)
+                    answers[key] = self.build_rejected_result(e)
+                    return key, None, 0.0
+                except Exception as e:
+                    logger.error(f"一括回答の検索中にエラー: {str(e)}", exc_info=True)
+                    answers[key] = self.build_error_result(e)
+                    return key, None, 0.0
+                finally:
+                    if admission is not None:
+                        admission.release()
+
+        retrieved = await asyncio.gather(*[retrieve(key, request_context) for key, request_context in request_contexts.items()])
+        if len(rejections) == len(request_contexts):
+            raise rejections[0]
+
+        # 参照するページごとにまとめる
+        page_groups: Dict[Optional[str], List[Tuple[str, Optional[Dict], float]]] = {}
+        for key, notion_info, similarity in retrieved:
+            if key in answers:
+                continue
+            page_id = notion_info.get("page_id") if notion_info else None
+            page_groups.setdefault(page_id, []).append((key, notion_info, similarity))
+
+        async def answer(key: str, notion_info: Optional[Dict], similarity: float) -> None:
+            async with semaphore:
+                request_context = request_contexts[key]
+                admission = None
+                try:
+                    admission = await admission_controller.admit()
+                    answers[key] = await self.answer_with_notion_info(request_context.user_query, notion_info, similarity, request_context)
+                except AdmissionRejected as e:
+                    answers[key] = self.build_rejected_result(e)
+                except Exception as e:
+                    logger.error(f"一括回答の生成中にエラー: {str(e)}", exc_info=True)
+                    answers[key] = self.build_error_result(e)
+                finally:
+                    if admission is not None:
+                        admission.release()
+
+        async def answer_group(group: List[Tuple[str, Optional[Dict], float]]) -> None:
+            for key, notion_info, similarity in group:
+                await answer(key, notion_info, similarity)
+
+        # 同じページを参照する質問のうち、回答キャッシュにヒットするほど似ている質問だけを順に処理し
+        # （先の回答をキャッシュから再利用できる）、それ以外は並行して処理する
+        # ページを特定できなかった質問は互いに関係しないため並行して処理する
+        unmatched = page_groups.pop(None, [])
+        similar_groups = [
+            similar_group
+            for group in page_groups.values()
+            for similar_group in self.group_similar_queries(group, request_contexts)
+        ]
+        await asyncio.gather(
+            *[answer_group(group) for group in similar_groups],
+            *[answer(key, notion_info, similarity) for key, notion_info, similarity in unmatched]
+        )
+
+        logger.info(
+            "%d件の質問にまとめて回答しました (重複を除いて%d件, %dページ)",
+            len(user_queries), len(request_contexts), len(page_groups)
+        )
+        return [dict(answers[normalize_query(user_query)]) for user_query in user_queries]
 
-            content_length = len(content)
+    """
+    同じページを参照する質問を、クエリのエンベディングの類似度が回答キャッシュの閾値以上のものごとにまとめる
+    各グループの先頭の質問との類似度で判定し、エンベディングがない質問は単独のグループとする
+    """
+    def group_similar_queries(
+        self,
+        group: List[Tuple[str, Optional[Dict], float]],
+        request_contexts: Dict[str, RequestContext]
+    ) -> List[List[Tuple[str, Optional[Dict], float]]]:
+        similar_groups: List[List[Tuple[str, Optional[Dict], float]]] = []
+        # 各グループの先頭の質問の正規化済みエンベディング（ない場合はNone）
+        leaders = []
+        for item in group:
+            embedding = request_contexts[item[0]].peek("query_embedding")
+            vector = to_unit_vector(embedding) if embedding is not None else None
+            similar_group = None
+            if vector is not None:
+                similar_group = next(
+                    (
+                        candidate for leader, candidate in zip(leaders, similar_groups)
+                        if leader is not None and float(leader @ vector) >= answer_cache.similarity_threshold
+                    ),
+                    None
+                )
+            if similar_group is not None:
+                similar_group.append(item)
+            else:
+                leaders.append(vector)
+                similar_groups.append([item])
+        return similar_groups
 
-            # 詳細な内容があるか確認
-            has_detailed_content = content_length > 100
-            content_type = "詳細なページ内容" if has_detailed_content else "データベースの情報"
+    """
+    Notion情報に基づいて回答をストリーミングで生成
+    検索が終わった時点で参照元の情報を返し、その後は生成されたトークンを順次返す
+    admissionには呼び出し元で確保した実行枠を渡し、終了時に返す
+    Yields:
+        {"event": "metadata" | "token" | "done" | "error", "data": dict}
+    """
+    async def stream_response_with_notion(
+        self,
+        user_query: str,
+        admission: Optional[Admission] = None
+    ) -> AsyncIterator[Dict[str, Any]]:
+        request_context = RequestContext(user_query)
 
-            logger.info(f"レスポンス生成に使用するコンテンツ: {content_length}文字")
+        try:
+            self.check_initialized()
+
+            notion_info, similarity = await self.retrieve_notion_info(user_query, request_context, admission)
+            context = self.pack_context(notion_info)
+            yield {"event": "metadata", "data": self.build_source_info(notion_info, similarity, context)}
+
+            page_id = notion_info.get("page_id") if notion_info else None
+            pages = self.cache_pages(notion_info, context) if page_id else {}
+
+            # キャッシュ済みの回答があればまとめて返す
+            query_embedding = None
+            if page_id:
+                try:
+                    query_embedding = await embed_query(user_query, request_context)
+                    cached_answer = answer_cache.lookup(query_embedding, pages)
+                    if cached_answer is not None:
+                        logger.info("回答キャッシュにヒットしました (ページ: %s)", page_id)
+                        yield {"event": "token", "data": {"text": cached_answer}}
+                        yield {"event": "done", "data": {"from_cache": True}}
+                        return
+                except Exception as e:
+                    logger.warning(f"回答キャッシュの検索中にエラー: {str(e)}")
+
+            prompt, error_message = self.build_prompt(user_query, notion_info, context)
+            if prompt is None:
+                yield {"event": "token", "data": {"text": error_message}}
+                yield {"event": "done", "data": {"from_cache": False}}
+                return
+
+            response_text = ""
+            async for token in generate_completion_stream(
+                prompt=prompt,
+                system_message=SYSTEM_MESSAGE,
+                model=COMPLETION_MODEL,
+                temperature=0.7,
+                timeout=30.0
+            ):
+                response_text += token
+                yield {"event": "token", "data": {"text": token}}
 
-            # 長いコンテンツを扱うためのトークン制限を考慮
-            max_content_length = 14000
+            if response_text and query_embedding is not None:
+                answer_cache.store(user_query, query_embedding, pages, response_text)
 
-            if content_length > max_content_length:
-                # コンテンツを切り詰める（先頭部分を優先）
-                truncated_content = content[:max_content_length] + "...(以下省略)"
-            else:
-                truncated_content = content
+            logger.info("ストリーミング応答を生成しました", extra={"timings_ms": request_context.timings_ms()})
+            yield {"event": "done", "data": {"from_cache": False}}
 
-            prompt = f"""
-            ユーザーの質問: {user_query}
+        except AdmissionRejected as e:
+            yield {"event": "error", "data": {"message": "混雑しています。しばらく経ってからもう一度お試しください。", "error": str(e), "retry_after": e.retry_after}}
+        except Exception as e:
+            logger.error(f"ストリーミング応答の生成中にエラー: {str(e)}", exc_info=True)
+            yield {"event": "error", "data": {"message": "エラーが発生しました。", "error": str(e)}}
+        finally:
+            if admission is not None:
+                admission.release()
 
-            参考情報 ({content_type}):
-            タイトル: {notion_info.get('title', '')}
-            内容: {truncated_content}
+    """
+    レスポンスに含める参照元の情報を構築
+    sourcesには参考情報として実際にプロンプトに含めたページを入れる
+    """
+    def build_source_info(self, notion_info: Optional[Dict], similarity: float, context: Optional[PackedContext] = None) -> Dict[str, Any]:
+        return {
+            "source": notion_info.get("title", "") if notion_info else "情報なし",
+            "url": notion_info.get("url", "") if notion_info else "",
+            "similarity": similarity,
+            "sources": context.sources if context else []
+        }
 
-            上記の参考情報に基づいて、ユーザーの質問に対する適切で具体的な回答を生成してください。
-            回答はシンプルで直接的に、かつ参考情報の内容に忠実に作成してください。
-            質問に直接関係する情報がない場合は正直に「この質問に答えるための十分な情報がありません」と伝えてください。
-            回答を始める際に「Notionのデータによると」などのフレーズは不要です。
-            """
+    """
+    検索したチャンクから、トークン数の上限内で回答生成に使う参考情報を組み立てる
+    チャンクの候補がない場合（Notionから直接取得したページなど）はページの内容を分割して使う
+    """
+    def pack_context(self, notion_info: Optional[Dict]) -> Optional[PackedContext]:
+        if not notion_info or not notion_info.get("content"):
+            return None
+
+        candidates = notion_info.get("context_chunks") or page_candidates(notion_info, DEFAULT_CHUNK_SIZE, DEFAULT_CHUNK_OVERLAP)
+        context = build_context(candidates, merge=merge_chunks)
+        logger.debug("参考情報を組み立てました (%dページ, %dトークン)", len(context.sources), context.tokens)
+        return context
+
+    """
+    回答キャッシュのキーにするページIDと最終編集日時
+    プロンプトに含めたすべてのページ（参考情報の各ページと最適なページ）を対象にする
+    """
+    def cache_pages(self, notion_info: Dict, context: Optional[PackedContext]) -> Dict[str, str]:
+        pages = {notion_info["page_id"]: notion_info.get("last_edited_time", "")}
+        for source in context.sources if context else []:
+            pages[source["page_id"]] = source.get("last_edited_time", "")
+        return pages
+
+    """
+    回答キャッシュを確認してからレスポンスを生成
+    参考情報のページがすべて同じ（最終編集日時も同じ）似た質問の回答があれば再利用する
+    Returns:
+        (回答, キャッシュから返したかどうか)
+    """
+    async def generate_response_with_cache(
+        self,
+        user_query: str,
+        notion_info: Optional[Dict],
+        context: Optional[PackedContext] = None,
+        request_context: Optional[RequestContext] = None
+    ) -> Tuple[str, bool]:
+        page_id = notion_info.get("page_id") if notion_info else None
+        if not page_id:
+            response_text, _ = await self._generate_response(user_query, notion_info, context)
+            return response_text, False
+
+        context = context or self.pack_context(notion_info)
+        pages = self.cache_pages(notion_info, context)
+        query_embedding = None
+        try:
+            # 検索時に計算済みのエンベディングを使い回す
+            query_embedding = await embed_query(user_query, request_context)
+            cached_answer = answer_cache.lookup(query_embedding, pages)
+            if cached_answer is not None:
+                logger.info("回答キャッシュにヒットしました (ページ: %s)", page_id)
+                return cached_answer, True
+        except Exception as e:
+            logger.warning(f"回答キャッシュの検索中にエラー: {str(e)}")
+
+        response_text, succeeded = await self._generate_response(user_query, notion_info, context)
+        if succeeded and query_embedding is not None:
+            answer_cache.store(user_query, query_embedding, pages, response_text)
+
+        return response_text, False
+
+    """
+    Notion情報に基づいてレスポンスを生成
+    チャンク分割された長い情報も適切に処理
+    """
+    async def generate_response(self, user_query: str, notion_info: Optional[Dict]) -> str:
+        response_text, _ = await self._generate_response(user_query, notion_info)
+        return response_text
 
-            system_message = "あなたはNotionの情報を基にした質問回答システムです。与えられた情報のみに基づいて簡潔に回答してください。"
+    """
+    レスポンスを生成し、回答の生成に成功したかどうかを合わせて返す
+    """
+    async def _generate_response(
+        self,
+        user_query: str,
+        notion_info: Optional[Dict],
+        context: Optional[PackedContext] = None
+    ) -> Tuple[str, bool]:
+        self.check_initialized()
+
+        try:
+            prompt, error_message = self.build_prompt(user_query, notion_info, context)
+            if prompt is None:
+                return error_message, False
 
             response_text = await generate_completion(
                 prompt=prompt,
-                system_message=system_message,
-                model="gpt-3.5-turbo-16k",
+                system_message=SYSTEM_MESSAGE,
+                model=COMPLETION_MODEL,
                 temperature=0.7,
                 timeout=30.0
             )
 
             if not response_text:
                 logger.error("レスポンス生成に失敗しました")
-                return "回答の生成中にエラーが発生しました。しばらく経ってからもう一度お試しください。"
+                return "回答の生成中にエラーが発生しました。しばらく経ってからもう一度お試しください。", False
 
-            return response_text
+            return response_text, True
 
         except Exception as e:
             logger.error(f"応答生成中にエラー: {str(e)}", exc_info=True)
-            return f"応答の生成中にエラーが発生しました: {str(e)[:100]}... お手数ですが、しばらく経ってからもう一度お試しください。"
+            return f"応答の生成中にエラーが発生しました: {str(e)[:100]}... お手数ですが、しばらく経ってからもう一度お試しください。", False
+
+    """
+    Notion情報から回答生成用のプロンプトを構築
+    参考情報はトークン数の上限内で複数ページの関連するチャンクから組み立てる
+    Returns:
+        (プロンプト, プロンプトを作れない場合にユーザーへ返すメッセージ)
+    """
+    def build_prompt(
+        self,
+        user_query: str,
+        notion_info: Optional[Dict],
+        context: Optional[PackedContext] = None
+    ) -> Tuple[Optional[str], Optional[str]]:
+        if not notion_info:
+            return None, "関連する情報が見つかりませんでした。もう少し具体的な質問をいただけますか？"
+
+        # コンテンツの長さを確認
+        content = notion_info.get('content', '')
+        if not content:
+            logger.warning("Notion情報のコンテンツが空です")
+            return None, "取得した情報に本文が含まれていないため、回答を生成できません。検索条件を変更してお試しください。"
+
+        content_length = len(content)
+
+        # 詳細な内容があるか確認
+        has_detailed_content = content_length > 100
+        content_type = "詳細なページ内容" if has_detailed_content else "データベースの情報"
+
+        # トークン数の上限内で参考情報を組み立てる
+        context = context or self.pack_context(notion_info)
+
+        logger.debug("レスポンス生成に使用するコンテンツ: %d文字 (%dトークン)", len(context.text), context.tokens)
+
+        prompt = f"""
+            ユーザーの質問: {user_query}
+
+            参考情報 ({content_type}):
+            {context.text}
+
+            上記の参考情報に基づいて、ユーザーの質問に対する適切で具体的な回答を生成してください。
+            回答はシンプルで直接的に、かつ参考情報の内容に忠実に作成してください。
+            質問に直接関係する情報がない場合は正直に「この質問に答えるための十分な情報がありません」と伝えてください。
+            回答を始める際に「Notionのデータによると」などのフレーズは不要です。
+            """
+
+        return prompt, None
 
 # シングルトンとしてインスタンスを作成
 chat = ChatService()
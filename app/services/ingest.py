@@ -0,0 +1,170 @@
+import json
+import os
+from typing import Optional, Dict, Any, AsyncIterator
+from app.db import (
+    PAGE_INDEX_COLLECTION,
+    store_notion_chunks,
+    get_indexed_last_edited_time,
+)
+from app.services.notion import notion
+from app.logger import get_logger
+
+logger = get_logger(__name__)
+
+# 差分同期の最終編集日時（ウォーターマーク）を保存するファイル
+SYNC_STATE_PATH = os.getenv("NOTION_SYNC_STATE_PATH", "notion_sync_state.json")
+
+"""
+Notionデータベースを事前に取り込み、ページ単位のベクトルインデックスを構築する
+リクエスト処理中にページ一覧の取得やページごとのエンベディングを行わずに済むようにする
+"""
+class IngestService:
+    def __init__(self, collection_name: str = PAGE_INDEX_COLLECTION, state_path: str = SYNC_STATE_PATH):
+        self.collection_name = collection_name
+        self.state_path = state_path
+
+    """
+    データベースごとのウォーターマークを読み込む
+    """
+    def load_watermark(self, database_id: str) -> Optional[str]:
+        try:
+            with open(self.state_path, "r", encoding="utf-8") as f:
+                state = json.load(f)
+            return state.get(self.collection_name, {}).get(database_id)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning(f"同期状態の読み込みに失敗しました: {str(e)}")
+            return None
+
+    """
+    データベースごとのウォーターマークを保存する
+    """
+    def save_watermark(self, database_id: str, watermark: str) -> None:
+        state = {}
+        try:
+            with open(self.state_path, "r", encoding="utf-8") as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.warning(f"同期状態の読み込みに失敗したため作り直します: {str(e)}")
+
+        state.setdefault(self.collection_name, {})[database_id] = watermark
+
+        # 書き込み途中で壊れないよう一時ファイル経由で置き換える
+        tmp_path = f"{self.state_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(state, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.state_path)
+
+    """
+    1ページ分をインデックスに取り込む
+    最終編集日時が変わっていなければスキップし、変わっていればチャンクを登録し直す
+    ページの内容を取得できなかった場合はRuntimeError（既存のチャンクはそのまま残す）
+    """
+    async def ingest_page(self, page: Dict, force: bool = False) -> Optional[int]:
+        summary = notion.extract_page_content(page)
+        page_id = summary.get("page_id")
+        if not page_id:
+            return None
+
+        last_edited_time = summary.get("last_edited_time", "")
+        if not force and last_edited_time:
+            indexed_time = await get_indexed_last_edited_time(page_id, self.collection_name)
+            if indexed_time == last_edited_time:
+                logger.debug(f"ページ '{page_id}' は更新されていないためスキップします")
+                return None
+
+        detailed = await notion.fetch_page_content(page_id)
+        # 取得に失敗した場合（最終編集日時が空）に登録し直すと、既存のチャンクが不要として削除されてしまう
+        if not detailed.get("last_edited_time"):
+            raise RuntimeError(f"ページ '{page_id}' の内容を取得できませんでした")
+
+        # プロパティの要約を先頭に置き、最初のチャンクがページの概要になるようにする
+        content = "\n".join(part for part in (summary["content"].strip(), detailed.get("content", "").strip()) if part)
+        if not summary["title"].strip() and not content:
+            return None
+
+        page_info = {
+            "page_id": page_id,
+            "title": detailed.get("title") or summary["title"],
+            "url": detailed.get("url") or summary["url"],
+            "content": content,
+            "last_edited_time": detailed.get("last_edited_time") or last_edited_time
+        }
+
+        # 内容の変わったチャンクだけが再エンベディングされ、不要になったチャンクは削除される
+        chunk_ids = await store_notion_chunks(page_info, collection_name=self.collection_name)
+        logger.info("ページ '%s' を%dチャンクとして取り込みました", page_info["title"], len(chunk_ids))
+        return len(chunk_ids)
+
+    """
+    データベース全体を走査してインデックスを構築
+    Returns:
+        取り込み結果の集計: {"pages": int, "ingested": int, "skipped": int, "chunks": int, "failed": int}
+    """
+    async def ingest_database(self, database_id: Optional[str] = None, force: bool = False) -> Dict[str, Any]:
+        stats = {"pages": 0, "ingested": 0, "skipped": 0, "chunks": 0, "failed": 0}
+
+        db_id = database_id or notion.database_id
+        await self._ingest_pages(notion.iter_database_pages(db_id), stats, force=force)
+        self._advance_watermark(db_id, stats)
+
+        logger.info(f"Notionデータベースの取り込みが完了しました: {stats}")
+        return stats
+
+    """
+    前回の同期以降に編集されたページだけを取り込む差分同期
+    ウォーターマークがない場合はデータベース全体を取り込む
+    Returns:
+        取り込み結果の集計（ingest_databaseと同じ形式 + "watermark"）
+    """
+    async def sync_database(self, database_id: Optional[str] = None) -> Dict[str, Any]:
+        db_id = database_id or notion.database_id
+        stats = {"pages": 0, "ingested": 0, "skipped": 0, "chunks": 0, "failed": 0}
+
+        watermark = self.load_watermark(db_id)
+        logger.info(f"差分同期を開始します (ウォーターマーク: {watermark or 'なし'})")
+
+        # Notionの最終編集日時は分単位に丸められるため on_or_after で取得し、
+        # 境界で重複したページはingest_pageの最終編集日時チェックでスキップされる
+        await self._ingest_pages(notion.iter_database_pages(db_id, edited_after=watermark), stats)
+        self._advance_watermark(db_id, stats)
+
+        stats.setdefault("watermark", watermark)
+        logger.info(f"差分同期が完了しました: {stats}")
+        return stats
+
+    """
+    取り込んだページの最終編集日時の最大値までウォーターマークを進める
+    失敗したページがあれば次回に再取得できるよう進めない
+    """
+    def _advance_watermark(self, database_id: str, stats: Dict[str, Any]) -> None:
+        latest_edited_time = stats.pop("latest_edited_time", None)
+        if latest_edited_time and stats["failed"] == 0:
+            stats["watermark"] = latest_edited_time
+            self.save_watermark(database_id, latest_edited_time)
+
+    """
+    ページを取得できた順に取り込む（全ページをメモリに載せない）
+    """
+    async def _ingest_pages(self, pages: AsyncIterator[Dict], stats: Dict[str, Any], force: bool = False) -> None:
+        async for page in pages:
+            stats["pages"] += 1
+            edited_time = page.get("last_edited_time")
+            if edited_time and edited_time > stats.get("latest_edited_time", ""):
+                stats["latest_edited_time"] = edited_time
+            try:
+                chunk_count = await self.ingest_page(page, force=force)
+                if chunk_count is None:
+                    stats["skipped"] += 1
+                else:
+                    stats["ingested"] += 1
+                    stats["chunks"] += chunk_count
+            except Exception as e:
+                stats["failed"] += 1
+                logger.error(f"ページ '{page.get('id', '')}' の取り込み中にエラー: {str(e)}", exc_info=True)
+
+# シングルトンとしてインスタンスを作成
+ingest = IngestService()
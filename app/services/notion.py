@@ -1,17 +1,36 @@
 import os
-from typing import Optional, Dict, List, Any
+import asyncio
+from typing import Optional, Dict, List, Any, AsyncIterator, Callable, Awaitable
 from fastapi import HTTPException
-from notion_client import Client
-from app.db import get_embeddings
+from notion_client import AsyncClient
+from notion_client.errors import HTTPResponseError, RequestTimeoutError
+from app.utils.openai import get_embeddings_each
+from app.utils.request_context import RequestContext, embed_query
 from app.logger import get_logger
+from app.utils.rate_limit import TokenBucket
+from app.utils.vector import to_matrix, to_unit_vector, cosine_scores, top_k
+from app.utils.singleflight import SingleFlight
+from app.utils.metrics import external_call
 
 logger = get_logger(__name__)
 
+# Notion APIのレート制限（平均3リクエスト/秒）に合わせた設定
+NOTION_RATE_LIMIT = float(os.getenv("NOTION_RATE_LIMIT", "3"))
+NOTION_RATE_BURST = float(os.getenv("NOTION_RATE_BURST", "3"))
+NOTION_MAX_CONCURRENCY = int(os.getenv("NOTION_MAX_CONCURRENCY", "3"))
+NOTION_MAX_RETRIES = int(os.getenv("NOTION_MAX_RETRIES", "3"))
+# リトライ対象のステータスコード
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
 class NotionService:
     def __init__(self):
         self.api_key = os.getenv("NOTION_API_KEY")
         self.database_id = os.getenv("NOTION_DATABASE_ID")
-        self.client = Client(auth=self.api_key) if self.api_key else None
+        self.client = AsyncClient(auth=self.api_key) if self.api_key else None
+        self.rate_limiter = TokenBucket(NOTION_RATE_LIMIT, NOTION_RATE_BURST)
+        self.semaphore = asyncio.Semaphore(NOTION_MAX_CONCURRENCY)
+        # 同じページの取得が同時に要求された場合にAPI呼び出しを1回にまとめる
+        self.page_fetches = SingleFlight()
 
     def check_initialized(self):
         if not self.api_key:
@@ -22,43 +41,138 @@ class NotionService:
             raise HTTPException(status_code=500, detail="Notionクライアントの初期化に失敗しました")
 
     """
-    Notionデータベースから情報を取得
+    レート制限と同時実行数の上限を守ってNotion APIを呼び出す
+    429や5xxの場合はRetry-Afterヘッダ（なければ指数バックオフ）に従って再試行する
+    """
+    async def request(self, method: Callable[..., Awaitable[Dict]], *args, **kwargs) -> Dict:
+        operation = getattr(method, "__qualname__", "request")
+        attempt = 0
+        while True:
+            async with self.semaphore:
+                await self.rate_limiter.acquire()
+                try:
+                    with external_call("notion", operation):
+                        return await method(*args, **kwargs)
+                except (HTTPResponseError, RequestTimeoutError) as e:
+                    status = getattr(e, "status", None)
+                    if attempt >= NOTION_MAX_RETRIES or (status is not None and status not in RETRYABLE_STATUSES):
+                        raise
+
+                    retry_after = None
+                    headers = getattr(e, "headers", None)
+                    if headers is not None:
+                        try:
+                            retry_after = float(headers.get("retry-after"))
+                        except (TypeError, ValueError):
+                            retry_after = None
+                    delay = retry_after if retry_after is not None else 0.5 * (2 ** attempt)
+
+                    # レート制限に達した場合は他のリクエストも含めて一時停止する
+                    if status == 429:
+                        self.rate_limiter.pause(delay)
+
+                    attempt += 1
+                    logger.warning(f"Notion APIの呼び出しに失敗したため{delay:.1f}秒後に再試行します ({attempt}/{NOTION_MAX_RETRIES}): {str(e)}")
+
+            await asyncio.sleep(delay)
+
+    """
+    Notionデータベースのページをカーソルを辿りながら順次返す
+    edited_afterを指定した場合はその日時以降に編集されたページのみを返す
     """
-    async def fetch_database_content(self, database_id: Optional[str] = None, query: Optional[Dict] = None) -> List[Dict]:
+    async def iter_database_pages(
+        self,
+        database_id: Optional[str] = None,
+        query: Optional[Dict] = None,
+        edited_after: Optional[str] = None
+    ) -> AsyncIterator[Dict]:
         self.check_initialized()
 
-        try:
-            db_id = database_id or self.database_id
+        db_id = database_id or self.database_id
+
+        # 最終編集日時による絞り込み
+        filters = []
+        if query is not None:
+            filters.append(query)
+        if edited_after:
+            filters.append({
+                "timestamp": "last_edited_time",
+                "last_edited_time": {"on_or_after": edited_after}
+            })
+
+        params = {"database_id": db_id, "page_size": 100}
+        if len(filters) == 1:
+            params["filter"] = filters[0]
+        elif filters:
+            params["filter"] = {"and": filters}
+        if edited_after:
+            # 古い順に取得して途中で失敗しても取りこぼしがないようにする
+            params["sorts"] = [{"timestamp": "last_edited_time", "direction": "ascending"}]
+
+        while True:
+            try:
+                results = await self.request(self.client.databases.query, **params)
+            except Exception as e:
+                raise HTTPException(status_code=500, detail=f"Notionからのデータ取得に失敗: {str(e)}")
 
-            # queryパラメータの処理を修正
-            if query is None:
-                # フィルターなしでクエリ
-                results = self.client.databases.query(database_id=db_id)
-            else:
-                # フィルター付きでクエリ
-                results = self.client.databases.query(
-                    database_id=db_id,
-                    filter=query
-                )
+            for page in results.get("results", []):
+                yield page
 
-            return results["results"]
-        except Exception as e:
-            raise HTTPException(status_code=500, detail=f"Notionからのデータ取得に失敗: {str(e)}")
+            if not results.get("has_more") or not results.get("next_cursor"):
+                break
+            params["start_cursor"] = results["next_cursor"]
+
+    """
+    Notionデータベースから情報を取得
+    edited_afterを指定した場合はその日時以降に編集されたページのみを取得する
+    """
+    async def fetch_database_content(
+        self,
+        database_id: Optional[str] = None,
+        query: Optional[Dict] = None,
+        edited_after: Optional[str] = None
+    ) -> List[Dict]:
+        return [page async for page in self.iter_database_pages(database_id, query, edited_after)]
+
+    """
+    ブロックの子ブロックをカーソルを辿りながらAPIの1ページ分（最大100件）ずつ返す
+    """
+    async def iter_block_children_pages(self, block_id: str) -> AsyncIterator[List[Dict]]:
+        params = {"block_id": block_id, "page_size": 100}
+
+        while True:
+            results = await self.request(self.client.blocks.children.list, **params)
+
+            yield results.get("results", [])
+
+            if not results.get("has_more") or not results.get("next_cursor"):
+                break
+            params["start_cursor"] = results["next_cursor"]
+
+    """
+    ブロックの子ブロックをカーソルを辿りながら順次返す
+    """
+    async def iter_block_children(self, block_id: str) -> AsyncIterator[Dict]:
+        async for blocks in self.iter_block_children_pages(block_id):
+            for block in blocks:
+                yield block
 
     """
     ページIDからページコンテンツを取得
+    同じページの取得が実行中であればその結果を共有する（呼び出し元ごとに辞書はコピーして返す）
     """
     async def fetch_page_content(self, page_id: str) -> Dict[str, Any]:
         self.check_initialized()
+        return dict(await self.page_fetches.do(page_id, lambda: self._fetch_page_content(page_id)))
 
+    async def _fetch_page_content(self, page_id: str) -> Dict[str, Any]:
         try:
-            # ページの基本情報を取得
-            logger.info(f"ページID '{page_id}' の情報を取得します")
-            page = self.client.pages.retrieve(page_id)
-
-            # ページのブロック（コンテンツ）を取得
-            logger.info(f"ページID '{page_id}' のブロックを取得します")
-            blocks = self.client.blocks.children.list(block_id=page_id)
+            # ページの基本情報とブロック（コンテンツ）を並行して取得
+            logger.debug("ページID '%s' の情報とブロックを取得します", page_id)
+            page, content = await asyncio.gather(
+                self.request(self.client.pages.retrieve, page_id),
+                self.fetch_blocks_content(page_id)
+            )
 
             # ページタイトルを取得（可能であれば）
             title = ""
@@ -70,14 +184,12 @@ class NotionService:
                             title += text_item.get("plain_text", "")
                         break
 
-            # ブロックからテキストを抽出
-            content = self.extract_blocks_content(blocks.get("results", []))
-
             return {
                 "page_id": page_id,
                 "title": title,
                 "content": content,
-                "url": page.get("url", "")
+                "url": page.get("url", ""),
+                "last_edited_time": page.get("last_edited_time", "")
             }
         except Exception as e:
             logger.error(f"ページID '{page_id}' の内容取得中にエラー: {str(e)}")
@@ -85,74 +197,106 @@ class NotionService:
                 "page_id": page_id,
                 "title": "",
                 "content": "",
-                "url": ""
+                "url": "",
+                "last_edited_time": ""
             }
 
+    """
+    ブロックIDの子孫ブロックを文書順にたどり、テキストをAPIの1ページ分ずつ順次返す
+    """
+    async def iter_blocks_content(self, block_id: str) -> AsyncIterator[str]:
+        async for blocks in self.iter_block_children_pages(block_id):
+            yield await self.extract_blocks_content(blocks)
+
+    """
+    ブロックIDの子孫ブロックのテキストをまとめて取得
+    """
+    async def fetch_blocks_content(self, block_id: str) -> str:
+        return "".join([text async for text in self.iter_blocks_content(block_id)])
+
     """
     ブロックのリストからテキストコンテンツを抽出
+    子ブロックは並行して取得するため、待ち時間はブロックの数ではなく階層の深さに比例する
     """
-    def extract_blocks_content(self, blocks: List[Dict]) -> str:
-        content = ""
+    async def extract_blocks_content(self, blocks: List[Dict]) -> str:
+        child_block_ids = [block.get("id") for block in blocks if block.get("has_children", False)]
+        child_contents = await asyncio.gather(*[self.fetch_child_blocks_content(block_id) for block_id in child_block_ids])
+        children = dict(zip(child_block_ids, child_contents))
 
+        content = ""
         for block in blocks:
-            block_type = block.get("type", "")
+            content += self.format_block(block)
+
+            # 子ブロックがある場合は親ブロックの直後に追加
+            if block.get("has_children", False):
+                content += children.get(block.get("id"), "")
+
+        return content
+
+    """
+    子ブロックのテキストを取得（失敗した場合は空文字として他のブロックの処理を続ける）
+    """
+    async def fetch_child_blocks_content(self, block_id: str) -> str:
+        try:
+            return await self.fetch_blocks_content(block_id)
+        except Exception as e:
+            logger.error(f"子ブロックの取得中にエラー: {str(e)}")
+            return ""
 
-            if block_type == "paragraph":
-                content += self.extract_rich_text(block.get("paragraph", {}).get("rich_text", [])) + "\n\n"
+    """
+    1ブロック分のテキストを抽出
+    """
+    def format_block(self, block: Dict) -> str:
+        content = ""
+        block_type = block.get("type", "")
 
-            elif block_type == "heading_1":
-                text = self.extract_rich_text(block.get("heading_1", {}).get("rich_text", []))
-                content += f"# {text}\n\n"
+        if block_type == "paragraph":
+            content += self.extract_rich_text(block.get("paragraph", {}).get("rich_text", [])) + "\n\n"
 
-            elif block_type == "heading_2":
-                text = self.extract_rich_text(block.get("heading_2", {}).get("rich_text", []))
-                content += f"## {text}\n\n"
+        elif block_type == "heading_1":
+            text = self.extract_rich_text(block.get("heading_1", {}).get("rich_text", []))
+            content += f"# {text}\n\n"
 
-            elif block_type == "heading_3":
-                text = self.extract_rich_text(block.get("heading_3", {}).get("rich_text", []))
-                content += f"### {text}\n\n"
+        elif block_type == "heading_2":
+            text = self.extract_rich_text(block.get("heading_2", {}).get("rich_text", []))
+            content += f"## {text}\n\n"
 
-            elif block_type == "bulleted_list_item":
-                text = self.extract_rich_text(block.get("bulleted_list_item", {}).get("rich_text", []))
-                content += f"• {text}\n"
+        elif block_type == "heading_3":
+            text = self.extract_rich_text(block.get("heading_3", {}).get("rich_text", []))
+            content += f"### {text}\n\n"
 
-            elif block_type == "numbered_list_item":
-                text = self.extract_rich_text(block.get("numbered_list_item", {}).get("rich_text", []))
-                content += f"1. {text}\n"
+        elif block_type == "bulleted_list_item":
+            text = self.extract_rich_text(block.get("bulleted_list_item", {}).get("rich_text", []))
+            content += f"• {text}\n"
 
-            elif block_type == "to_do":
-                todo_data = block.get("to_do", {})
-                checked = "✅ " if todo_data.get("checked", False) else "☐ "
-                text = self.extract_rich_text(todo_data.get("rich_text", []))
-                content += f"{checked}{text}\n"
+        elif block_type == "numbered_list_item":
+            text = self.extract_rich_text(block.get("numbered_list_item", {}).get("rich_text", []))
+            content += f"1. {text}\n"
 
-            elif block_type == "toggle":
-                text = self.extract_rich_text(block.get("toggle", {}).get("rich_text", []))
-                content += f"▶ {text}\n"
+        elif block_type == "to_do":
+            todo_data = block.get("to_do", {})
+            checked = "✅ " if todo_data.get("checked", False) else "☐ "
+            text = self.extract_rich_text(todo_data.get("rich_text", []))
+            content += f"{checked}{text}\n"
 
-            elif block_type == "code":
-                code_data = block.get("code", {})
-                language = code_data.get("language", "")
-                text = self.extract_rich_text(code_data.get("rich_text", []))
-                content += f"```{language}\n{text}\n```\n\n"
+        elif block_type == "toggle":
+            text = self.extract_rich_text(block.get("toggle", {}).get("rich_text", []))
+            content += f"▶ {text}\n"
 
-            elif block_type == "quote":
-                text = self.extract_rich_text(block.get("quote", {}).get("rich_text", []))
-                content += f"> {text}\n\n"
+        elif block_type == "code":
+            code_data = block.get("code", {})
+            language = code_data.get("language", "")
+            text = self.extract_rich_text(code_data.get("rich_text", []))
+            content += f"```{language}\n{text}\n```\n\n"
 
-            elif block_type == "callout":
-                text = self.extract_rich_text(block.get("callout", {}).get("rich_text", []))
-                emoji = block.get("callout", {}).get("icon", {}).get("emoji", "💡")
-                content += f"{emoji} {text}\n\n"
+        elif block_type == "quote":
+            text = self.extract_rich_text(block.get("quote", {}).get("rich_text", []))
+            content += f"> {text}\n\n"
 
-            # 子ブロックがある場合は再帰的に処理
-            if block.get("has_children", False):
-                try:
-                    child_blocks = self.client.blocks.children.list(block_id=block.get("id"))
-                    child_content = self.extract_blocks_content(child_blocks.get("results", []))
-                    content += child_content
-                except Exception as e:
-                    logger.error(f"子ブロックの取得中にエラー: {str(e)}")
+        elif block_type == "callout":
+            text = self.extract_rich_text(block.get("callout", {}).get("rich_text", []))
+            emoji = block.get("callout", {}).get("icon", {}).get("emoji", "💡")
+            content += f"{emoji} {text}\n\n"
 
         return content
 
@@ -196,20 +340,34 @@ class NotionService:
                 "title": title,
                 "content": content,
                 "page_id": page.get("id"),
-                "url": page.get("url", "")
+                "url": page.get("url", ""),
+                "last_edited_time": page.get("last_edited_time", "")
             }
         except Exception as e:
             logger.error(f"ページコンテンツの抽出中にエラー: {str(e)}")
-            return {"title": "", "content": "", "page_id": page.get("id", ""), "url": page.get("url", "")}
+            return {
+                "title": "",
+                "content": "",
+                "page_id": page.get("id", ""),
+                "url": page.get("url", ""),
+                "last_edited_time": page.get("last_edited_time", "")
+            }
 
     """
     ユーザークエリに関連する候補ページを見つける（簡易的な類似度計算）
     """
-    async def find_candidate_pages(self, user_query: str, notion_data: List[Dict], max_candidates: int = 3) -> List[Dict]:
-        # クエリのエンベディングを取得
-        query_embedding = await get_embeddings(user_query)
+    async def find_candidate_pages(
+        self,
+        user_query: str,
+        notion_data: List[Dict],
+        max_candidates: int = 3,
+        request_context: Optional[RequestContext] = None
+    ) -> List[Dict]:
+        # クエリのエンベディングを取得（リクエスト内で計算済みであれば使い回す）
+        query_embedding = await embed_query(user_query, request_context)
 
         candidates = []
+        combined_texts = []
 
         # 各ページをチェック
         for item in notion_data:
@@ -221,80 +379,95 @@ class NotionService:
                 if not page_content["title"].strip() and not page_content["content"].strip():
                     continue
 
-                # テキストを結合してエンベディング化
-                combined_text = f"{page_content['title']} {page_content['content']}".strip()
-                item_embedding = await get_embeddings(combined_text)
-
-                # コサイン類似度を計算
-                score = self.cosine_similarity(query_embedding, item_embedding)
-                page_content["score"] = score
-
+                # テキストを結合してエンベディング化の対象にする
+                combined_texts.append(f"{page_content['title']} {page_content['content']}".strip())
                 candidates.append(page_content)
 
             except Exception as e:
                 logger.error(f"候補ページの処理中にエラー: {str(e)}")
                 continue
 
-        # スコアで並べ替えて上位の候補を返す
-        candidates.sort(key=lambda x: x.get("score", 0), reverse=True)
-        return candidates[:max_candidates]
+        # 全ページのエンベディングをまとめて取得（取得できなかったページは候補から外す）
+        embedded = [
+            (candidate, embedding)
+            for candidate, embedding in zip(candidates, await get_embeddings_each(combined_texts))
+            if embedding is not None
+        ]
+        candidates = [candidate for candidate, _ in embedded]
+        item_embeddings = [embedding for _, embedding in embedded]
+
+        # 全候補を1回の行列ベクトル積で採点し、上位の候補を返す
+        scores = cosine_scores(query_embedding, to_matrix(item_embeddings))
+        top_candidates = []
+        for index in top_k(scores, max_candidates):
+            candidates[index]["score"] = float(scores[index])
+            top_candidates.append(candidates[index])
+        return top_candidates
 
     """
     候補ページからコンテンツを取得して最適なページを選択
     """
-    async def find_best_page_with_content(self, user_query: str, candidate_pages: List[Dict]) -> Optional[Dict]:
+    async def find_best_page_with_content(
+        self,
+        user_query: str,
+        candidate_pages: List[Dict],
+        request_context: Optional[RequestContext] = None
+    ) -> Optional[Dict]:
         if not candidate_pages:
             logger.info("候補ページがありません")
             return None
 
-        # クエリのエンベディングを取得
-        query_embedding = await get_embeddings(user_query)
+        # クエリのエンベディングを取得（リクエスト内で計算済みであれば使い回す）
+        query_embedding = await embed_query(user_query, request_context)
 
         best_match = None
         best_score = -1
 
-        # 各候補ページの詳細コンテンツを取得して評価
-        for page in candidate_pages:
-            try:
-                page_id = page.get("page_id")
-                if not page_id:
-                    continue
-
-                # ページの詳細コンテンツを取得
-                logger.info(f"ページID '{page_id}' の詳細コンテンツを取得中...")
-                detailed_content = await self.fetch_page_content(page_id)
-
-                # タイトルがない場合は元のタイトルを使用
-                if not detailed_content.get("title") and page.get("title"):
-                    detailed_content["title"] = page.get("title")
-
-                # 詳細なテキストコンテンツで類似度を再計算
-                combined_text = f"{detailed_content['title']} {detailed_content['content']}".strip()
-
-                # 詳細コンテンツが十分にある場合のみ処理
-                if len(combined_text) > 20:
-                    logger.info(f"ページ '{detailed_content['title']}' の詳細コンテンツを使用して類似度を計算中...")
-                    item_embedding = await get_embeddings(combined_text)
+        # 各候補ページの詳細コンテンツを並行して取得
+        pages = [page for page in candidate_pages if page.get("page_id")]
+        logger.debug("%d件の候補ページの詳細コンテンツを取得中...", len(pages))
+        detailed_contents = await asyncio.gather(*[self.fetch_page_content(page["page_id"]) for page in pages])
 
-                    # コサイン類似度を計算
-                    score = self.cosine_similarity(query_embedding, item_embedding)
-                    detailed_content["score"] = score
+        evaluated = []
+        for page, detailed_content in zip(pages, detailed_contents):
+            # タイトルがない場合は元のタイトルを使用
+            if not detailed_content.get("title") and page.get("title"):
+                detailed_content["title"] = page.get("title")
 
-                    logger.info(f"ページ '{detailed_content['title']}' の類似度スコア: {score}")
+            # 詳細なテキストコンテンツで類似度を再計算
+            combined_text = f"{detailed_content['title']} {detailed_content['content']}".strip()
 
-                    if score > best_score:
-                        best_score = score
-                        best_match = detailed_content
-                else:
-                    logger.info(f"ページ '{detailed_content['title']}' の詳細コンテンツが不十分です")
-
-            except Exception as e:
-                logger.error(f"詳細ページの処理中にエラー: {str(e)}")
-                continue
+            # 詳細コンテンツが十分にある場合のみ処理
+            if len(combined_text) > 20:
+                evaluated.append((detailed_content, combined_text))
+            else:
+                logger.debug("ページ '%s' の詳細コンテンツが不十分です", detailed_content['title'])
+
+        # まとめて取得できなかった場合は1件ずつ取得し、取得できなかったページのみ飛ばす
+        embedded = [
+            (page, embedding)
+            for page, embedding in zip(evaluated, await get_embeddings_each([combined_text for _, combined_text in evaluated]))
+            if embedding is not None
+        ]
+        if len(embedded) < len(evaluated):
+            logger.error("%d件の詳細ページのエンベディングを取得できなかったため飛ばします", len(evaluated) - len(embedded))
+        evaluated = [page for page, _ in embedded]
+        item_embeddings = [embedding for _, embedding in embedded]
+
+        # コサイン類似度をまとめて計算
+        scores = cosine_scores(query_embedding, to_matrix(item_embeddings))
+        for (detailed_content, _), score in zip(evaluated, scores.tolist()):
+            detailed_content["score"] = score
+
+            logger.debug("ページ '%s' の類似度スコア: %s", detailed_content['title'], score)
+
+            if score > best_score:
+                best_score = score
+                best_match = detailed_content
 
         # スコアが低すぎる場合は関連情報なしとする
         if best_score < 0.3:
-            logger.info(f"最高スコア ({best_score}) が閾値を下回っているため関連情報なしとします")
+            logger.info("最高スコア (%s) が閾値を下回っているため関連情報なしとします", best_score)
             return None
 
         return best_match
@@ -303,12 +476,7 @@ class NotionService:
     ベクトル間のコサイン類似度を計算
     """
     def cosine_similarity(self, vec1: List[float], vec2: List[float]) -> float:
-        dot_product = sum(a * b for a, b in zip(vec1, vec2))
-        magnitude1 = sum(a * a for a in vec1) ** 0.5
-        magnitude2 = sum(b * b for b in vec2) ** 0.5
-        if magnitude1 * magnitude2 == 0:
-            return 0
-        return dot_product / (magnitude1 * magnitude2)
+        return float(to_unit_vector(vec1) @ to_unit_vector(vec2))
 
     """
     クエリに最も関連するコンテンツを検索する統合メソッド
@@ -317,19 +485,21 @@ class NotionService:
     3. 候補ページの詳細コンテンツを取得
     4. 詳細コンテンツで再度類似度を計算して最適なページを選択
     """
-    async def find_best_matching_content(self, user_query: str) -> Optional[Dict]:
+    async def find_best_matching_content(self, user_query: str, request_context: Optional[RequestContext] = None) -> Optional[Dict]:
         try:
             # データを取得
             notion_data = await self.fetch_database_content()
 
             # 候補ページを絞り込み
-            candidate_pages = await self.find_candidate_pages(user_query, notion_data, max_candidates=3)
+            candidate_pages = await self.find_candidate_pages(user_query, notion_data, max_candidates=3, request_context=request_context)
+            if request_context is not None:
+                request_context.candidates["notion_pages"] = candidate_pages
 
             # 最適なページを選択
-            best_match = await self.find_best_page_with_content(user_query, candidate_pages)
+            best_match = await self.find_best_page_with_content(user_query, candidate_pages, request_context)
 
             if best_match:
-                logger.info(f"最適なページが見つかりました: '{best_match['title']}'")
+                logger.info("最適なページが見つかりました: '%s'", best_match["title"])
             else:
                 logger.info("関連するコンテンツが見つかりませんでした")
 
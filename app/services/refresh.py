@@ -0,0 +1,165 @@
+import os
+import time
+import asyncio
+from collections import OrderedDict
+from typing import Dict, Optional, Set, Tuple
+from notion_client.errors import HTTPResponseError
+from app.db import store_notion_chunks, delete_page_chunks
+from app.services.notion import notion
+from app.services.ingest import ingest
+from app.logger import get_logger
+from app.utils.answer_cache import answer_cache
+from app.utils.rate_limit import TokenBucket
+
+logger = get_logger(__name__)
+
+# 保存済みの情報を返した後にNotion側の更新を確認するかどうか
+REFRESH_ENABLED = os.getenv("REFRESH_ENABLED", "true").lower() == "true"
+# 同じページの更新を確認する最短の間隔（秒）
+REFRESH_CHECK_INTERVAL_SECONDS = float(os.getenv("REFRESH_CHECK_INTERVAL_SECONDS", "300"))
+# 更新確認の頻度の上限（1秒あたりのページ数）
+REFRESH_RATE = float(os.getenv("REFRESH_RATE", "0.5"))
+# 更新確認を待つページ数の上限（超えた分は次に参照されたときに確認する）
+REFRESH_QUEUE_SIZE = int(os.getenv("REFRESH_QUEUE_SIZE", "100"))
+
+"""
+保存済みのNotion情報をリクエストにはそのまま返し、Notion側で更新されていないかをバックグラウンドで確認する
+更新されていれば取り込み直し、削除・アーカイブされていれば保存済みのチャンクを削除する
+"""
+class RefreshService:
+    def __init__(
+        self,
+        check_interval: float = REFRESH_CHECK_INTERVAL_SECONDS,
+        rate: float = REFRESH_RATE,
+        queue_size: int = REFRESH_QUEUE_SIZE
+    ):
+        self.check_interval = check_interval
+        self.rate_limiter = TokenBucket(rate, 1)
+        self.queue_size = queue_size
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._queued: Set[Tuple[str, str]] = set()
+        # 確認した順に並べ、確認の間隔を過ぎたものは先頭から削除する
+        self._checked_at: "OrderedDict[Tuple[str, str], float]" = OrderedDict()
+        self.stats = {"checked": 0, "refreshed": 0, "deleted": 0, "dropped": 0, "failed": 0}
+
+    """
+    返したページの更新確認を予約する
+    最近確認したページや予約済みのページは予約しない
+    """
+    def schedule(self, notion_info: Optional[Dict], collection_name: str) -> None:
+        if not REFRESH_ENABLED or not notion_info or not notion_info.get("page_id"):
+            return
+
+        key = (collection_name, notion_info["page_id"])
+        checked_at = self._checked_at.get(key)
+        if key in self._queued or (checked_at is not None and time.monotonic() - checked_at < self.check_interval):
+            return
+
+        self.start()
+        try:
+            self._queue.put_nowait((key, notion_info.get("last_edited_time", "")))
+            self._queued.add(key)
+        except asyncio.QueueFull:
+            self.stats["dropped"] += 1
+
+    """
+    更新確認を行うバックグラウンドタスクを開始（開始済みであれば何もしない）
+    """
+    def start(self) -> None:
+        if self._worker is not None and not self._worker.done():
+            return
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        self._queued.clear()
+        self._worker = asyncio.ensure_future(self._run())
+
+    """
+    バックグラウンドタスクを停止
+    """
+    async def stop(self) -> None:
+        if self._worker is None:
+            return
+        self._worker.cancel()
+        try:
+            await self._worker
+        except asyncio.CancelledError:
+            pass
+        self._worker = None
+
+    async def _run(self) -> None:
+        while True:
+            key, last_edited_time = await self._queue.get()
+            try:
+                await self.rate_limiter.acquire()
+                await self.refresh_page(key[1], key[0], last_edited_time)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.stats["failed"] += 1
+                logger.error(f"ページ '{key[1]}' の更新確認中にエラー: {str(e)}", exc_info=True)
+            finally:
+                self._queued.discard(key)
+                self._record_checked(key)
+                self._queue.task_done()
+
+    """
+    ページを確認した時刻を記録し、確認の間隔を過ぎた記録を削除する
+    """
+    def _record_checked(self, key: Tuple[str, str]) -> None:
+        now = time.monotonic()
+        self._checked_at[key] = now
+        self._checked_at.move_to_end(key)
+        while self._checked_at:
+            oldest_key, checked_at = next(iter(self._checked_at.items()))
+            if now - checked_at < self.check_interval:
+                break
+            del self._checked_at[oldest_key]
+
+    """
+    ページの最終編集日時を確認し、変わっていれば取り込み直す
+    Returns:
+        取り込み直した・削除した場合はTrue
+    """
+    async def refresh_page(self, page_id: str, collection_name: str, last_edited_time: str) -> bool:
+        notion.check_initialized()
+        self.stats["checked"] += 1
+
+        try:
+            page = await notion.request(notion.client.pages.retrieve, page_id)
+        except HTTPResponseError as e:
+            if getattr(e, "status", None) != 404:
+                raise
+            page = {"archived": True}
+
+        # 削除・アーカイブされたページは保存済みのチャンクを削除する
+        if page.get("archived") or page.get("in_trash"):
+            await delete_page_chunks(page_id, collection_name)
+            answer_cache.invalidate_page(page_id)
+            self.stats["deleted"] += 1
+            logger.info("ページ '%s' は削除されたため保存済みのチャンクを削除しました", page_id)
+            return True
+
+        if page.get("last_edited_time", "") == last_edited_time:
+            return False
+
+        # ページインデックスは取り込み時と同じ形式で、それ以外は検索時と同じ形式で保存し直す
+        # どちらも内容を取得できなかった場合は保存済みのチャンクを残したままRuntimeErrorとする
+        if collection_name == ingest.collection_name:
+            if await ingest.ingest_page(page, force=True) is None:
+                return False
+        else:
+            page_info = await notion.fetch_page_content(page_id)
+            if not page_info.get("last_edited_time"):
+                raise RuntimeError("ページの内容を取得できませんでした")
+            await store_notion_chunks(page_info, collection_name=collection_name)
+
+        answer_cache.invalidate_page(page_id)
+        self.stats["refreshed"] += 1
+        logger.info(
+            "ページ '%s' が更新されていたため取り込み直しました (%s → %s)",
+            page_id, last_edited_time or "なし", page.get("last_edited_time", "")
+        )
+        return True
+
+# シングルトンとしてインスタンスを作成
+refresh = RefreshService()
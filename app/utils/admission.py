@@ -0,0 +1,161 @@
+import os
+import math
+import time
+import asyncio
+from collections import deque
+from typing import Deque, Dict, Optional
+from app.utils.metrics import ADMISSION_REJECTED, ADMISSION_WAIT
+
+# 同時に処理するリクエスト数と待機列の上限による受付制御を行うかどうか
+ADMISSION_ENABLED = os.getenv("ADMISSION_ENABLED", "true").lower() == "true"
+# 保存済みの情報で回答できるリクエスト（軽い処理）の同時実行数と待機列の上限
+ADMISSION_HIT_MAX_CONCURRENCY = int(os.getenv("ADMISSION_HIT_MAX_CONCURRENCY", "32"))
+ADMISSION_HIT_MAX_QUEUE = int(os.getenv("ADMISSION_HIT_MAX_QUEUE", "64"))
+# Notionの検索が必要なリクエスト（重い処理）の同時実行数と待機列の上限
+ADMISSION_MISS_MAX_CONCURRENCY = int(os.getenv("ADMISSION_MISS_MAX_CONCURRENCY", "4"))
+ADMISSION_MISS_MAX_QUEUE = int(os.getenv("ADMISSION_MISS_MAX_QUEUE", "16"))
+# 待機列で待つ時間の上限（秒）
+ADMISSION_QUEUE_TIMEOUT_SECONDS = float(os.getenv("ADMISSION_QUEUE_TIMEOUT_SECONDS", "5"))
+
+class AdmissionRejected(Exception):
+    """
+    混雑のためリクエストを受け付けなかった
+    待機列が一杯の場合は429、待機列で待ちきれなかった場合は503とし、再試行までの目安の秒数を持つ
+    """
+    def __init__(self, budget: str, status_code: int, retry_after: int, reason: str):
+        super().__init__(f"混雑しているためリクエストを受け付けられませんでした ({budget}: {reason})")
+        self.budget = budget
+        self.status_code = status_code
+        self.retry_after = retry_after
+        self.reason = reason
+
+class AdmissionLimiter:
+    """
+    同時実行数の上限を超えたリクエストを上限付きの待機列で先着順に待たせる
+    待機列が一杯の場合は待たずに拒否し、待機列で一定時間待っても順番が来ない場合も拒否する
+    """
+    def __init__(self, name: str, max_concurrency: int, max_queue: int, queue_timeout: float = ADMISSION_QUEUE_TIMEOUT_SECONDS):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.active = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+        # 1リクエストあたりの処理時間の移動平均（再試行までの目安の計算に使う）
+        self._service_time = 1.0
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._waiters)
+
+    def retry_after(self) -> int:
+        """
+        待機中のリクエストが処理されるまでの目安の秒数
+        """
+        return max(1, math.ceil(self._service_time * (len(self._waiters) + 1) / max(self.max_concurrency, 1)))
+
+    async def acquire(self) -> None:
+        if self.active < self.max_concurrency and not self._waiters:
+            self.active += 1
+            return
+
+        if len(self._waiters) >= self.max_queue:
+            ADMISSION_REJECTED.inc(1.0, self.name, "queue_full")
+            raise AdmissionRejected(self.name, 429, self.retry_after(), "queue_full")
+
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.append(future)
+        started_at = time.perf_counter()
+        try:
+            # 順番が来るとreleaseから実行枠が引き渡される
+            await asyncio.wait_for(future, self.queue_timeout)
+        except asyncio.TimeoutError:
+            self._remove(future)
+            ADMISSION_REJECTED.inc(1.0, self.name, "queue_timeout")
+            raise AdmissionRejected(self.name, 503, self.retry_after(), "queue_timeout")
+        except asyncio.CancelledError:
+            self._remove(future)
+            # 引き渡された直後にキャンセルされた場合は実行枠を返す
+            if future.done() and not future.cancelled():
+                self.release()
+            raise
+        finally:
+            ADMISSION_WAIT.observe(time.perf_counter() - started_at, self.name)
+
+    def release(self, service_time: Optional[float] = None) -> None:
+        if service_time is not None:
+            self._service_time = 0.9 * self._service_time + 0.1 * service_time
+
+        # 待っているリクエストがあれば実行枠をそのまま引き渡す
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.active -= 1
+
+    def _remove(self, future: asyncio.Future) -> None:
+        try:
+            self._waiters.remove(future)
+        except ValueError:
+            pass
+
+class Admission:
+    """
+    1回のリクエストが確保している実行枠
+    保存済みの情報で回答できなかった場合はescalateで重い処理用の実行枠に移る
+    """
+    def __init__(self, controller: "AdmissionController"):
+        self.controller = controller
+        self.limiter: Optional[AdmissionLimiter] = None
+        self._acquired_at = 0.0
+
+    async def enter(self, limiter: AdmissionLimiter) -> None:
+        self.release()
+        await limiter.acquire()
+        self.limiter = limiter
+        self._acquired_at = time.perf_counter()
+
+    async def escalate(self) -> None:
+        """
+        Notionの検索に進む前に、軽い処理用の実行枠を返して重い処理用の実行枠を確保する
+        """
+        if self.controller.enabled and self.limiter is not self.controller.miss:
+            await self.enter(self.controller.miss)
+
+    def release(self) -> None:
+        if self.limiter is not None:
+            self.limiter.release(time.perf_counter() - self._acquired_at)
+            self.limiter = None
+
+class AdmissionController:
+    """
+    保存済みの情報で回答できるリクエストと、Notionの検索が必要なリクエストで別々の実行枠を管理する
+    重いリクエストが詰まっても、保存済みの情報で回答できるリクエストは待たされない
+    """
+    def __init__(self, hit: AdmissionLimiter, miss: AdmissionLimiter, enabled: bool = ADMISSION_ENABLED):
+        self.hit = hit
+        self.miss = miss
+        self.enabled = enabled
+
+    async def admit(self) -> Admission:
+        """
+        軽い処理用の実行枠を確保する（受け付けられない場合はAdmissionRejected）
+        使い終わったらAdmission.releaseを呼び出す
+        """
+        admission = Admission(self)
+        if self.enabled:
+            await admission.enter(self.hit)
+        return admission
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        return {
+            limiter.name: {"in_flight": limiter.active, "queue_depth": limiter.queue_depth}
+            for limiter in (self.hit, self.miss)
+        }
+
+# シングルトンとしてインスタンスを作成
+admission_controller = AdmissionController(
+    AdmissionLimiter("hit", ADMISSION_HIT_MAX_CONCURRENCY, ADMISSION_HIT_MAX_QUEUE),
+    AdmissionLimiter("miss", ADMISSION_MISS_MAX_CONCURRENCY, ADMISSION_MISS_MAX_QUEUE)
+)
@@ -0,0 +1,124 @@
+import os
+import time
+import itertools
+from collections import OrderedDict
+from typing import List, Dict, Optional, Sequence
+import numpy as np
+from app.utils.vector import to_unit_vector
+
+# 回答を再利用するクエリ同士の類似度の下限（未設定の場合はSIMILARITY_THRESHOLDを使用）
+ANSWER_CACHE_SIMILARITY_THRESHOLD = float(
+    os.getenv("ANSWER_CACHE_SIMILARITY_THRESHOLD", os.getenv("SIMILARITY_THRESHOLD", "0.85"))
+)
+ANSWER_CACHE_TTL_SECONDS = float(os.getenv("ANSWER_CACHE_TTL_SECONDS", "3600"))
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "1000"))
+
+class AnswerCache:
+    """
+    生成済みの回答をクエリのエンベディングとともに保持し、
+    同じページ群を参考情報にした十分に似た質問には回答を再利用する
+    参考情報のいずれかのページの最終編集日時が変わった場合やTTLを過ぎた場合は再利用しない
+    """
+    def __init__(
+        self,
+        similarity_threshold: float = ANSWER_CACHE_SIMILARITY_THRESHOLD,
+        ttl_seconds: float = ANSWER_CACHE_TTL_SECONDS,
+        max_entries: int = ANSWER_CACHE_MAX_ENTRIES
+    ):
+        self.similarity_threshold = similarity_threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[int, Dict]" = OrderedDict()
+        self._page_index: Dict[str, List[int]] = {}
+        self._ids = itertools.count()
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, query_embedding: Sequence[float], pages: Dict[str, str]) -> Optional[str]:
+        """
+        キャッシュ済みの回答を検索
+
+        Args:
+            query_embedding: 新しいクエリのエンベディング
+            pages: 回答の根拠となるページIDと最終編集日時（参考情報に含めたすべてのページ）
+
+        Returns:
+            再利用できる回答（なければNone）
+        """
+        now = time.monotonic()
+        entry_ids = []
+        for entry_id in list(self._page_index.get(next(iter(pages), ""), [])):
+            entry = self._entries.get(entry_id)
+            if entry is None:
+                continue
+            # 期限切れ・いずれかのページが更新済みのエントリは削除
+            if now - entry["created_at"] > self.ttl_seconds or any(
+                page_id in pages and pages[page_id] != last_edited_time
+                for page_id, last_edited_time in entry["pages"].items()
+            ):
+                self._remove(entry_id)
+                continue
+            # 参考情報のページが異なる回答は使わない
+            if entry["pages"] != pages:
+                continue
+            entry_ids.append(entry_id)
+
+        if entry_ids:
+            matrix = np.stack([self._entries[entry_id]["embedding"] for entry_id in entry_ids])
+            scores = matrix @ to_unit_vector(query_embedding)
+            best = int(np.argmax(scores))
+            if scores[best] >= self.similarity_threshold:
+                entry_id = entry_ids[best]
+                self._entries.move_to_end(entry_id)
+                self.hits += 1
+                return self._entries[entry_id]["answer"]
+
+        self.misses += 1
+        return None
+
+    def store(self, query: str, query_embedding: Sequence[float], pages: Dict[str, str], answer: str) -> None:
+        """
+        回答をキャッシュに保存（上限を超えた場合は最も使われていないものから削除）
+        いずれかのページが更新された場合に削除できるよう、参考情報のすべてのページに紐づける
+        """
+        entry_id = next(self._ids)
+        self._entries[entry_id] = {
+            "query": query,
+            "embedding": to_unit_vector(query_embedding),
+            "pages": dict(pages),
+            "answer": answer,
+            "created_at": time.monotonic()
+        }
+        for page_id in pages:
+            self._page_index.setdefault(page_id, []).append(entry_id)
+
+        while len(self._entries) > self.max_entries:
+            self._remove(next(iter(self._entries)))
+
+    def invalidate_page(self, page_id: str) -> None:
+        """
+        指定ページに紐づく回答をすべて削除
+        """
+        for entry_id in list(self._page_index.get(page_id, [])):
+            self._remove(entry_id)
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._page_index.clear()
+
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries)}
+
+    def _remove(self, entry_id: int) -> None:
+        entry = self._entries.pop(entry_id, None)
+        if entry is None:
+            return
+        for page_id in entry["pages"]:
+            page_entries = self._page_index.get(page_id, [])
+            if entry_id in page_entries:
+                page_entries.remove(entry_id)
+            if not page_entries:
+                self._page_index.pop(page_id, None)
+
+# シングルトンとしてインスタンスを作成
+answer_cache = AnswerCache()
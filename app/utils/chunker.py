@@ -0,0 +1,254 @@
+import os
+import re
+from typing import Callable, Iterable, Iterator, List, NamedTuple, Optional, Tuple, Union
+from app.logger import get_logger
+
+logger = get_logger(__name__)
+
+# トークン数の数え方（approx: 文字種からの概算 / tiktoken: OpenAIのトークナイザー）
+CHUNK_TOKENIZER = os.getenv("CHUNK_TOKENIZER", "approx")
+TIKTOKEN_ENCODING = os.getenv("TIKTOKEN_ENCODING", "cl100k_base")
+
+HEADING_PATTERN = re.compile(r"^(#{1,6})\s+\S")
+LIST_ITEM_PATTERN = re.compile(r"^(• |\d+\. |☐ |✅ |▶ |- |\* )")
+CODE_FENCE = "```"
+# 文の区切り（日本語の句点・感嘆符・疑問符と英語の文末、改行）
+SENTENCE_PATTERN = re.compile(r".+?(?:[。！？!?]+|\.(?=\s)|\n|$)", re.S)
+
+class Chunk(NamedTuple):
+    text: str
+    # チャンクが属する見出しの階層（"# A > ## B" の形式）
+    heading: str
+
+def approximate_token_count(text: str) -> int:
+    """
+    トークン数を文字種から概算（日本語などは1文字≒1トークン、英数字は4文字≒1トークン）
+    """
+    wide = sum(1 for ch in text if ord(ch) > 0x2E7F)
+    return wide + (len(text) - wide + 3) // 4
+
+def get_tokenizer(name: str = CHUNK_TOKENIZER) -> Callable[[str], int]:
+    """
+    トークン数を数える関数を取得
+    tiktokenが使えない環境では概算にフォールバックする
+    """
+    if name == "tiktoken":
+        try:
+            import tiktoken
+            encoding = tiktoken.get_encoding(TIKTOKEN_ENCODING)
+            return lambda text: len(encoding.encode(text, disallowed_special=()))
+        except Exception as e:
+            logger.warning(f"tiktokenを利用できないため概算のトークン数を使用します: {str(e)}")
+    return approximate_token_count
+
+def iter_lines(source: Union[str, Iterable[str]]) -> Iterator[str]:
+    """
+    文字列、または順次届くテキスト断片の列を行ごとに返す
+    """
+    if isinstance(source, str):
+        yield from source.split("\n")
+        return
+
+    buffer = ""
+    for piece in source:
+        buffer += piece
+        *lines, buffer = buffer.split("\n")
+        yield from lines
+    if buffer:
+        yield buffer
+
+def iter_units(source: Union[str, Iterable[str]]) -> Iterator[Tuple[str, str]]:
+    """
+    テキストを構造単位（見出し・コードブロック・リスト・段落）に分けて返す
+
+    Yields:
+        (種類, テキスト) 種類は "heading" / "code" / "list" / "paragraph"
+    """
+    code_lines: Optional[List[str]] = None
+    list_lines: List[str] = []
+    paragraph_lines: List[str] = []
+
+    def flush() -> Iterator[Tuple[str, str]]:
+        if list_lines:
+            yield "list", "\n".join(list_lines)
+            list_lines.clear()
+        if paragraph_lines:
+            yield "paragraph", "\n".join(paragraph_lines)
+            paragraph_lines.clear()
+
+    for line in iter_lines(source):
+        stripped = line.strip()
+
+        # コードブロックは閉じるまで1つの単位として扱う
+        if code_lines is not None:
+            code_lines.append(line)
+            if stripped.startswith(CODE_FENCE):
+                yield "code", "\n".join(code_lines)
+                code_lines = None
+            continue
+
+        if stripped.startswith(CODE_FENCE):
+            yield from flush()
+            code_lines = [line]
+        elif HEADING_PATTERN.match(stripped):
+            yield from flush()
+            yield "heading", stripped
+        elif not stripped:
+            yield from flush()
+        elif LIST_ITEM_PATTERN.match(stripped):
+            if paragraph_lines:
+                yield "paragraph", "\n".join(paragraph_lines)
+                paragraph_lines.clear()
+            list_lines.append(line)
+        else:
+            if list_lines:
+                yield "list", "\n".join(list_lines)
+                list_lines.clear()
+            paragraph_lines.append(line)
+
+    yield from flush()
+    if code_lines:
+        yield "code", "\n".join(code_lines)
+
+def split_sentences(text: str, kind: str) -> List[str]:
+    """
+    単位を文（コードブロックとリストは行）に分割
+    """
+    if kind in ("code", "list"):
+        lines = text.split("\n")
+        return [line + "\n" for line in lines[:-1]] + [lines[-1]]
+    return [sentence for sentence in SENTENCE_PATTERN.findall(text) if sentence]
+
+def split_by_tokens(text: str, max_tokens: int, count: Callable[[str], int]) -> Iterator[str]:
+    """
+    1文がmax_tokensを超える場合に、トークン数の上限に収まる長さで機械的に分割
+    """
+    while text:
+        low, high = 1, len(text)
+        while low < high:
+            middle = (low + high + 1) // 2
+            if count(text[:middle]) <= max_tokens:
+                low = middle
+            else:
+                high = middle - 1
+        yield text[:low]
+        text = text[low:]
+
+def split_oversized(
+    text: str,
+    kind: str,
+    max_tokens: int,
+    overlap_tokens: int,
+    count: Callable[[str], int]
+) -> Iterator[str]:
+    """
+    上限を超える単位を文の境界で分割
+    分割した断片の間では末尾の文をoverlap_tokensまで次の断片の先頭に含める
+    """
+    sentences: List[str] = []
+    for sentence in split_sentences(text, kind):
+        if count(sentence) > max_tokens:
+            sentences.extend(split_by_tokens(sentence, max_tokens, count))
+        else:
+            sentences.append(sentence)
+
+    current: List[str] = []
+    current_tokens = 0
+    for sentence in sentences:
+        sentence_tokens = count(sentence)
+        if current and current_tokens + sentence_tokens > max_tokens:
+            yield "".join(current)
+
+            # 直前の断片の末尾の文を重複として引き継ぐ
+            carried: List[str] = []
+            carried_tokens = 0
+            for previous in reversed(current):
+                previous_tokens = count(previous)
+                if carried_tokens + previous_tokens > overlap_tokens or carried_tokens + previous_tokens + sentence_tokens > max_tokens:
+                    break
+                carried.insert(0, previous)
+                carried_tokens += previous_tokens
+            current = carried
+            current_tokens = carried_tokens
+
+        current.append(sentence)
+        current_tokens += sentence_tokens
+
+    if current:
+        yield "".join(current)
+
+def iter_chunks(
+    source: Union[str, Iterable[str]],
+    max_tokens: int,
+    overlap_tokens: int = 0,
+    tokenizer: Optional[Callable[[str], int]] = None
+) -> Iterator[Chunk]:
+    """
+    ブロック構造に沿ってテキストをチャンクに分割するジェネレーター
+    短い節は上限まで次の節とまとめ、見出しだけのチャンクは作らない（末尾の見出しは次のチャンクに回す）
+    コードブロックやリストは途中で切らずにまとめ、上限を超える単位のみ文の境界で分割する
+    チャンクのheadingには本文に含まれない上位の見出しのみを入れる
+
+    Args:
+        source: テキスト、または順次届くテキスト断片の列
+        max_tokens: 1チャンクあたりの最大トークン数
+        overlap_tokens: 長い単位を分割する際に重複させるトークン数
+        tokenizer: トークン数を数える関数（省略時はCHUNK_TOKENIZERの設定に従う）
+
+    Yields:
+        チャンク
+    """
+    count = tokenizer or get_tokenizer()
+    headings: List[Tuple[int, str]] = []
+    # (種類, テキスト, トークン数, その単位より前の見出しの階層)
+    parts: List[Tuple[str, str, int, str]] = []
+    yielded = False
+
+    def heading_path() -> str:
+        return " > ".join(heading for _, heading in headings)
+
+    def flush() -> Iterator[Chunk]:
+        nonlocal parts, yielded
+        # 末尾の見出しは本文と一緒になるよう次のチャンクに回す
+        end = len(parts)
+        while end and parts[end - 1][0] == "heading":
+            end -= 1
+        if not end:
+            return
+        yield Chunk("\n\n".join(part[1] for part in parts[:end]), parts[0][3])
+        parts = parts[end:]
+        yielded = True
+
+    for kind, text in iter_units(source):
+        unit_tokens = count(text)
+        parts_tokens = sum(part[2] for part in parts)
+
+        if kind == "heading":
+            # 上限の半分に満たない節は次の節とまとめる
+            if parts_tokens >= max_tokens // 2:
+                yield from flush()
+            level = len(text) - len(text.lstrip("#"))
+            headings = [(lv, heading) for lv, heading in headings if lv < level]
+            path = heading_path()
+            headings.append((level, text))
+        else:
+            path = heading_path()
+
+        if unit_tokens > max_tokens:
+            yield from flush()
+            # 回した見出しは分割した断片の見出しの階層に含める
+            parts = []
+            for piece in split_oversized(text, kind, max_tokens, overlap_tokens, count):
+                yield Chunk(piece, heading_path())
+                yielded = True
+            continue
+
+        if parts and parts_tokens + unit_tokens > max_tokens:
+            yield from flush()
+
+        parts.append((kind, text, unit_tokens, path))
+
+    yield from flush()
+    # 見出しのみのテキストは内容が失われないよう1つのチャンクにする
+    if parts and not yielded:
+        yield Chunk("\n\n".join(part[1] for part in parts), parts[0][3])
@@ -0,0 +1,171 @@
+import os
+from typing import Any, Callable, Dict, List, NamedTuple, Optional
+from app.utils.chunker import get_tokenizer, iter_chunks
+from app.utils.lexical_index import tokenize
+
+# 回答生成に渡す参考情報のトークン数の上限
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "6000"))
+# MMRで関連度と重複の少なさのどちらを重視するか（1に近いほど関連度を重視）
+CONTEXT_MMR_LAMBDA = float(os.getenv("CONTEXT_MMR_LAMBDA", "0.7"))
+# 参考情報に含める最大ページ数
+CONTEXT_MAX_PAGES = int(os.getenv("CONTEXT_MAX_PAGES", "3"))
+# 既に選んだチャンクとの重複がこれ以上のチャンクは含めない
+CONTEXT_DUPLICATE_THRESHOLD = 0.9
+
+class PackedContext(NamedTuple):
+    text: str
+    # 参考情報に使ったページ（{"title", "url", "page_id", "last_edited_time", "similarity"}）
+    sources: List[Dict[str, Any]]
+    tokens: int
+
+def page_candidates(notion_info: Dict, chunk_size: int, overlap: int) -> List[Dict[str, Any]]:
+    """
+    チャンクに分割されていないページの内容から候補のチャンクを作成
+    候補チャンクはcontent・similarity（チャンクの関連度）のほか、ページの情報（最終編集日時を含む）と
+    page_similarity（ページ全体の類似度、参照元として返す値）を持つ
+
+    Args:
+        notion_info: ページ情報（title, url, page_id, content）
+        chunk_size: チャンクの最大トークン数
+        overlap: 長い段落を分割する際に重複させるトークン数
+
+    Returns:
+        候補チャンクのリスト
+    """
+    return [
+        {
+            "page_id": notion_info.get("page_id", ""),
+            "title": notion_info.get("title", ""),
+            "url": notion_info.get("url", ""),
+            "last_edited_time": notion_info.get("last_edited_time", ""),
+            "chunk_index": i,
+            "content": chunk.text,
+            "similarity": 1.0
+        }
+        for i, chunk in enumerate(iter_chunks(notion_info.get("content", ""), chunk_size, overlap))
+    ]
+
+def overlap_ratio(a: set, b: set) -> float:
+    """
+    トークン集合の重なり（Jaccard係数）
+    """
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+def select_chunks(
+    candidates: List[Dict[str, Any]],
+    token_budget: int,
+    mmr_lambda: float = CONTEXT_MMR_LAMBDA,
+    count: Optional[Callable[[str], int]] = None
+) -> List[Dict[str, Any]]:
+    """
+    関連度が高く、既に選んだチャンクと重複しないものから順に、トークン数の上限までチャンクを選ぶ（MMR）
+
+    Args:
+        candidates: 候補チャンク（content, similarityを含む辞書）
+        token_budget: 選ぶチャンクの合計トークン数の上限
+        mmr_lambda: 関連度の重み（残りは重複の少なさの重み）
+        count: トークン数を数える関数
+
+    Returns:
+        選ばれたチャンク（選ばれた順）
+    """
+    count = count or get_tokenizer()
+    remaining = []
+    for position, candidate in enumerate(candidates):
+        content = candidate.get("content", "")
+        if not content:
+            continue
+        remaining.append({
+            "candidate": candidate,
+            "position": position,
+            "terms": set(tokenize(content)),
+            "tokens": count(content),
+            # 選んだチャンクとの重複の最大値（選ぶたびに更新する）
+            "redundancy": 0.0
+        })
+
+    selected = []
+    used_tokens = 0
+    while remaining:
+        remaining = [
+            item for item in remaining
+            if used_tokens + item["tokens"] <= token_budget and item["redundancy"] < CONTEXT_DUPLICATE_THRESHOLD
+        ]
+        if not remaining:
+            break
+
+        # 同点の場合は候補の順序（ページ内の順序）を優先
+        best = max(
+            remaining,
+            key=lambda item: (
+                mmr_lambda * item["candidate"].get("similarity", 0.0) - (1 - mmr_lambda) * item["redundancy"],
+                -item["position"]
+            )
+        )
+        remaining.remove(best)
+        selected.append(best["candidate"])
+        used_tokens += best["tokens"]
+
+        for item in remaining:
+            item["redundancy"] = max(item["redundancy"], overlap_ratio(item["terms"], best["terms"]))
+
+    return selected
+
+def build_context(
+    candidates: List[Dict[str, Any]],
+    token_budget: int = CONTEXT_TOKEN_BUDGET,
+    max_pages: int = CONTEXT_MAX_PAGES,
+    mmr_lambda: float = CONTEXT_MMR_LAMBDA,
+    merge: Callable[[List[str]], str] = "\n\n".join
+) -> PackedContext:
+    """
+    複数ページの候補チャンクからトークン数の上限内で参考情報を組み立てる
+
+    Args:
+        candidates: 候補チャンク（関連度の高いページ順）
+        token_budget: 参考情報のトークン数の上限
+        max_pages: 参考情報に含める最大ページ数
+        mmr_lambda: MMRの関連度の重み
+        merge: 同じページのチャンクを結合する関数
+
+    Returns:
+        組み立てた参考情報と使ったページ
+    """
+    count = get_tokenizer()
+
+    # 関連度の高いページから最大ページ数までに絞る
+    page_order: List[str] = []
+    for candidate in candidates:
+        page_id = candidate.get("page_id", "")
+        if page_id not in page_order:
+            page_order.append(page_id)
+    page_order = page_order[:max_pages]
+    candidates = [candidate for candidate in candidates if candidate.get("page_id", "") in page_order]
+
+    selected = select_chunks(candidates, token_budget, mmr_lambda, count)
+
+    sections = []
+    sources = []
+    tokens = 0
+    for page_id in page_order:
+        page_chunks = sorted(
+            (chunk for chunk in selected if chunk.get("page_id", "") == page_id),
+            key=lambda chunk: chunk.get("chunk_index", 0)
+        )
+        if not page_chunks:
+            continue
+
+        content = merge([chunk["content"] for chunk in page_chunks])
+        tokens += sum(count(chunk["content"]) for chunk in page_chunks)
+        sections.append(f"タイトル: {page_chunks[0].get('title', '')}\n内容: {content}")
+        sources.append({
+            "title": page_chunks[0].get("title", ""),
+            "url": page_chunks[0].get("url", ""),
+            "page_id": page_id,
+            "last_edited_time": page_chunks[0].get("last_edited_time", ""),
+            "similarity": page_chunks[0].get("page_similarity", max(chunk.get("similarity", 0.0) for chunk in page_chunks))
+        })
+
+    return PackedContext("\n\n".join(sections), sources, tokens)
@@ -0,0 +1,258 @@
+import os
+import time
+import asyncio
+import sqlite3
+import hashlib
+import threading
+from array import array
+from collections import OrderedDict
+from typing import List, Dict, Optional, Iterable, Set, Tuple
+from app.logger import get_logger
+
+logger = get_logger(__name__)
+
+# ディスク上のキャッシュファイル（空文字でディスク層を無効化、最初にディスクを使うときに作成する）
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", "embedding_cache.sqlite3")
+# メモリ上に保持するエンベディングの件数
+EMBEDDING_CACHE_MEMORY_ITEMS = int(os.getenv("EMBEDDING_CACHE_MEMORY_ITEMS", "10000"))
+# ディスク上のキャッシュの最大サイズ（バイト）
+EMBEDDING_CACHE_MAX_BYTES = int(os.getenv("EMBEDDING_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+# ディスク上の最終アクセス日時の更新をまとめて書き込む件数（書き込みがなくてもこの件数に達すれば読み込み時に反映する）
+EMBEDDING_CACHE_ACCESS_FLUSH_ITEMS = int(os.getenv("EMBEDDING_CACHE_ACCESS_FLUSH_ITEMS", "256"))
+
+class EmbeddingCache:
+    """
+    (モデル, テキスト) のハッシュをキーにしたエンベディングのキャッシュ
+    プロセス内のLRUと、再起動後も残るSQLite（float32のBLOB）の2層で構成する
+    SQLiteのファイルはインポート時ではなく、最初にディスクを使うときにワーカースレッドで開く
+    """
+    def __init__(
+        self,
+        path: Optional[str] = EMBEDDING_CACHE_PATH,
+        max_memory_items: int = EMBEDDING_CACHE_MEMORY_ITEMS,
+        max_disk_bytes: int = EMBEDDING_CACHE_MAX_BYTES
+    ):
+        self.path = path
+        self.max_memory_items = max_memory_items
+        self.max_disk_bytes = max_disk_bytes
+        self._memory: "OrderedDict[str, List[float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        # SQLiteの接続はワーカースレッドから使うため、メモリとは別のロックで直列化する
+        self._db_lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        # ファイルを開けなかった場合はメモリのみで動作する
+        self._disk_enabled = bool(path)
+        # ディスクから読み込んだキーの最終アクセス日時（次の書き込み時にまとめて反映する）
+        self._pending_access: Dict[str, float] = {}
+        # 実行中のディスクへの書き込み（完了前にガベージコレクションされないよう参照を保持する）
+        self._writes: Set[asyncio.Task] = set()
+        self._disk_bytes = 0
+        self.hits_memory = 0
+        self.hits_disk = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(model: str, text: str) -> str:
+        return hashlib.sha256(f"{model}\0{text}".encode("utf-8")).hexdigest()
+
+    async def get_many(self, model: str, texts: Iterable[str]) -> Dict[str, List[float]]:
+        """
+        キャッシュ済みのエンベディングを取得
+        メモリにないものだけをワーカースレッドでディスクから読み込み、イベントループを止めない
+        ディスクから読み込んだものの最終アクセス日時はまとめて後から書き込む
+
+        Args:
+            model: エンベディングモデル名
+            texts: 対象のテキスト
+
+        Returns:
+            テキストをキーにしたエンベディング（見つかったもののみ）
+        """
+        found: Dict[str, List[float]] = {}
+        disk_lookup: Dict[str, str] = {}
+        seen = set()
+
+        with self._lock:
+            for text in texts:
+                if text in seen:
+                    continue
+                seen.add(text)
+                key = self.make_key(model, text)
+                embedding = self._memory.get(key)
+                if embedding is not None:
+                    self._memory.move_to_end(key)
+                    found[text] = embedding
+                    self.hits_memory += 1
+                else:
+                    disk_lookup[key] = text
+
+        if disk_lookup and self._disk_enabled:
+            try:
+                rows = await asyncio.to_thread(self._read_disk, list(disk_lookup))
+                now = time.time()
+                with self._lock:
+                    for key, blob in rows:
+                        embedding = array("f", blob).tolist()
+                        found[disk_lookup.pop(key)] = embedding
+                        self._remember(key, embedding)
+                        self._pending_access[key] = now
+                        self.hits_disk += 1
+            except Exception as e:
+                logger.warning(f"エンベディングキャッシュの読み込みに失敗しました: {str(e)}")
+
+        with self._lock:
+            self.misses += len(disk_lookup)
+
+        return found
+
+    def put_many(self, model: str, items: Iterable[Tuple[str, List[float]]]) -> None:
+        """
+        エンベディングをキャッシュに保存
+        メモリにはすぐに保存し、ディスクへの書き込みはバックグラウンドのタスクからワーカースレッドで行う
+        （呼び出し元は書き込みの完了を待たない、完了を待つ場合はflushを呼び出す）
+
+        Args:
+            model: エンベディングモデル名
+            items: (テキスト, エンベディング) の組
+        """
+        rows: Dict[str, Tuple[str, bytes, int, float]] = {}
+        now = time.time()
+
+        with self._lock:
+            for text, embedding in items:
+                key = self.make_key(model, text)
+                self._remember(key, embedding)
+                blob = array("f", embedding).tobytes()
+                rows[key] = (key, blob, len(blob), now)
+
+        if rows and self._disk_enabled:
+            task = asyncio.ensure_future(self._write_disk_async(list(rows.values())))
+            self._writes.add(task)
+            task.add_done_callback(self._writes.discard)
+
+    async def flush(self) -> None:
+        """
+        実行中のディスクへの書き込みの完了を待つ（終了時に呼び出す）
+        """
+        while self._writes:
+            await asyncio.gather(*list(self._writes), return_exceptions=True)
+
+    async def _write_disk_async(self, rows: List[Tuple[str, bytes, int, float]]) -> None:
+        try:
+            await asyncio.to_thread(self._write_disk, rows)
+        except Exception as e:
+            logger.warning("エンベディングキャッシュの書き込みに失敗しました: %s", str(e))
+
+    def clear_memory(self) -> None:
+        """
+        メモリ上のキャッシュのみ削除（ディスク上のキャッシュは残す）
+        """
+        with self._lock:
+            self._memory.clear()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "hits_memory": self.hits_memory,
+            "hits_disk": self.hits_disk,
+            "misses": self.misses,
+            "memory_items": len(self._memory),
+            "disk_bytes": self._disk_bytes
+        }
+
+    def _remember(self, key: str, embedding: List[float]) -> None:
+        self._memory[key] = embedding
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_items:
+            self._memory.popitem(last=False)
+
+    def _select_in(self, columns: str, keys: List[str]) -> List[tuple]:
+        rows = []
+        # SQLiteのプレースホルダ数の上限を超えないよう分割して検索する
+        for start in range(0, len(keys), 500):
+            batch = keys[start:start + 500]
+            placeholders = ",".join("?" * len(batch))
+            rows.extend(self._conn.execute(
+                f"SELECT {columns} FROM embeddings WHERE key IN ({placeholders})", batch
+            ).fetchall())
+        return rows
+
+    def _connect(self) -> bool:
+        """
+        SQLiteのファイルを開く（_db_lockを取得済みであること、開けない場合はディスク層を無効にする）
+        """
+        if self._conn is not None:
+            return True
+        if not self._disk_enabled:
+            return False
+        try:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                "key TEXT PRIMARY KEY, vector BLOB NOT NULL, size INTEGER NOT NULL, last_access REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_last_access ON embeddings(last_access)")
+            conn.commit()
+            self._disk_bytes = conn.execute("SELECT COALESCE(SUM(size), 0) FROM embeddings").fetchone()[0]
+            self._conn = conn
+            return True
+        except Exception as e:
+            logger.warning(f"エンベディングキャッシュファイルを開けないためメモリのみで動作します: {str(e)}")
+            self._disk_enabled = False
+            return False
+
+    def _read_disk(self, keys: List[str]) -> List[Tuple[str, bytes]]:
+        with self._db_lock:
+            if not self._connect():
+                return []
+            rows = self._select_in("key, vector", keys)
+            # 最終アクセス日時の更新がたまっていれば読み込みのついでに書き込む
+            if len(self._pending_access) >= EMBEDDING_CACHE_ACCESS_FLUSH_ITEMS:
+                self._flush_access()
+                self._conn.commit()
+        return rows
+
+    def _write_disk(self, rows: List[Tuple[str, bytes, int, float]]) -> None:
+        with self._db_lock:
+            if not self._connect():
+                return
+            # 上書きされるキーは元のサイズを差し引いて、ディスク上のサイズを正しく保つ
+            replaced_bytes = sum(size for _, size in self._select_in("key, size", [row[0] for row in rows]))
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector, size, last_access) VALUES (?, ?, ?, ?)", rows
+            )
+            self._flush_access()
+            self._conn.commit()
+            self._disk_bytes += sum(row[2] for row in rows) - replaced_bytes
+            if self._disk_bytes > self.max_disk_bytes:
+                self._evict_disk()
+
+    def _flush_access(self) -> None:
+        # 呼び出し元でコミットする（_db_lockを取得済みであること）
+        with self._lock:
+            pending, self._pending_access = self._pending_access, {}
+        if pending:
+            self._conn.executemany(
+                "UPDATE embeddings SET last_access = ? WHERE key = ?", [(now, key) for key, now in pending.items()]
+            )
+
+    def _evict_disk(self) -> None:
+        # 最終アクセスが古いものから、上限の9割を下回るまで削除する（_db_lockを取得済みであること）
+        target = int(self.max_disk_bytes * 0.9)
+        while self._disk_bytes > target:
+            rows = self._conn.execute("SELECT key, size FROM embeddings ORDER BY last_access LIMIT 500").fetchall()
+            if not rows:
+                self._disk_bytes = 0
+                break
+            for key, size in rows:
+                if self._disk_bytes <= target:
+                    break
+                self._conn.execute("DELETE FROM embeddings WHERE key = ?", (key,))
+                self._disk_bytes -= size
+        self._conn.commit()
+
+# シングルトンとしてインスタンスを作成
+embedding_cache = EmbeddingCache()
@@ -0,0 +1,218 @@
+import math
+import re
+import heapq
+import threading
+import unicodedata
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+# BM25のパラメータ
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+# 英数字の語（チケットIDなどは "abc-123" のように1語として扱う）とそれ以外の文字の連続
+WORD_PATTERN = re.compile(r"[a-z0-9]+(?:[-_.][a-z0-9]+)*|[^\sa-z0-9]+")
+# 記号のみの連続はトークンにしない
+SYMBOL_PATTERN = re.compile(r"^[\W_]+$")
+
+def tokenize(text: str) -> List[str]:
+    """
+    テキストを検索用のトークンに分割
+    英数字は語単位、日本語などの分かち書きされない文字列は文字バイグラムにする
+
+    Args:
+        text: 対象のテキスト
+
+    Returns:
+        トークンのリスト（重複を含む）
+    """
+    tokens = []
+    for word in WORD_PATTERN.findall(unicodedata.normalize("NFKC", text).lower()):
+        if word[0].isascii() and word[0].isalnum():
+            tokens.append(word)
+            continue
+        if SYMBOL_PATTERN.match(word):
+            continue
+        if len(word) == 1:
+            tokens.append(word)
+        else:
+            tokens.extend(word[i:i + 2] for i in range(len(word) - 1))
+    return tokens
+
+class LexicalIndex:
+    """
+    文字バイグラムによるBM25の転置インデックス
+    エンベディングを使わずにローカルだけで検索できるため、ベクトル検索と組み合わせたり、
+    エンベディングAPIが使えない場合の代わりに使う
+    """
+    def __init__(self):
+        self._postings: Dict[str, Dict[str, int]] = {}
+        self._doc_terms: Dict[str, Counter] = {}
+        self._doc_lengths: Dict[str, int] = {}
+        self._metadatas: Dict[str, Dict] = {}
+        self._total_length = 0
+        self._lock = threading.Lock()
+        self.loaded = False
+        # 構築した時刻（time.monotonic）
+        self.built_at = 0.0
+
+    def __len__(self) -> int:
+        return len(self._doc_terms)
+
+    def add(self, doc_ids: Iterable[str], documents: Iterable[str], metadatas: Iterable[Dict]) -> None:
+        """
+        文書を追加（同じIDの文書は置き換える）
+        """
+        with self._lock:
+            for doc_id, document, metadata in zip(doc_ids, documents, metadatas):
+                self._remove(doc_id)
+                terms = Counter(tokenize(document or ""))
+                for term, freq in terms.items():
+                    self._postings.setdefault(term, {})[doc_id] = freq
+                self._doc_terms[doc_id] = terms
+                self._doc_lengths[doc_id] = sum(terms.values())
+                self._metadatas[doc_id] = metadata or {}
+                self._total_length += self._doc_lengths[doc_id]
+
+    def update_metadatas(self, doc_ids: Iterable[str], metadatas: Iterable[Dict]) -> None:
+        """
+        登録済み文書のメタデータのみ更新
+        """
+        with self._lock:
+            for doc_id, metadata in zip(doc_ids, metadatas):
+                if doc_id in self._metadatas:
+                    self._metadatas[doc_id] = metadata
+
+    def remove(self, doc_ids: Iterable[str]) -> None:
+        with self._lock:
+            for doc_id in doc_ids:
+                self._remove(doc_id)
+
+    def remove_where(self, key: str, value: str) -> int:
+        """
+        メタデータのkeyがvalueに一致する文書を削除（ページ単位の削除に使う）
+
+        Returns:
+            削除した文書数
+        """
+        with self._lock:
+            doc_ids = [doc_id for doc_id, metadata in self._metadatas.items() if metadata.get(key) == value]
+            for doc_id in doc_ids:
+                self._remove(doc_id)
+        return len(doc_ids)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._postings.clear()
+            self._doc_terms.clear()
+            self._doc_lengths.clear()
+            self._metadatas.clear()
+            self._total_length = 0
+            self.loaded = False
+
+    def search(self, query: str, n_results: int = 20) -> List[Tuple[str, float, float, Dict]]:
+        """
+        BM25でクエリに一致する文書を検索
+
+        Args:
+            query: 検索クエリ
+            n_results: 返す最大件数
+
+        Returns:
+            (文書ID, BM25スコア, 一致率, メタデータ) のリスト（スコアの降順）
+            一致率はクエリのトークンのうち文書に含まれる割合（0〜1）
+        """
+        query_terms = set(tokenize(query))
+        if not query_terms:
+            return []
+
+        with self._lock:
+            doc_count = len(self._doc_terms)
+            if doc_count == 0:
+                return []
+            average_length = self._total_length / doc_count
+
+            scores: Dict[str, float] = {}
+            matched: Counter = Counter()
+            for term in query_terms:
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (doc_count - len(postings) + 0.5) / (len(postings) + 0.5))
+                for doc_id, freq in postings.items():
+                    length_norm = 1 - BM25_B + BM25_B * self._doc_lengths[doc_id] / average_length
+                    scores[doc_id] = scores.get(doc_id, 0.0) + idf * freq * (BM25_K1 + 1) / (freq + BM25_K1 * length_norm)
+                    matched[doc_id] += 1
+
+            best = heapq.nlargest(n_results, scores.items(), key=lambda item: item[1])
+            return [
+                (doc_id, score, matched[doc_id] / len(query_terms), self._metadatas[doc_id])
+                for doc_id, score in best
+            ]
+
+    def _remove(self, doc_id: str) -> None:
+        terms = self._doc_terms.pop(doc_id, None)
+        if terms is None:
+            return
+        for term in terms:
+            postings = self._postings.get(term)
+            if postings is None:
+                continue
+            postings.pop(doc_id, None)
+            if not postings:
+                del self._postings[term]
+        self._total_length -= self._doc_lengths.pop(doc_id, 0)
+        self._metadatas.pop(doc_id, None)
+
+def reciprocal_rank_fusion(
+    rankings: Iterable[List[str]],
+    k: int = 60,
+    weights: Optional[Sequence[float]] = None
+) -> Dict[str, float]:
+    """
+    複数のランキングをReciprocal Rank Fusionで統合
+
+    Args:
+        rankings: IDを順位順に並べたリストの列
+        k: 下位の順位の影響を抑える定数
+        weights: ランキングごとの重み（省略時はすべて1）
+
+    Returns:
+        IDごとの統合スコア
+    """
+    fused: Dict[str, float] = {}
+    for i, ranking in enumerate(rankings):
+        weight = weights[i] if weights is not None else 1.0
+        for rank, item_id in enumerate(ranking):
+            fused[item_id] = fused.get(item_id, 0.0) + weight / (k + rank + 1)
+    return fused
+
+class LexicalIndexRegistry:
+    """
+    コレクション名ごとの転置インデックスを保持する
+    """
+    def __init__(self):
+        self._indexes: Dict[str, LexicalIndex] = {}
+        self._lock = threading.Lock()
+
+    def replace(self, name: str, index: LexicalIndex) -> None:
+        """
+        構築し直したインデックスに差し替える（差し替えるまでは古いインデックスを使い続ける）
+        """
+        index.loaded = True
+        with self._lock:
+            self._indexes[name] = index
+
+    def peek(self, name: str) -> Optional[LexicalIndex]:
+        """
+        構築済みのインデックスのみ返す（未構築ならNone）
+        """
+        index = self._indexes.get(name)
+        return index if index is not None and index.loaded else None
+
+    def invalidate(self, name: str) -> None:
+        with self._lock:
+            self._indexes.pop(name, None)
+
+# シングルトンとしてインスタンスを作成
+lexical_indexes = LexicalIndexRegistry()
@@ -0,0 +1,236 @@
+import os
+import time
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+from opentelemetry import trace
+
+# OTLPでトレースを送信する場合の送信先（未設定の場合はトレースを記録しない）
+OTEL_EXPORTER_OTLP_ENDPOINT = os.getenv("OTEL_EXPORTER_OTLP_ENDPOINT", "")
+OTEL_SERVICE_NAME = os.getenv("OTEL_SERVICE_NAME", "devbot")
+# ヒストグラムのバケット（秒）
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+LabelValues = Tuple[str, ...]
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+class Counter:
+    """
+    増加のみする値（Prometheusのcounter）
+    """
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[LabelValues, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, *labelvalues: str) -> None:
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0.0) + amount
+
+    def collect(self) -> List[str]:
+        with self._lock:
+            values = list(self._values.items())
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        lines += [f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}" for labels, value in values]
+        return lines
+
+class Histogram:
+    """
+    値の分布を固定のバケットで集計する（Prometheusのhistogram）
+    記録時はバケットの位置を二分探索して加算するだけにし、累積は出力時に計算する
+    """
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # ラベルの値ごとの [バケットごとの件数..., +Infの件数], 合計
+        self._values: Dict[LabelValues, Tuple[List[int], List[float]]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labelvalues: str) -> None:
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._values.get(labelvalues) or self._values.setdefault(
+                labelvalues, ([0] * (len(self.buckets) + 1), [0.0])
+            )
+            counts[index] += 1
+            total[0] += value
+
+    def collect(self) -> List[str]:
+        with self._lock:
+            values = [(labels, list(counts), total[0]) for labels, (counts, total) in self._values.items()]
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for labels, counts, total in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, labels)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+class CallbackMetric:
+    """
+    出力時に関数を呼び出して値を取得する（キャッシュの統計など、他で集計済みの値を公開する）
+    """
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        callback: Callable[[], Dict[LabelValues, float]],
+        labelnames: Sequence[str] = (),
+        metric_type: str = "gauge"
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.callback = callback
+        self.labelnames = tuple(labelnames)
+        self.metric_type = metric_type
+
+    def collect(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.metric_type}"]
+        lines += [
+            f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}"
+            for labels, value in self.callback().items()
+        ]
+        return lines
+
+class MetricsRegistry:
+    """
+    メトリクスを登録し、Prometheusのテキスト形式で出力する
+    """
+    def __init__(self):
+        self._metrics: Dict[str, object] = {}
+
+    def register(self, metric):
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def callback(
+        self,
+        name: str,
+        documentation: str,
+        callback: Callable[[], Dict[LabelValues, float]],
+        labelnames: Sequence[str] = (),
+        metric_type: str = "gauge"
+    ) -> CallbackMetric:
+        return self.register(CallbackMetric(name, documentation, callback, labelnames, metric_type))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines += metric.collect()
+        return "\n".join(lines) + "\n"
+
+# シングルトンとしてインスタンスを作成
+metrics = MetricsRegistry()
+tracer = trace.get_tracer("devbot")
+
+HTTP_REQUEST_DURATION = metrics.histogram(
+    "devbot_http_request_duration_seconds", "HTTPリクエストの処理時間（ストリーミングは最初の応答まで）", ("method", "route", "status")
+)
+STAGE_DURATION = metrics.histogram("devbot_stage_duration_seconds", "チャットの処理段階ごとの処理時間", ("stage",))
+EXTERNAL_CALL_DURATION = metrics.histogram(
+    "devbot_external_call_duration_seconds", "外部サービスの呼び出し時間", ("service", "operation")
+)
+EXTERNAL_CALL_ERRORS = metrics.counter("devbot_external_call_errors_total", "外部サービスの呼び出しの失敗数", ("service", "operation"))
+EMBEDDING_INPUTS = metrics.counter("devbot_embedding_inputs_total", "APIに送信したエンベディングの入力数")
+TOKENS_USED = metrics.counter("devbot_tokens_total", "OpenAI APIで消費したトークン数", ("model", "type"))
+ADMISSION_WAIT = metrics.histogram("devbot_admission_wait_seconds", "受付制御の待機列で待った時間", ("budget",))
+ADMISSION_REJECTED = metrics.counter("devbot_admission_rejected_total", "混雑のため受け付けなかったリクエスト数", ("budget", "reason"))
+
+@contextmanager
+def stage_timer(stage: str) -> Iterator[None]:
+    """
+    チャットの処理段階の処理時間を記録し、トレースのスパンを作成する
+    """
+    started_at = time.perf_counter()
+    with tracer.start_as_current_span(f"stage.{stage}"):
+        try:
+            yield
+        finally:
+            STAGE_DURATION.observe(time.perf_counter() - started_at, stage)
+
+@contextmanager
+def external_call(service: str, operation: str) -> Iterator[None]:
+    """
+    外部サービスの呼び出し時間と失敗数を記録し、トレースのスパンを作成する
+    """
+    started_at = time.perf_counter()
+    with tracer.start_as_current_span(f"{service}.{operation}", kind=trace.SpanKind.CLIENT):
+        try:
+            yield
+        except BaseException:
+            EXTERNAL_CALL_ERRORS.inc(1.0, service, operation)
+            raise
+        finally:
+            EXTERNAL_CALL_DURATION.observe(time.perf_counter() - started_at, service, operation)
+
+def record_token_usage(model: str, usage: Optional[object]) -> None:
+    """
+    OpenAI APIの応答に含まれるトークン数を記録
+    """
+    if usage is None:
+        return
+    for usage_type in ("prompt_tokens", "completion_tokens"):
+        tokens = getattr(usage, usage_type, None)
+        if tokens:
+            TOKENS_USED.inc(float(tokens), model, usage_type.replace("_tokens", ""))
+
+def setup_tracing(app) -> bool:
+    """
+    OTEL_EXPORTER_OTLP_ENDPOINTが設定されていれば、OTLPでトレースを送信するように設定し、
+    FastAPIのリクエストにもスパンを作成する
+    未設定の場合は何もせず、各処理のスパンは記録されない（ほぼ負荷がかからない）
+
+    Args:
+        app: FastAPIアプリケーション
+
+    Returns:
+        トレースを有効にした場合はTrue
+    """
+    if not OTEL_EXPORTER_OTLP_ENDPOINT:
+        return False
+
+    from opentelemetry.exporter.otlp.proto.grpc.trace_exporter import OTLPSpanExporter
+    from opentelemetry.instrumentation.fastapi import FastAPIInstrumentor
+    from opentelemetry.sdk.resources import Resource
+    from opentelemetry.sdk.trace import TracerProvider
+    from opentelemetry.sdk.trace.export import BatchSpanProcessor
+
+    # サンプリングの割合は OTEL_TRACES_SAMPLER / OTEL_TRACES_SAMPLER_ARG で指定できる
+    provider = TracerProvider(resource=Resource.create({"service.name": OTEL_SERVICE_NAME}))
+    provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter()))
+    trace.set_tracer_provider(provider)
+    FastAPIInstrumentor.instrument_app(app, excluded_urls="metrics")
+    return True
@@ -1,8 +1,12 @@
 import os
-from typing import List, Dict, Any
-from openai import OpenAI
+import asyncio
+from typing import List, Dict, Any, Optional, Tuple, Iterator, AsyncIterator, Set
+import httpx
+from openai import AsyncOpenAI, BadRequestError, DefaultAsyncHttpxClient
 from dotenv import load_dotenv, find_dotenv
 from app.logger import get_logger
+from app.utils.embedding_cache import embedding_cache
+from app.utils.metrics import EMBEDDING_INPUTS, external_call, record_token_usage
 
 # ロガーの設定
 logger = get_logger(__name__)
@@ -14,30 +18,250 @@ if dotenv_path:
 else:
     logger.warning(".env ファイルが見つかりません")
 
+# 接続プールとタイムアウトの設定
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", "100"))
+OPENAI_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("OPENAI_MAX_KEEPALIVE_CONNECTIONS", "20"))
+OPENAI_CONNECT_TIMEOUT = float(os.getenv("OPENAI_CONNECT_TIMEOUT", "5.0"))
+OPENAI_TIMEOUT = float(os.getenv("OPENAI_TIMEOUT", "60.0"))
+OPENAI_EMBEDDING_TIMEOUT = float(os.getenv("OPENAI_EMBEDDING_TIMEOUT", "10.0"))
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "2"))
+
 # OpenAIクライアントの初期化（環境変数から直接取得）
+# 非同期クライアントを全リクエストで共有し、イベントループをブロックしないようにする
 openai_api_key = os.getenv("OPENAI_API_KEY")
-openai_client = OpenAI(api_key=openai_api_key)
+openai_client = AsyncOpenAI(
+    api_key=openai_api_key,
+    max_retries=OPENAI_MAX_RETRIES,
+    timeout=httpx.Timeout(OPENAI_TIMEOUT, connect=OPENAI_CONNECT_TIMEOUT),
+    http_client=DefaultAsyncHttpxClient(
+        limits=httpx.Limits(
+            max_connections=OPENAI_MAX_CONNECTIONS,
+            max_keepalive_connections=OPENAI_MAX_KEEPALIVE_CONNECTIONS
+        )
+    )
+)
 
-async def get_embeddings(text: str) -> List[float]:
+async def close_openai_client() -> None:
     """
-    OpenAIのAPIを使用してテキストのエンベディングを取得
+    共有しているOpenAIクライアントの接続プールを閉じる（アプリ終了時に呼び出す）
+    """
+    await openai_client.close()
+
+EMBEDDING_MODEL = "text-embedding-3-small"
+# 1リクエストあたりの入力数・トークン数の上限（APIの上限 2048件 / 300,000トークンより余裕を持たせる）
+EMBEDDING_BATCH_MAX_INPUTS = int(os.getenv("EMBEDDING_BATCH_MAX_INPUTS", "2048"))
+EMBEDDING_BATCH_MAX_TOKENS = int(os.getenv("EMBEDDING_BATCH_MAX_TOKENS", "250000"))
+# 1件の入力のトークン数の上限（概算、超えた分は切り捨てる）
+# モデルの上限は8191トークンだが、漢字は1文字で2トークン以上になることがあるため余裕を持たせる
+EMBEDDING_MAX_INPUT_TOKENS = int(os.getenv("EMBEDDING_MAX_INPUT_TOKENS", "6000"))
+# 同時に発生した単発のエンベディング要求をまとめる待ち時間（ミリ秒、0で無効）
+EMBEDDING_COALESCE_WINDOW_MS = float(os.getenv("EMBEDDING_COALESCE_WINDOW_MS", "5"))
+
+def estimate_tokens(text: str) -> int:
+    """
+    テキストのトークン数を概算（UTF-8のバイト数 / 3）
+    日本語は1文字≒1トークン、英語は実際より多めに見積もられるため上限判定には安全側に働く
 
     Args:
-        text: エンベディングを生成するテキスト
+        text: 対象のテキスト
 
     Returns:
-        生成されたエンベディングベクトル
+        概算トークン数
+    """
+    return max(1, len(text.encode("utf-8")) // 3)
+
+def truncate_embedding_input(text: str, max_tokens: int = EMBEDDING_MAX_INPUT_TOKENS) -> str:
+    """
+    1件の入力がモデルの上限を超えないよう、概算トークン数の上限で末尾を切り捨てる
+
+    Args:
+        text: 対象のテキスト
+        max_tokens: 概算トークン数の上限
+
+    Returns:
+        上限以下のテキスト（上限以下であればそのまま）
+    """
+    encoded = text.encode("utf-8")
+    if len(encoded) // 3 <= max_tokens:
+        return text
+    # estimate_tokensと同じ見積もりで上限に収まるバイト数で切り、途中で切れた文字は捨てる
+    return encoded[:max_tokens * 3].decode("utf-8", errors="ignore")
+
+def _split_batches(texts: List[str]) -> Iterator[List[str]]:
+    """
+    入力数とトークン数の上限を超えないようにテキストをバッチに分割
     """
+    batch: List[str] = []
+    batch_tokens = 0
+    for text in texts:
+        tokens = min(estimate_tokens(text), EMBEDDING_MAX_INPUT_TOKENS)
+        if batch and (len(batch) >= EMBEDDING_BATCH_MAX_INPUTS or batch_tokens + tokens > EMBEDDING_BATCH_MAX_TOKENS):
+            yield batch
+            batch = []
+            batch_tokens = 0
+        batch.append(text)
+        batch_tokens += tokens
+    if batch:
+        yield batch
+
+async def _request_embeddings(texts: List[str], timeout: float = OPENAI_EMBEDDING_TIMEOUT) -> Dict[str, List[float]]:
+    """
+    キャッシュを確認せずにAPIからエンベディングを取得し、結果をキャッシュに保存
+    重複したテキストは1回だけ送信し、上限を超える場合は複数リクエストに分割する
+    1件の上限を超えるテキストは切り捨てて送信し、結果は元のテキストに対応付ける
+    """
+    embeddings_by_text: Dict[str, List[float]] = {}
+
     try:
-        response = openai_client.embeddings.create(
-            input=text,
-            model="text-embedding-3-small"
-        )
-        return response.data[0].embedding
+        for batch in _split_batches(list(dict.fromkeys(texts))):
+            with external_call("openai", "embeddings"):
+                response = await openai_client.embeddings.create(
+                    input=[truncate_embedding_input(text) for text in batch],
+                    model=EMBEDDING_MODEL,
+                    timeout=timeout
+                )
+            EMBEDDING_INPUTS.inc(len(batch))
+            record_token_usage(EMBEDDING_MODEL, getattr(response, "usage", None))
+            new_embeddings = [(batch[item.index], item.embedding) for item in response.data]
+            embeddings_by_text.update(new_embeddings)
+            embedding_cache.put_many(EMBEDDING_MODEL, new_embeddings)
     except Exception as e:
         logger.error(f"エンベディング生成中にエラーが発生しました: {str(e)}")
         raise
 
+    return embeddings_by_text
+
+async def get_embeddings_batch(texts: List[str], timeout: float = OPENAI_EMBEDDING_TIMEOUT) -> List[List[float]]:
+    """
+    複数のテキストのエンベディングをまとめて取得
+    キャッシュ済みのテキストは送信せず、残りを1回（上限を超える場合は複数回）のリクエストで取得する
+
+    Args:
+        texts: エンベディングを生成するテキストのリスト
+        timeout: 1リクエストあたりのタイムアウト（秒）
+
+    Returns:
+        入力と同じ順序のエンベディングベクトルのリスト
+    """
+    if not texts:
+        return []
+
+    embeddings_by_text = await embedding_cache.get_many(EMBEDDING_MODEL, texts)
+    missing_texts = [text for text in texts if text not in embeddings_by_text]
+    if missing_texts:
+        embeddings_by_text.update(await _request_embeddings(missing_texts, timeout))
+
+    return [embeddings_by_text[text] for text in texts]
+
+async def get_embeddings_each(texts: List[str], timeout: float = OPENAI_EMBEDDING_TIMEOUT) -> List[Optional[List[float]]]:
+    """
+    複数のテキストのエンベディングをまとめて取得し、失敗した場合は1件ずつ取得し直す
+    1件の失敗で全体を失敗させず、取得できなかったテキストのみNoneとする
+
+    Args:
+        texts: エンベディングを生成するテキストのリスト
+        timeout: 1リクエストあたりのタイムアウト（秒）
+
+    Returns:
+        入力と同じ順序のエンベディングベクトル（取得できなかったものはNone）のリスト
+    """
+    try:
+        return list(await get_embeddings_batch(texts, timeout))
+    except Exception as e:
+        if len(texts) <= 1:
+            return [None] * len(texts)
+        logger.warning("まとめたエンベディングの取得に失敗したため1件ずつ取得し直します: %s", str(e))
+
+    results = await asyncio.gather(*[get_embeddings_batch([text], timeout) for text in texts], return_exceptions=True)
+    return [None if isinstance(result, BaseException) else result[0] for result in results]
+
+class EmbeddingCoalescer:
+    """
+    短い時間枠内に別々のリクエストから届いた単発のエンベディング要求を
+    1回のAPI呼び出しにまとめる
+    """
+    def __init__(self, window_ms: float = EMBEDDING_COALESCE_WINDOW_MS, max_batch: int = EMBEDDING_BATCH_MAX_INPUTS):
+        self.window = window_ms / 1000
+        self.max_batch = max_batch
+        self._pending: List[Tuple[str, asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        # 実行中のAPI呼び出し（完了前にガベージコレクションされないよう参照を保持する）
+        self._tasks: Set[asyncio.Task] = set()
+
+    async def embed(self, text: str) -> List[float]:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((text, future))
+
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._flush)
+
+        return await future
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        pending, self._pending = self._pending, []
+        if pending:
+            task = asyncio.ensure_future(self._run(pending))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, pending: List[Tuple[str, asyncio.Future]]) -> None:
+        texts = list(dict.fromkeys(text for text, _ in pending))
+        try:
+            # 呼び出し元でキャッシュを確認済みのため、直接APIに問い合わせる
+            results: Dict[str, Any] = await _request_embeddings(texts)
+        except BadRequestError as e:
+            if len(texts) == 1:
+                results = {texts[0]: e}
+            else:
+                # 不正な入力が1件あるとまとめたリクエスト全体が失敗するため、1件ずつ取得し直して
+                # 失敗した入力の要求だけを失敗させる
+                logger.warning("まとめたエンベディングの取得に失敗したため1件ずつ取得し直します: %s", str(e))
+                retried = await asyncio.gather(*[_request_embeddings([text]) for text in texts], return_exceptions=True)
+                results = {
+                    text: result if isinstance(result, BaseException) else result[text]
+                    for text, result in zip(texts, retried)
+                }
+        except Exception as e:
+            results = {text: e for text in texts}
+
+        for text, future in pending:
+            if future.done():
+                continue
+            result = results[text]
+            if isinstance(result, BaseException):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+embedding_coalescer = EmbeddingCoalescer()
+
+async def get_embeddings(text: str) -> List[float]:
+    """
+    OpenAIのAPIを使用してテキストのエンベディングを取得
+    同時に届いた要求はEmbeddingCoalescerで1回のAPI呼び出しにまとめられる
+
+    Args:
+        text: エンベディングを生成するテキスト
+
+    Returns:
+        生成されたエンベディングベクトル
+    """
+    # キャッシュ済みであれば時間枠を待たずに返す
+    cached = await embedding_cache.get_many(EMBEDDING_MODEL, [text])
+    if text in cached:
+        return cached[text]
+
+    if EMBEDDING_COALESCE_WINDOW_MS > 0:
+        return await embedding_coalescer.embed(text)
+    return (await _request_embeddings([text]))[text]
+
 async def generate_completion(
     prompt: str,
     system_message: str = "あなたは役立つAIアシスタントです。",
@@ -77,7 +301,9 @@ async def generate_completion(
             params["max_tokens"] = max_tokens
 
         # OpenAI APIを呼び出し
-        response = openai_client.chat.completions.create(**params)
+        with external_call("openai", "chat.completions"):
+            response = await openai_client.chat.completions.create(**params)
+        record_token_usage(model, getattr(response, "usage", None))
 
         if not response or not response.choices:
             logger.error("OpenAIからの応答が空または無効です")
@@ -88,3 +314,58 @@ async def generate_completion(
     except Exception as e:
         logger.error(f"テキスト生成中にエラーが発生しました: {str(e)}")
         raise
+
+async def generate_completion_stream(
+    prompt: str,
+    system_message: str = "あなたは役立つAIアシスタントです。",
+    model: str = "gpt-3.5-turbo-16k",
+    temperature: float = 0.7,
+    max_tokens: int = None,
+    timeout: float = 30.0
+) -> AsyncIterator[str]:
+    """
+    OpenAIのAPIを使用してテキスト生成を行い、生成されたトークンを順次返す
+
+    Args:
+        prompt: ユーザープロンプト
+        system_message: システムメッセージ
+        model: 使用するモデル
+        temperature: 生成の多様性（0-1）
+        max_tokens: 最大トークン数（Noneの場合はモデルのデフォルト）
+        timeout: タイムアウト（秒）
+
+    Yields:
+        生成されたテキストの断片
+    """
+    try:
+        params = {
+            "model": model,
+            "messages": [
+                {"role": "system", "content": system_message},
+                {"role": "user", "content": prompt}
+            ],
+            "temperature": temperature,
+            "timeout": timeout,
+            "stream": True,
+            # 最後のチャンクで消費トークン数を受け取る
+            "stream_options": {"include_usage": True}
+        }
+
+        if max_tokens is not None:
+            params["max_tokens"] = max_tokens
+
+        # 計測するのは最初の応答までの時間
+        with external_call("openai", "chat.completions.stream"):
+            stream = await openai_client.chat.completions.create(**params)
+
+        async for chunk in stream:
+            record_token_usage(model, getattr(chunk, "usage", None))
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if delta:
+                yield delta
+
+    except Exception as e:
+        logger.error(f"ストリーミングでのテキスト生成中にエラーが発生しました: {str(e)}")
+        raise
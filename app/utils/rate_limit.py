@@ -0,0 +1,45 @@
+import asyncio
+import time
+from typing import Optional
+
+class TokenBucket:
+    """
+    トークンバケット方式のレート制限
+    1秒あたりrate個のトークンを補充し、最大capacity個まで貯められる
+    """
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        """
+        トークンを1つ取得するまで待機
+        """
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+
+                # Retry-Afterなどで一時停止中は再開時刻まで待つ
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def pause(self, seconds: float) -> None:
+        """
+        指定秒数の間、トークンの払い出しを止める（レート制限の応答を受けたときに使用）
+        """
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = 0
@@ -0,0 +1,103 @@
+import time
+import asyncio
+from contextlib import contextmanager
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Optional, TypeVar
+from app.utils.openai import get_embeddings
+from app.utils.metrics import stage_timer
+
+T = TypeVar("T")
+
+class RequestContext:
+    """
+    1回のリクエストの処理全体で共有する値を保持する
+    クエリのエンベディングなど計算に時間のかかる値は最初の1回だけ計算し、
+    検索で見つかった候補や各段階の処理時間もここに記録する
+    """
+    def __init__(self, user_query: str):
+        self.user_query = user_query
+        self.started_at = time.perf_counter()
+        # 段階ごとの処理時間（秒）
+        self.timings: Dict[str, float] = {}
+        # 検索で見つかった候補（段階名ごと）
+        self.candidates: Dict[str, Any] = {}
+        self._memo: Dict[str, asyncio.Future] = {}
+
+    async def memoize(self, key: str, factory: Callable[[], Awaitable[T]]) -> T:
+        """
+        keyごとにfactoryの結果を1回だけ計算して使い回す
+        計算中に同じkeyで呼ばれた場合は同じ計算の完了を待つ
+
+        Args:
+            key: 値の名前
+            factory: 値を計算するコルーチンを返す関数
+
+        Returns:
+            計算結果
+        """
+        future = self._memo.get(key)
+        if future is None:
+            future = asyncio.ensure_future(factory())
+            # 呼び出し元がタイムアウトで待つのをやめた場合も例外を回収しておく
+            future.add_done_callback(lambda done: done.cancelled() or done.exception())
+            self._memo[key] = future
+        # 1つの呼び出し元のキャンセルで共有の計算を止めないようにする
+        return await asyncio.shield(future)
+
+    def seed(self, key: str, value: Any) -> None:
+        """
+        まとめて計算済みの値をkeyの結果として設定する（以降のmemoizeは計算せずにこの値を返す）
+        """
+        future = asyncio.get_running_loop().create_future()
+        future.set_result(value)
+        self._memo[key] = future
+
+    def peek(self, key: str) -> Any:
+        """
+        keyの計算済みの値を返す（未計算・計算中・失敗した場合はNone）
+        """
+        future = self._memo.get(key)
+        if future is None or not future.done() or future.cancelled() or future.exception() is not None:
+            return None
+        return future.result()
+
+    async def query_embedding(self) -> List[float]:
+        return await self.memoize("query_embedding", lambda: get_embeddings(self.user_query))
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        """
+        with文で囲んだ段階の処理時間を記録する（メトリクスとトレースのスパンにも記録される）
+        """
+        started_at = time.perf_counter()
+        try:
+            with stage_timer(name):
+                yield
+        finally:
+            self.timings[name] = self.timings.get(name, 0.0) + time.perf_counter() - started_at
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started_at
+
+    def timings_ms(self) -> Dict[str, int]:
+        """
+        ログに付与する処理時間（ミリ秒、合計と段階ごと）
+        文字列にするのはログの出力時に行う
+        """
+        timings = {"total": round(self.elapsed() * 1000)}
+        timings.update((name, round(seconds * 1000)) for name, seconds in list(self.timings.items()))
+        return timings
+
+async def embed_query(user_query: str, request_context: Optional[RequestContext] = None) -> List[float]:
+    """
+    クエリのエンベディングを取得（リクエストの処理中であれば計算済みの値を使い回す）
+
+    Args:
+        user_query: ユーザーの質問
+        request_context: リクエストのコンテキスト
+
+    Returns:
+        エンベディングベクトル
+    """
+    if request_context is not None and request_context.user_query == user_query:
+        return await request_context.query_embedding()
+    return await get_embeddings(user_query)
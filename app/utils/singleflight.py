@@ -0,0 +1,72 @@
+import asyncio
+from typing import Awaitable, Callable, Dict, Hashable, Optional, TypeVar
+
+T = TypeVar("T")
+
+class SingleFlight:
+    """
+    同じキーの処理が同時に要求された場合に1回だけ実行し、結果を待っている全員に返す
+    処理が終わるとキーは解放されるため、結果を保持し続けるキャッシュではない
+    cancel_when_abandoned=Trueの場合、待っている全員がキャンセルされると処理自体もキャンセルする
+    """
+    def __init__(self, cancel_when_abandoned: bool = True):
+        self.cancel_when_abandoned = cancel_when_abandoned
+        self._calls: Dict[Hashable, asyncio.Future] = {}
+        self._waiters: Dict[asyncio.Future, int] = {}
+        # 処理を開始したタスク（実行中の処理が誰のものかを判定する）
+        self._leaders: Dict[Hashable, Optional[asyncio.Task]] = {}
+        # 実行中の処理に相乗りした回数
+        self.shared = 0
+
+    async def do(self, key: Hashable, factory: Callable[[], Awaitable[T]]) -> T:
+        """
+        keyの処理が実行中であればその完了を待ち、なければfactoryを実行する
+
+        Args:
+            key: 処理を識別するキー
+            factory: 処理を行うコルーチンを返す関数
+
+        Returns:
+            処理の結果（例外も待っている全員に伝わる）
+        """
+        future = self._calls.get(key)
+        if future is None:
+            future = asyncio.ensure_future(factory())
+            self._calls[key] = future
+            self._leaders[key] = asyncio.current_task()
+            future.add_done_callback(lambda done: self._release(key, done))
+        else:
+            self.shared += 1
+
+        self._waiters[future] = self._waiters.get(future, 0) + 1
+        try:
+            # 待っている1件がキャンセルされても他の待ち手のために処理は続ける
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            if self.cancel_when_abandoned and self._waiters.get(future) == 1 and not future.done():
+                future.cancel()
+            raise
+        finally:
+            self._waiters[future] -= 1
+            if not self._waiters[future]:
+                del self._waiters[future]
+
+    def in_flight(self) -> int:
+        return len(self._calls)
+
+    def is_running(self, key: Hashable) -> bool:
+        return key in self._calls
+
+    def is_leader(self, key: Hashable, task: Optional[asyncio.Task]) -> bool:
+        """
+        keyの処理が実行中で、taskがその処理を開始したかどうか
+        """
+        return key in self._calls and task is not None and self._leaders.get(key) is task
+
+    def _release(self, key: Hashable, future: asyncio.Future) -> None:
+        if self._calls.get(key) is future:
+            del self._calls[key]
+            self._leaders.pop(key, None)
+        # 全員が待つのをやめていた場合も例外を回収しておく
+        if not future.cancelled():
+            future.exception()
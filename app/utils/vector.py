@@ -0,0 +1,55 @@
+from typing import List, Sequence
+import numpy as np
+
+def to_matrix(embeddings: Sequence[Sequence[float]]) -> np.ndarray:
+    """
+    エンベディングのリストを連続したfloat32の行列に変換し、各行を正規化する
+
+    Args:
+        embeddings: エンベディングベクトルのリスト
+
+    Returns:
+        (件数, 次元数) の正規化済み行列
+    """
+    matrix = np.ascontiguousarray(embeddings, dtype=np.float32)
+    if matrix.ndim != 2 or matrix.shape[0] == 0:
+        return matrix.reshape(0, 0)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    matrix /= norms
+    return matrix
+
+def to_unit_vector(embedding: Sequence[float]) -> np.ndarray:
+    """
+    1件のエンベディングをfloat32の単位ベクトルに変換
+    """
+    vector = np.asarray(embedding, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm > 0 else vector
+
+def cosine_scores(query_embedding: Sequence[float], matrix: np.ndarray) -> np.ndarray:
+    """
+    クエリと正規化済み行列の全行とのコサイン類似度を1回の行列ベクトル積で計算
+
+    Args:
+        query_embedding: クエリのエンベディング
+        matrix: to_matrixで作成した正規化済み行列
+
+    Returns:
+        各行の類似度
+    """
+    if matrix.size == 0:
+        return np.zeros(0, dtype=np.float32)
+    return matrix @ to_unit_vector(query_embedding)
+
+def top_k(scores: np.ndarray, k: int) -> List[int]:
+    """
+    スコアの上位k件のインデックスを降順で返す（全体をソートせずargpartitionで選択）
+    """
+    n = scores.shape[0]
+    if n == 0 or k <= 0:
+        return []
+    if k >= n:
+        return np.argsort(-scores).tolist()
+    candidates = np.argpartition(-scores, k - 1)[:k]
+    return candidates[np.argsort(-scores[candidates])].tolist()
@@ -0,0 +1,53 @@
+import argparse
+import asyncio
+import json
+from benchmarks.runner import (
+    SCENARIOS, BenchmarkRunner, compare_with_baseline, configure_environment, format_results, install_fakes, load_trace
+)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="OpenAI・Notion・ChromaDBの代替を使ってチャットAPIの性能を計測します")
+    parser.add_argument("scenarios", nargs="*", help=f"実行するシナリオ（{', '.join(SCENARIOS)}、省略時はすべて）")
+    parser.add_argument("--requests", type=int, default=50, help="シナリオごとのリクエスト数")
+    parser.add_argument("--concurrency", type=int, default=10, help="concurrentシナリオの同時実行数")
+    parser.add_argument("--pages", type=int, default=200, help="合成データベースのページ数")
+    parser.add_argument("--trace", default=None, help="再生するリクエストのJSONL（各行に \"message\" と任意の \"offset\"）")
+    parser.add_argument("--realtime", action="store_true", help="concurrentシナリオでトレースのoffsetどおりの時刻に送信する")
+    parser.add_argument("--notion-latency-ms", type=float, default=80, help="Notion APIの1呼び出しあたりの待ち時間")
+    parser.add_argument("--embedding-latency-ms", type=float, default=30, help="エンベディングAPIの1呼び出しあたりの待ち時間")
+    parser.add_argument("--completion-latency-ms", type=float, default=500, help="回答生成APIの待ち時間")
+    parser.add_argument("--notion-rate", type=float, default=None, help="Notion APIのレート制限（1秒あたりの呼び出し数、省略時はアプリの設定）")
+    parser.add_argument("--output", default=None, help="結果を保存するJSONファイル（次回の--baselineに使える）")
+    parser.add_argument("--baseline", default=None, help="比較する基準値のJSONファイル")
+    parser.add_argument("--log-level", default="WARNING", help="アプリのログレベル")
+    args = parser.parse_args()
+    unknown = [scenario for scenario in args.scenarios if scenario not in SCENARIOS]
+    if unknown:
+        parser.error(f"不明なシナリオ: {', '.join(unknown)}")
+    scenarios = args.scenarios or SCENARIOS
+
+    # 環境変数を設定してからアプリのモジュールを読み込む
+    configure_environment(args.log_level, args.notion_rate)
+    fake_openai, fake_notion = install_fakes(
+        args.pages,
+        args.notion_latency_ms / 1000,
+        args.embedding_latency_ms / 1000,
+        args.completion_latency_ms / 1000
+    )
+
+    runner = BenchmarkRunner(load_trace(args.trace), args.requests, args.concurrency, args.realtime)
+    results = asyncio.run(runner.run(scenarios))
+
+    print("\n".join(format_results(results)))
+    print(f"外部APIの呼び出し回数: OpenAI {fake_openai.calls}, Notion {fake_notion.calls}")
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        print("\n基準値との比較:")
+        print("\n".join(compare_with_baseline(results, baseline)))
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"config": {**vars(args), "scenarios": scenarios}, "scenarios": results}, f, ensure_ascii=False, indent=2)
+        print(f"\n結果を {args.output} に保存しました")
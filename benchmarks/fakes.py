@@ -0,0 +1,184 @@
+import asyncio
+import hashlib
+import random
+from types import SimpleNamespace
+from typing import Any, AsyncIterator, Dict, List, Optional
+import numpy as np
+
+# 合成データの話題（タイトルと本文に使う）
+TOPICS = [
+    "休暇申請", "経費精算", "VPN接続", "勤怠管理", "入社手続き", "退職手続き", "社内Wiki", "セキュリティ研修",
+    "パスワード変更", "備品購入", "出張申請", "評価面談", "リモートワーク", "会議室予約", "名刺発注", "健康診断",
+    "育児休業", "副業申請", "オンボーディング", "障害対応", "デプロイ手順", "コードレビュー", "採用面接", "社内イベント"
+]
+ACTIONS = ["申請方法", "手順", "注意点", "締め切り", "問い合わせ先", "よくある質問", "必要な書類", "承認フロー"]
+
+def fake_embedding(text: str, dimensions: int = 256) -> List[float]:
+    """
+    文字バイグラムのハッシュから決定的なエンベディングを作成
+    同じテキストには常に同じベクトルを返し、文字の重なりが多いテキストほど類似度が高くなる
+
+    Args:
+        text: 対象のテキスト
+        dimensions: 次元数
+
+    Returns:
+        正規化済みのベクトル
+    """
+    vector = np.zeros(dimensions, dtype=np.float32)
+    compact = "".join(text.split())
+    for i in range(max(len(compact) - 1, 1)):
+        digest = hashlib.blake2b(compact[i:i + 2].encode("utf-8"), digest_size=8).digest()
+        vector[int.from_bytes(digest, "little") % dimensions] += 1.0
+    norm = np.linalg.norm(vector)
+    return (vector / norm if norm > 0 else vector).tolist()
+
+class FakeOpenAI:
+    """
+    OpenAI APIの代わりに使うクライアント（AsyncOpenAIのうちアプリが使う部分のみ）
+    エンベディングは決定的に作成し、回答生成は指定した待ち時間の後に固定の文を返す
+    """
+    def __init__(self, embedding_latency: float = 0.03, completion_latency: float = 0.5, stream_tokens: int = 20):
+        self.embedding_latency = embedding_latency
+        self.completion_latency = completion_latency
+        self.stream_tokens = stream_tokens
+        self.calls = {"embeddings": 0, "embedding_inputs": 0, "completions": 0}
+        self.embeddings = SimpleNamespace(create=self._create_embeddings)
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create_completion))
+
+    async def _create_embeddings(self, input: List[str], model: str, **kwargs) -> Any:
+        self.calls["embeddings"] += 1
+        self.calls["embedding_inputs"] += len(input)
+        await asyncio.sleep(self.embedding_latency)
+        return SimpleNamespace(data=[
+            SimpleNamespace(index=i, embedding=fake_embedding(text)) for i, text in enumerate(input)
+        ])
+
+    async def _create_completion(self, messages: List[Dict], stream: bool = False, **kwargs) -> Any:
+        self.calls["completions"] += 1
+        answer = f"ベンチマーク用の回答です（プロンプト {len(messages[-1]['content'])} 文字）"
+        if stream:
+            return self._stream(answer)
+        await asyncio.sleep(self.completion_latency)
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=answer))])
+
+    async def _stream(self, answer: str) -> AsyncIterator[Any]:
+        size = max(1, len(answer) // self.stream_tokens)
+        delay = self.completion_latency / self.stream_tokens
+        for i in range(0, len(answer), size):
+            await asyncio.sleep(delay)
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=answer[i:i + size]))])
+
+    async def close(self) -> None:
+        pass
+
+def rich_text(text: str) -> List[Dict]:
+    return [{"type": "text", "plain_text": text, "text": {"content": text}}]
+
+class FakeNotion:
+    """
+    Notion APIの代わりに使うクライアント（AsyncClientのうちアプリが使う部分のみ）
+    合成したデータベースのページと入れ子のブロックを、APIと同じくカーソルによるページ分割で返す
+    フィルタと並び順の指定は無視して全ページを返す
+    """
+    def __init__(
+        self,
+        pages: int = 200,
+        latency: float = 0.08,
+        page_size: int = 100,
+        block_page_size: int = 20,
+        seed: int = 0
+    ):
+        self.latency = latency
+        self.page_size = page_size
+        self.block_page_size = block_page_size
+        self.calls = {"databases.query": 0, "blocks.children.list": 0, "pages.retrieve": 0}
+        self._pages: List[Dict] = []
+        self._pages_by_id: Dict[str, Dict] = {}
+        self._children: Dict[str, List[Dict]] = {}
+        self._build(pages, random.Random(seed))
+
+        self.databases = SimpleNamespace(query=self._query_database)
+        self.blocks = SimpleNamespace(children=SimpleNamespace(list=self._list_children))
+        self.pages = SimpleNamespace(retrieve=self._retrieve_page)
+
+    @property
+    def page_titles(self) -> List[str]:
+        return [page["properties"]["名前"]["title"][0]["plain_text"] for page in self._pages]
+
+    def _build(self, page_count: int, rng: random.Random) -> None:
+        for i in range(page_count):
+            topic = TOPICS[i % len(TOPICS)]
+            title = f"{topic}の{ACTIONS[(i // len(TOPICS)) % len(ACTIONS)]} #{i}"
+            page_id = f"page-{i:05d}"
+            self._pages.append({
+                "object": "page",
+                "id": page_id,
+                "url": f"https://www.notion.so/{page_id}",
+                "last_edited_time": f"2026-01-{1 + i % 28:02d}T00:00:00.000Z",
+                "archived": False,
+                "properties": {
+                    "名前": {"type": "title", "title": rich_text(title)},
+                    "カテゴリ": {"type": "select", "select": {"name": topic}},
+                    "概要": {"type": "rich_text", "rich_text": rich_text(f"{topic}に関する社内ルールと手順をまとめたページです。")}
+                }
+            })
+            self._pages_by_id[page_id] = self._pages[-1]
+            self._children[page_id] = self._build_blocks(page_id, topic, rng)
+
+    def _build_blocks(self, parent_id: str, topic: str, rng: random.Random, depth: int = 0) -> List[Dict]:
+        blocks = []
+        for section in range(rng.randint(2, 4) if depth == 0 else 2):
+            block_id = f"{parent_id}-{section}"
+            action = rng.choice(ACTIONS)
+            if depth == 0:
+                blocks.append(self._block(f"{block_id}-h", "heading_2", f"{topic}の{action}"))
+            sentences = "".join(
+                f"{topic}の{rng.choice(ACTIONS)}については担当部署に確認してください。" for _ in range(rng.randint(3, 12))
+            )
+            blocks.append(self._block(f"{block_id}-p", "paragraph", sentences))
+
+            # 箇条書きには子ブロックを持たせて入れ子の取得を再現する
+            has_children = depth < 2 and rng.random() < 0.5
+            item = self._block(f"{block_id}-li", "bulleted_list_item", f"{action}のチェック項目", has_children)
+            blocks.append(item)
+            if has_children:
+                self._children[item["id"]] = self._build_blocks(item["id"], topic, rng, depth + 1)
+
+            if depth == 0 and rng.random() < 0.3:
+                blocks.append(self._block(f"{block_id}-code", "code", f"echo '{topic} {action}'", language="bash"))
+        return blocks
+
+    def _block(self, block_id: str, block_type: str, text: str, has_children: bool = False, **extra) -> Dict:
+        return {
+            "object": "block",
+            "id": block_id,
+            "type": block_type,
+            "has_children": has_children,
+            block_type: {"rich_text": rich_text(text), **extra}
+        }
+
+    def _paginate(self, items: List[Dict], page_size: int, start_cursor: Optional[str]) -> Dict:
+        start = int(start_cursor or 0)
+        end = start + page_size
+        return {
+            "object": "list",
+            "results": items[start:end],
+            "has_more": end < len(items),
+            "next_cursor": str(end) if end < len(items) else None
+        }
+
+    async def _query_database(self, database_id: str, page_size: int = 100, start_cursor: Optional[str] = None, **kwargs) -> Dict:
+        self.calls["databases.query"] += 1
+        await asyncio.sleep(self.latency)
+        return self._paginate(self._pages, min(page_size, self.page_size), start_cursor)
+
+    async def _list_children(self, block_id: str, page_size: int = 100, start_cursor: Optional[str] = None, **kwargs) -> Dict:
+        self.calls["blocks.children.list"] += 1
+        await asyncio.sleep(self.latency)
+        return self._paginate(self._children.get(block_id, []), min(page_size, self.block_page_size), start_cursor)
+
+    async def _retrieve_page(self, page_id: str, **kwargs) -> Dict:
+        self.calls["pages.retrieve"] += 1
+        await asyncio.sleep(self.latency)
+        return self._pages_by_id[page_id]
@@ -0,0 +1,251 @@
+import os
+import json
+import time
+import asyncio
+import tempfile
+from typing import Any, Dict, List, Optional, Tuple
+import numpy as np
+from benchmarks.fakes import ACTIONS, TOPICS, FakeNotion, FakeOpenAI
+
+# 実行できるシナリオ
+SCENARIOS = ["cache_hit", "cache_miss", "ingestion", "concurrent"]
+# 基準値と比較する指標（Trueは大きいほど良い指標）
+COMPARED_METRICS = {"p50_ms": False, "p95_ms": False, "p99_ms": False, "rps": True}
+
+def configure_environment(log_level: str = "WARNING", notion_rate: Optional[float] = None) -> None:
+    """
+    アプリのモジュールを読み込む前に、外部サービスやファイルに依存しない設定にする
+    （明示的に設定された環境変数は上書きしない）
+    """
+    state_dir = tempfile.mkdtemp(prefix="devbot-bench-")
+    defaults = {
+        "OPENAI_API_KEY": "benchmark",
+        "NOTION_API_KEY": "benchmark",
+        "NOTION_DATABASE_ID": "benchmark-database",
+        "EMBEDDING_CACHE_PATH": "",
+        "NOTION_SYNC_STATE_PATH": os.path.join(state_dir, "notion_sync_state.json"),
+        "LOG_LEVEL": log_level,
+        "ANONYMIZED_TELEMETRY": "False"
+    }
+    for key, value in defaults.items():
+        os.environ.setdefault(key, value)
+    # Notion APIのレート制限は指定された場合のみ変更する（省略時はアプリの設定どおり）
+    if notion_rate is not None:
+        os.environ["NOTION_RATE_LIMIT"] = str(notion_rate)
+        os.environ["NOTION_RATE_BURST"] = str(max(notion_rate, 1))
+
+def install_fakes(
+    pages: int,
+    notion_latency: float,
+    embedding_latency: float,
+    completion_latency: float
+) -> Tuple[FakeOpenAI, FakeNotion]:
+    """
+    ChromaDBをプロセス内のクライアントに、OpenAIとNotionのクライアントを代替クライアントに差し替える
+    """
+    import chromadb
+
+    # app.dbの読み込み時に作られるHttpClientをプロセス内のクライアントに置き換える
+    ephemeral_client = chromadb.EphemeralClient()
+    chromadb.HttpClient = lambda *args, **kwargs: ephemeral_client
+
+    import app.utils.openai as openai_utils
+    from app.services.notion import notion
+
+    fake_openai = FakeOpenAI(embedding_latency=embedding_latency, completion_latency=completion_latency)
+    fake_notion = FakeNotion(pages=pages, latency=notion_latency)
+    openai_utils.openai_client = fake_openai
+    notion.client = fake_notion
+    return fake_openai, fake_notion
+
+def reset_state() -> None:
+    """
+    シナリオごとに保存済みのチャンクとプロセス内のキャッシュを空にする
+    """
+    from app import db
+    from app.utils.answer_cache import answer_cache
+    from app.utils.embedding_cache import embedding_cache
+    from app.utils.lexical_index import lexical_indexes
+
+    for collection in db.client.list_collections():
+        name = getattr(collection, "name", collection)
+        db.client.delete_collection(name)
+        db.collection_registry.invalidate(name)
+        lexical_indexes.invalidate(name)
+    answer_cache.clear()
+    embedding_cache.clear_memory()
+
+def load_trace(path: Optional[str]) -> List[Dict[str, Any]]:
+    """
+    再生するリクエストを読み込む
+    JSONLの各行は {"message": 質問, "offset": 開始からの秒数（省略可）} の形式
+    パスを省略した場合は合成データの話題から質問を作る
+    """
+    if not path:
+        return [
+            {"message": f"{topic}の{action}を教えてください"}
+            for action in ACTIONS
+            for topic in TOPICS
+        ]
+
+    trace = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if record.get("message"):
+                trace.append({"message": record["message"], "offset": record.get("offset")})
+    if not trace:
+        raise ValueError(f"{path} に再生できるリクエストがありません（各行に \"message\" が必要です）")
+    return trace
+
+def summarize(latencies: List[float], errors: int, duration: float, **extra: Any) -> Dict[str, Any]:
+    """
+    レイテンシの分布とスループットを集計
+    """
+    values = np.asarray(latencies, dtype=np.float64) * 1000
+    summary = {
+        "count": len(latencies),
+        "errors": errors,
+        "p50_ms": float(np.percentile(values, 50)) if len(values) else 0.0,
+        "p95_ms": float(np.percentile(values, 95)) if len(values) else 0.0,
+        "p99_ms": float(np.percentile(values, 99)) if len(values) else 0.0,
+        "mean_ms": float(values.mean()) if len(values) else 0.0,
+        "rps": len(latencies) / duration if duration > 0 else 0.0
+    }
+    summary.update(extra)
+    return summary
+
+class BenchmarkRunner:
+    """
+    プロセス内のアプリに対してシナリオごとにリクエストを送り、レイテンシとスループットを計測する
+    """
+    def __init__(self, trace: List[Dict[str, Any]], requests: int, concurrency: int, realtime: bool = False):
+        self.trace = trace
+        self.requests = requests
+        self.concurrency = concurrency
+        self.realtime = realtime
+
+    async def run(self, scenarios: List[str]) -> Dict[str, Dict[str, Any]]:
+        import httpx
+        from app.main import app
+        from app.services.refresh import refresh
+
+        results = {}
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=None) as client:
+            for scenario in scenarios:
+                reset_state()
+                results[scenario] = await getattr(self, scenario)(client)
+                await refresh.stop()
+        return results
+
+    def messages(self, count: int) -> List[Dict[str, Any]]:
+        return [self.trace[i % len(self.trace)] for i in range(count)]
+
+    async def send(self, client, message: str) -> Tuple[float, bool]:
+        started_at = time.perf_counter()
+        try:
+            response = await client.post("/api/chat/notion", json={"message": message})
+            ok = response.status_code == 200 and response.json().get("success", False)
+        except Exception:
+            ok = False
+        return time.perf_counter() - started_at, ok
+
+    async def cache_hit(self, client) -> Dict[str, Any]:
+        """
+        回答キャッシュに載った質問を繰り返す
+        """
+        warm = self.messages(min(self.requests, 10))
+        for record in warm:
+            await self.send(client, record["message"])
+
+        latencies, errors = [], 0
+        started_at = time.perf_counter()
+        for i in range(self.requests):
+            latency, ok = await self.send(client, warm[i % len(warm)]["message"])
+            latencies.append(latency)
+            errors += not ok
+        return summarize(latencies, errors, time.perf_counter() - started_at)
+
+    async def cache_miss(self, client) -> Dict[str, Any]:
+        """
+        保存済みの情報がない状態から、Notionの検索・保存・回答生成までを1件ずつ計測する
+        """
+        latencies, errors = [], 0
+        started_at = time.perf_counter()
+        for record in self.messages(self.requests):
+            reset_state()
+            latency, ok = await self.send(client, record["message"])
+            latencies.append(latency)
+            errors += not ok
+        return summarize(latencies, errors, time.perf_counter() - started_at)
+
+    async def ingestion(self, client) -> Dict[str, Any]:
+        """
+        データベース全体をページインデックスに取り込む
+        """
+        from app.services.ingest import ingest
+
+        started_at = time.perf_counter()
+        stats = await ingest.ingest_database(force=True)
+        duration = time.perf_counter() - started_at
+        return summarize(
+            [duration],
+            stats["failed"],
+            duration,
+            pages=stats["pages"],
+            chunks=stats["chunks"],
+            pages_per_second=stats["pages"] / duration if duration > 0 else 0.0
+        )
+
+    async def concurrent(self, client) -> Dict[str, Any]:
+        """
+        同時実行数を制限しながらリクエストを送る（キャッシュのヒットとミスが混在する）
+        realtimeの場合はトレースのoffsetどおりの時刻に送る
+        """
+        semaphore = asyncio.Semaphore(self.concurrency)
+        latencies, errors = [], 0
+        started_at = time.perf_counter()
+
+        async def worker(record: Dict[str, Any]) -> None:
+            nonlocal errors
+            if self.realtime and record.get("offset") is not None:
+                await asyncio.sleep(max(0.0, started_at + float(record["offset"]) - time.perf_counter()))
+            async with semaphore:
+                latency, ok = await self.send(client, record["message"])
+            latencies.append(latency)
+            errors += not ok
+
+        await asyncio.gather(*[worker(record) for record in self.messages(self.requests)])
+        return summarize(latencies, errors, time.perf_counter() - started_at, concurrency=self.concurrency)
+
+def compare_with_baseline(results: Dict[str, Dict[str, Any]], baseline: Dict[str, Any]) -> List[str]:
+    """
+    基準値との差分を表示用の行にする
+    """
+    lines = []
+    for scenario, summary in results.items():
+        previous = baseline.get("scenarios", {}).get(scenario)
+        if not previous:
+            continue
+        parts = []
+        for metric, higher_is_better in COMPARED_METRICS.items():
+            before, after = previous.get(metric), summary.get(metric)
+            if not before or after is None:
+                continue
+            change = (after - before) / before * 100
+            improved = change > 0 if higher_is_better else change < 0
+            parts.append(f"{metric} {before:.1f} → {after:.1f} ({change:+.1f}%{' 改善' if improved else ''})")
+        lines.append(f"{scenario}: " + ", ".join(parts))
+    return lines
+
+def format_results(results: Dict[str, Dict[str, Any]]) -> List[str]:
+    lines = [f"{'シナリオ':<12} {'件数':>6} {'失敗':>6} {'p50(ms)':>10} {'p95(ms)':>10} {'p99(ms)':>10} {'req/s':>8}"]
+    for scenario, summary in results.items():
+        lines.append(
+            f"{scenario:<12} {summary['count']:>6} {summary['errors']:>6} "
+            f"{summary['p50_ms']:>10.1f} {summary['p95_ms']:>10.1f} {summary['p99_ms']:>10.1f} {summary['rps']:>8.2f}"
+        )
+    return lines
@@ -0,0 +1,31 @@
+import argparse
+import asyncio
+from dotenv import load_dotenv
+from app.logger import setup_logger
+
+if __name__ == "__main__":
+    load_dotenv()
+    setup_logger()
+
+    parser = argparse.ArgumentParser(description="Notionデータベースをページインデックスに取り込みます")
+    parser.add_argument("--database-id", default=None, help="取り込むデータベースID（省略時はNOTION_DATABASE_ID）")
+    parser.add_argument("--full", action="store_true", help="差分同期ではなくデータベース全体を走査する")
+    parser.add_argument("--force", action="store_true", help="最終編集日時に関わらず全ページを再取り込みする（--fullを含む）")
+    args = parser.parse_args()
+
+    # 環境変数を読み込んでからサービスを初期化する
+    from app.services.ingest import ingest
+
+    from app.utils.embedding_cache import embedding_cache
+
+    async def run():
+        try:
+            if args.full or args.force:
+                return await ingest.ingest_database(args.database_id, force=args.force)
+            return await ingest.sync_database(args.database_id)
+        finally:
+            # エンベディングキャッシュのディスクへの書き込みを終えてから終了する
+            await embedding_cache.flush()
+
+    stats = asyncio.run(run())
+    print(f"取り込み結果: {stats}")
@@ -1,9 +1,14 @@
-from fastapi import APIRouter
+import json
+from fastapi import APIRouter, HTTPException
+from starlette.background import BackgroundTask
+from fastapi.responses import JSONResponse, StreamingResponse
 from app.models import ChatRequest, NotionChatResponse
 from openai import OpenAI
 from typing import Optional, List, Dict, Any
 from pydantic import BaseModel
 from app.services import notion, chat
+from app.services.chat import BATCH_MAX_REQUESTS
+from app.utils.admission import AdmissionRejected, admission_controller
 
 router = APIRouter()
 
@@ -24,9 +29,94 @@ async def notion_chat(request: ChatRequest):
         result = await chat.generate_response_with_notion(request.message)
         return NotionChatResponse(**result)
 
+    except AdmissionRejected as e:
+        return rejected_response(e)
     except Exception as e:
         return NotionChatResponse(
             message="エラーが発生しました",
             success=False,
             error=str(e)
-        )
\ No newline at end of file
+        )
+
+"""
+複数の質問にNotionの情報からまとめて回答（結果は質問と同じ順序で返す）
+"""
+@router.post("/chat/notion/batch", response_model=List[NotionChatResponse])
+async def notion_chat_batch(requests: List[ChatRequest]):
+    if len(requests) > BATCH_MAX_REQUESTS:
+        raise HTTPException(status_code=413, detail=f"一度に送信できる質問は{BATCH_MAX_REQUESTS}件までです")
+
+    responses = [
+        NotionChatResponse(
+            message="どうしましたか？何か質問があれば仰ってください。",
+            success=False,
+            error="Empty Message"
+        ) if not request.message else None
+        for request in requests
+    ]
+
+    user_queries = [request.message for request in requests if request.message]
+    if user_queries:
+        try:
+            results = iter(await chat.generate_batch_responses(user_queries))
+            responses = [response or NotionChatResponse(**next(results)) for response in responses]
+        except AdmissionRejected as e:
+            return rejected_response(e)
+        except Exception as e:
+            error_response = NotionChatResponse(message="エラーが発生しました", success=False, error=str(e))
+            responses = [response or error_response for response in responses]
+
+    return responses
+
+"""
+Notionから情報を取得して回答（Server-Sent Eventsでストリーミング）
+metadata → token（複数回） → done の順にイベントを送信し、失敗時は error を送信する
+"""
+@router.post("/chat/notion/stream")
+async def notion_chat_stream(request: ChatRequest):
+    # 混雑している場合はストリーミングを始める前に拒否する
+    admission = None
+    if request.message:
+        try:
+            admission = await admission_controller.admit()
+        except AdmissionRejected as e:
+            return rejected_response(e)
+
+    async def event_stream():
+        if not request.message:
+            yield format_sse({
+                "event": "error",
+                "data": {"message": "どうしましたか？何か質問があれば仰ってください。", "error": "Empty Message"}
+            })
+            return
+
+        async for event in chat.stream_response_with_notion(request.message, admission):
+            yield format_sse(event)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        # ストリーミングが始まる前に切断された場合も実行枠を返す（二重に返しても問題ない）
+        background=BackgroundTask(admission.release) if admission is not None else None
+    )
+
+"""
+イベントをServer-Sent Eventsの形式に変換
+"""
+def format_sse(event: Dict[str, Any]) -> str:
+    return f"event: {event['event']}\ndata: {json.dumps(event['data'], ensure_ascii=False)}\n\n"
+
+"""
+混雑のため受け付けなかったリクエストへの応答（Retry-Afterヘッダで再試行までの目安を返す）
+"""
+def rejected_response(error: AdmissionRejected) -> JSONResponse:
+    return JSONResponse(
+        status_code=error.status_code,
+        content=NotionChatResponse(
+            message="混雑しています。しばらく経ってからもう一度お試しください。",
+            success=False,
+            error=str(error)
+        ).model_dump(),
+        headers={"Retry-After": str(error.retry_after)}
+    )